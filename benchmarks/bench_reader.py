@@ -0,0 +1,109 @@
+"""Output throughput of the clang-repl output reader, byte-at-a-time (before) vs chunked (after).
+
+A child process writes ``--mb`` megabytes of lines followed by the ``clang-repl> `` prompt and the
+reader consumes it the way ``Shell._do_execute`` does for the last line of a cell.
+
+    python benchmarks/bench_reader.py --mb 4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'clang_repl_kernel'))
+
+from clang_repl_kernel.reader import ChunkReader, LineSender  # noqa: E402
+
+BANNER = 'clang-repl> '
+BANNER_CONT = 'clang-repl...   '
+
+CHILD = """
+import sys
+line = b'x' * {width} + b'\\n'
+out = sys.stdout.buffer
+for _ in range({count}):
+    out.write(line)
+out.write(b'clang-repl> ')
+out.flush()
+"""
+
+
+def spawn(total_bytes, width):
+    count = max(1, total_bytes // (width + 1))
+    process = subprocess.Popen([sys.executable, '-c', CHILD.format(width=width, count=count)],
+                               stdout=subprocess.PIPE)
+    return process, count * (width + 1)
+
+
+def legacy_read(process, send_func):
+    # the loop Shell._do_execute used before the chunked reader
+    banner_bytes = BANNER.encode('utf-8')
+    outs = bytearray()
+    last_newline = None
+    while process.returncode is None:
+        stdout_data = process.stdout.read(1)
+        outs += stdout_data
+        if len(stdout_data) == 0:
+            return
+        if len(outs) >= len(banner_bytes):
+            banner_part = outs[len(outs) - len(banner_bytes):]
+            if banner_part == banner_bytes:
+                decoded = str(outs, 'utf-8')
+                decoded = decoded[:decoded.rfind(BANNER)]
+                if len(decoded) > 0:
+                    send_func(decoded)
+                break
+        if outs[-1] == 0xA:
+            decoded = str(outs, 'utf-8')
+            if last_newline is not None:
+                decoded = last_newline + decoded
+            if decoded.endswith('\r\n'):
+                last_newline = '\r\n'
+                decoded = decoded[:-2]
+            else:
+                last_newline = '\n'
+                decoded = decoded[:-1]
+            if len(decoded) > 0:
+                send_func(decoded)
+            outs = bytearray()
+
+
+def chunked_read(process, send_func):
+    reader = ChunkReader(process.stdout.fileno(), [BANNER, BANNER_CONT])
+    reader.read_until_prompt(LineSender(send_func))
+
+
+def measure(read_func, total_bytes, width):
+    process, produced = spawn(total_bytes, width)
+    lines = [0]
+
+    def send_func(msg):
+        lines[0] += 1
+
+    start = time.perf_counter()
+    read_func(process, send_func)
+    elapsed = time.perf_counter() - start
+    process.wait()
+    assert lines[0] == produced // (width + 1), (lines[0], produced)
+    return produced, elapsed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--mb', type=float, default=2.0, help="Megabytes of output per run")
+    ap.add_argument('--width', type=int, default=79, help="Characters per output line")
+    args = ap.parse_args(argv)
+    total_bytes = int(args.mb * 1024 * 1024)
+
+    results = {}
+    for name, read_func in [('before (read(1))', legacy_read), ('after (chunked)', chunked_read)]:
+        produced, elapsed = measure(read_func, total_bytes, args.width)
+        results[name] = produced / elapsed
+        print(f"{name:18s} {produced / 1e6:8.2f} MB in {elapsed:7.3f} s  {produced / elapsed / 1e6:9.2f} MB/s")
+    before, after = results.values()
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""Benchmarks of the REPL drivers: startup, round-trip latency, multi-line cells and output throughput.
+
+Both ``clang_repl_kernel.kernel.Shell`` and ``shell_echo_kernel.kernel.Shell`` are measured, either against the
+fake clang-repl shipped with clang_repl_kernel (``--backend fake``, the default, needs no LLVM) or against a real
+binary (``--backend real``). The results are written as JSON so two commits can be compared:
+
+    python benchmarks/bench_repl.py --output before.json
+    git checkout <other commit>
+    python benchmarks/bench_repl.py --output after.json --compare before.json
+
+With the real backend the clang target uses the installed toolchain, or ``--repl PATH``; the echo target needs
+``--echo-repl PATH`` (a build of shell_echo_kernel/echo.cpp) and is skipped otherwise.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'clang_repl_kernel'))
+sys.path.insert(0, os.path.join(ROOT, 'shell_echo_kernel'))
+
+from clang_repl_kernel import fake_repl  # noqa: E402
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'p95': ordered[int(0.95 * (len(ordered) - 1))],
+        'mean': statistics.fmean(ordered),
+    }
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+class ClangTarget:
+    name = 'clang_repl_kernel'
+
+    def __init__(self, backend, repl=None):
+        self.backend = backend
+        self.repl = repl
+        self.kernel = None
+
+    def make_shell(self):
+        if self.backend == 'fake':
+            return fake_repl.make_shell()
+        if self.kernel is None:
+            from clang_repl_kernel import ClangReplKernel
+            # the kernel sets up the environment of clang-repl the same way it does in a notebook
+            ClangReplKernel.ClangReplKernel_InTest = True
+            self.kernel = ClangReplKernel()
+            if self.repl is not None:
+                self.kernel.my_shell._prog, self.kernel.my_shell.tool_found = self.repl, True
+            self.kernel.my_shell.prog()
+        return self.kernel._create_shell()
+
+    def start(self):
+        shell = self.make_shell()
+        shell.run()
+        return shell
+
+    @staticmethod
+    def execute(shell, code):
+        return shell.do_execute_sync(code)
+
+    @staticmethod
+    def stop(shell):
+        shell.kill()
+
+    @staticmethod
+    def cell(lines):
+        # Shell.split_command adds the line continuations
+        return '\n'.join(lines)
+
+    def prepare_output(self, shell):
+        if self.backend == 'real':
+            self.execute(shell, '#include <iostream>')
+
+    def output_cell(self, count):
+        if self.backend == 'fake':
+            return 'lines(%d);' % count
+        return 'for (int i = 0; i < %d; ++i) std::cout << "line " << i << "\\n"; std::cout << std::flush;' % count
+
+
+class EchoTarget:
+    name = 'shell_echo_kernel'
+
+    def __init__(self, backend, repl=None):
+        self.backend = backend
+        self.repl = repl
+        self.wrapper_dir = None
+
+    def program(self):
+        if self.backend == 'real':
+            return self.repl
+        if self.wrapper_dir is None:
+            # this Shell starts the program without arguments, a wrapper passes the continuation prompt it expects
+            self.wrapper_dir = tempfile.mkdtemp(prefix='bench_repl_')
+            wrapper = os.path.join(self.wrapper_dir, 'fake-clang-repl')
+            with open(wrapper, 'w') as f:
+                f.write('#!/bin/sh\nexec %s "$@"\n' % subprocess.list2cmdline(
+                    [sys.executable, fake_repl.__file__, '--prompt-cont', 'clang-repl... ']))
+            os.chmod(wrapper, 0o755)
+        return os.path.join(self.wrapper_dir, 'fake-clang-repl')
+
+    def start(self):
+        from shell_echo_kernel.kernel import Shell
+        shell = Shell()
+        shell._prog = self.program()
+        shell.run()
+        return shell
+
+    @staticmethod
+    def execute(shell, code):
+        outs = []
+        shell.do_execute(code, outs.append)
+        return '\n'.join(outs)
+
+    @staticmethod
+    def stop(shell):
+        shell.del_loop()
+
+    @staticmethod
+    def cell(lines):
+        # this Shell sends the lines as they are, the continuations must be in the cell
+        return '\\\n'.join(lines)
+
+    def prepare_output(self, shell):
+        pass
+
+    def output_cell(self, count):
+        if self.backend == 'fake':
+            return 'lines(%d);' % count
+        # the echo REPL prints a statement back, so a long statement is a long output
+        return self.cell(['line %d' % idx for idx in range(count)])
+
+
+def bench_target(target, args, log):
+    results = {}
+
+    samples = []
+    for _ in range(args.startup_runs):
+        elapsed, shell = timed(target.start)
+        samples.append(elapsed)
+        target.stop(shell)
+    results['startup'] = summarize(samples)
+    log('%-18s startup           median %8.2f ms' % (target.name, results['startup']['median'] * 1000))
+
+    shell = target.start()
+    try:
+        samples = [timed(target.execute, shell, 'int bench_rt_%d = %d;' % (idx, idx))[0]
+                   for idx in range(args.round_trips)]
+        results['round_trip'] = summarize(samples)
+        log('%-18s round trip        median %8.3f ms' % (target.name, results['round_trip']['median'] * 1000))
+
+        results['multi_line'] = {}
+        for count in args.line_counts:
+            samples = []
+            for run in range(args.repeat):
+                lines = ['int bench_ml_%d_%d_%d = %d;' % (count, run, idx, idx) for idx in range(count)]
+                samples.append(timed(target.execute, shell, target.cell(lines))[0])
+            summary = summarize(samples)
+            summary['per_line'] = summary['median'] / count
+            results['multi_line'][str(count)] = summary
+            log('%-18s %5d line cell   median %8.3f ms' % (target.name, count, summary['median'] * 1000))
+
+        target.prepare_output(shell)
+        samples, produced = [], 0
+        for _ in range(args.repeat):
+            elapsed, output = timed(target.execute, shell, target.output_cell(args.output_lines))
+            samples.append(elapsed)
+            produced = len(output.encode('utf-8'))
+            lines = output.count('\n') + 1
+        summary = summarize(samples)
+        summary['bytes'] = produced
+        summary['lines'] = lines
+        summary['mb_per_s'] = produced / summary['median'] / 1e6
+        summary['lines_per_s'] = lines / summary['median']
+        results['throughput'] = summary
+        log('%-18s output            %8.2f MB/s %10.0f lines/s' % (target.name, summary['mb_per_s'],
+                                                                   summary['lines_per_s']))
+    finally:
+        target.stop(shell)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    # the medians and rates are what two runs are compared on
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict) and 'median' not in value:
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, dict):
+            flat[name + '.median'] = value['median']
+            for rate in ('mb_per_s', 'lines_per_s'):
+                if rate in value:
+                    flat[name + '.' + rate] = value[rate]
+    return flat
+
+
+def compare(baseline, current, log):
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    log('%-50s %12s %12s %8s' % ('metric', 'baseline', 'current', 'ratio'))
+    for name in sorted(set(old) & set(new)):
+        ratio = new[name] / old[name] if old[name] else float('nan')
+        log('%-50s %12.6g %12.6g %7.2fx' % (name, old[name], new[name], ratio))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--backend', choices=['fake', 'real'], default='fake')
+    ap.add_argument('--target', choices=['clang', 'echo'], action='append',
+                    help="Shell to measure, may be repeated; both by default")
+    ap.add_argument('--repl', help="clang-repl binary for the real backend")
+    ap.add_argument('--echo-repl', help="echo REPL binary for the real backend of the echo target")
+    ap.add_argument('--startup-runs', type=int, default=3)
+    ap.add_argument('--round-trips', type=int, default=50)
+    ap.add_argument('--line-counts', type=int, nargs='+', default=[1, 10, 100, 1000])
+    ap.add_argument('--output-lines', type=int, default=100000)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--output', help="Write the JSON results here instead of stdout")
+    ap.add_argument('--compare', help="JSON results of an earlier run to compare with")
+    args = ap.parse_args(argv)
+
+    def log(line):
+        print(line, file=sys.stderr)
+
+    targets = []
+    for name in args.target or ['clang', 'echo']:
+        if name == 'clang':
+            targets.append(ClangTarget(args.backend, args.repl))
+        elif args.backend == 'real' and args.echo_repl is None:
+            log('shell_echo_kernel skipped, --echo-repl is needed with the real backend')
+        elif args.backend == 'fake' and os.name == 'nt':
+            log('shell_echo_kernel skipped, the fake backend needs a POSIX shell for its wrapper')
+        else:
+            targets.append(EchoTarget(args.backend, args.echo_repl))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'backend': args.backend,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'settings': {key: getattr(args, key) for key in
+                         ('startup_runs', 'round_trips', 'line_counts', 'output_lines', 'repeat')},
+        },
+        'results': {target.name: bench_target(target, args, log) for target in targets},
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), report, log)
+
+
+if __name__ == '__main__':
+    main()
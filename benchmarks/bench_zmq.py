@@ -0,0 +1,238 @@
+"""End to end execute request latency through jupyter_client and ZMQ, relative to the echo kernel.
+
+MyEchoKernel does no work, so its latency is the cost of ipykernel and ZMQ alone; what the other kernels add on
+top of it is their own layer. Every kernel is launched through a kernelspec and sent a mix of execute requests
+with small and large outputs, ``--concurrency`` of them in flight at a time. The latency of a request runs from
+sending it to the ``idle`` status that follows its last output.
+
+    python benchmarks/bench_zmq.py --mix small:200,large:20 --concurrency 1 4
+
+``--kernel LABEL`` picks the kernels: ``echo``, ``shell_echo`` and ``clang_repl`` run the packages of this
+repository, ``LABEL=SPEC`` runs the installed kernelspec SPEC instead. Kernels that cannot start, like
+clang_repl without a toolchain, are reported and skipped.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from jupyter_client.kernelspec import KernelSpecManager
+from jupyter_client.manager import KernelManager
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# label: (python module, package directory, kernelspec language)
+REPO_KERNELS = {
+    'echo': ('my_echo_kernel', 'echo_kernel', 'text'),
+    'shell_echo': ('shell_echo_kernel', 'shell_echo_kernel', 'text'),
+    'clang_repl': ('clang_repl_kernel', 'clang_repl_kernel', 'c++'),
+}
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def make_code(language, workload, idx, large_lines):
+    if language == 'c++':
+        if workload == 'small':
+            return 'std::cout << %d << std::endl;' % idx
+        return 'for (int i = 0; i < %d; ++i) std::cout << "line " << i << "\\n"; std::cout << std::flush;' % large_lines
+    # the echo kernels print the cell back, so the cell size is the output size
+    if workload == 'small':
+        return 'x%d' % idx
+    return '\\\n'.join('line %d' % line for line in range(large_lines))
+
+
+def repo_spec_manager(labels, spec_dir):
+    kernels_dir = os.path.join(spec_dir, 'kernels')
+    for label in labels:
+        module, package_dir, language = REPO_KERNELS[label]
+        os.makedirs(os.path.join(kernels_dir, 'bench_' + label))
+        spec = {
+            'argv': [sys.executable, '-m', module, '-f', '{connection_file}'],
+            'display_name': 'bench ' + label,
+            'language': language,
+            'env': {'PYTHONPATH': os.pathsep.join(filter(None, [os.path.join(ROOT, package_dir),
+                                                                os.environ.get('PYTHONPATH')]))},
+        }
+        with open(os.path.join(kernels_dir, 'bench_' + label, 'kernel.json'), 'w') as f:
+            json.dump(spec, f)
+    return KernelSpecManager(kernel_dirs=[kernels_dir])
+
+
+def start_kernel(spec_name, spec_manager, timeout):
+    km = KernelManager(kernel_name=spec_name, kernel_spec_manager=spec_manager)
+    km.start_kernel()
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kc.wait_for_ready(timeout=timeout)
+    except RuntimeError:
+        kc.stop_channels()
+        km.shutdown_kernel(now=True)
+        raise
+    return km, kc
+
+
+def run_requests(kc, codes, concurrency, timeout):
+    """Sends ``codes`` keeping ``concurrency`` requests in flight; returns per request latency and output size."""
+    sent = {}
+    done = {}
+    output_bytes = {}
+    queue = list(enumerate(codes))
+    queue.reverse()
+    deadline = time.monotonic() + timeout
+    while len(done) < len(codes):
+        while queue and len(sent) - len(done) < concurrency:
+            idx, code = queue.pop()
+            msg_id = kc.execute(code)
+            sent[msg_id] = (idx, time.perf_counter())
+            output_bytes[msg_id] = 0
+        try:
+            msg = kc.get_iopub_msg(timeout=1)
+        except Exception:
+            if time.monotonic() > deadline:
+                raise Exception('timed out with %d of %d requests done' % (len(done), len(codes)))
+            continue
+        msg_id = msg['parent_header'].get('msg_id')
+        if msg_id not in sent:
+            continue
+        if msg['msg_type'] == 'stream':
+            output_bytes[msg_id] += len(msg['content']['text'].encode('utf-8'))
+        elif msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+            done[msg_id] = time.perf_counter() - sent[msg_id][1]
+    # the replies on the shell channel are not needed, drop them
+    while True:
+        try:
+            kc.get_shell_msg(timeout=0.01)
+        except Exception:
+            break
+    results = [None] * len(codes)
+    for msg_id, (idx, _) in sent.items():
+        results[idx] = (done[msg_id], output_bytes[msg_id])
+    return results
+
+
+def bench_kernel(kc, language, args, log, label):
+    for idx in range(args.warmup):
+        run_requests(kc, [make_code(language, 'small', idx, args.large_lines)], 1, args.timeout)
+    results = {}
+    for concurrency in args.concurrency:
+        codes, kinds = [], []
+        for workload, count in args.mix:
+            for idx in range(count):
+                codes.append(make_code(language, workload, idx, args.large_lines))
+                kinds.append(workload)
+        started = time.perf_counter()
+        samples = run_requests(kc, codes, concurrency, args.timeout)
+        wall = time.perf_counter() - started
+        entry = {'requests_per_s': len(codes) / wall,
+                 'output_mb_per_s': sum(size for _, size in samples) / wall / 1e6}
+        for workload, _ in args.mix:
+            ordered = sorted(latency for (latency, _), kind in zip(samples, kinds) if kind == workload)
+            entry[workload] = {'n': len(ordered), 'p50': statistics.median(ordered),
+                               'p99': percentile(ordered, 0.99)}
+            log('%-12s c=%-3d %-6s p50 %9.3f ms  p99 %9.3f ms' % (
+                label, concurrency, workload, entry[workload]['p50'] * 1000, entry[workload]['p99'] * 1000))
+        log('%-12s c=%-3d %9.1f requests/s %8.2f MB/s' % (
+            label, concurrency, entry['requests_per_s'], entry['output_mb_per_s']))
+        results[str(concurrency)] = entry
+    return results
+
+
+def subtract_baseline(results, baseline):
+    # what each kernel adds over ipykernel and ZMQ alone
+    overhead = {}
+    for label, by_concurrency in results.items():
+        overhead[label] = {}
+        for concurrency, entry in by_concurrency.items():
+            base = baseline.get(concurrency, {})
+            overhead[label][concurrency] = {
+                workload: {key: entry[workload][key] - base[workload][key] for key in ('p50', 'p99')}
+                for workload in entry if isinstance(entry[workload], dict) and workload in base
+            }
+    return overhead
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        workload, _, count = part.partition(':')
+        if workload not in ('small', 'large'):
+            raise argparse.ArgumentTypeError('unknown workload: ' + workload)
+        mix.append((workload, int(count or 1)))
+    return mix
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--kernel', action='append',
+                    help="LABEL of a kernel of this repository or LABEL=SPEC of an installed kernelspec; "
+                         "echo, shell_echo and clang_repl by default")
+    ap.add_argument('--baseline', default='echo', help="Label of the kernel the others are compared with")
+    ap.add_argument('--mix', type=parse_mix, default=parse_mix('small:200,large:20'),
+                    help="Requests per workload, e.g. small:200,large:20")
+    ap.add_argument('--large-lines', type=int, default=1000, help="Output lines of a large request")
+    ap.add_argument('--concurrency', type=int, nargs='+', default=[1, 4], help="Requests in flight")
+    ap.add_argument('--warmup', type=int, default=5)
+    ap.add_argument('--startup-timeout', type=float, default=60)
+    ap.add_argument('--timeout', type=float, default=600, help="Seconds allowed for one request mix")
+    ap.add_argument('--output', help="Write the JSON results here instead of stdout")
+    args = ap.parse_args(argv)
+
+    def log(line):
+        print(line, file=sys.stderr)
+
+    kernels = []
+    for item in args.kernel or list(REPO_KERNELS):
+        label, _, spec = item.partition('=')
+        if not spec and label not in REPO_KERNELS:
+            ap.error('unknown kernel %s, use LABEL=SPEC for an installed kernelspec' % label)
+        kernels.append((label, spec or None))
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench_zmq_') as spec_dir:
+        repo_specs = repo_spec_manager([label for label, spec in kernels if spec is None], spec_dir)
+        installed_specs = KernelSpecManager()
+        for label, spec in kernels:
+            spec_manager = installed_specs if spec is not None else repo_specs
+            spec_name = spec if spec is not None else 'bench_' + label
+            language = spec_manager.get_kernel_spec(spec_name).language
+            try:
+                km, kc = start_kernel(spec_name, spec_manager, args.startup_timeout)
+            except Exception as e:
+                log('%-12s skipped, the kernel did not start: %s' % (label, e))
+                continue
+            try:
+                results[label] = bench_kernel(kc, language, args, log, label)
+            finally:
+                kc.stop_channels()
+                km.shutdown_kernel(now=True)
+
+    report = {
+        'settings': {'mix': args.mix, 'large_lines': args.large_lines, 'concurrency': args.concurrency},
+        'results': results,
+    }
+    if args.baseline in results:
+        report['over_baseline'] = subtract_baseline(results, results[args.baseline])
+        for label, by_concurrency in report['over_baseline'].items():
+            if label == args.baseline:
+                continue
+            for concurrency, entry in by_concurrency.items():
+                for workload, delta in entry.items():
+                    log('%-12s c=%-3s %-6s adds p50 %9.3f ms  p99 %9.3f ms over %s' % (
+                        label, concurrency, workload, delta['p50'] * 1000, delta['p99'] * 1000, args.baseline))
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
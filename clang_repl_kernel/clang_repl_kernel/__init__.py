@@ -2,6 +2,24 @@
 
 __version__ = '1.6.22'
 
-from .downloader import list, download, get_dll_or_download, is_done
+from .pool import ShellPool
 from .kernel import ClangReplKernel, PlatformPath, ClangReplConfig, find_prog,WinShell, BashShell, Shell, update_platform_system, CLANG_REPL_DEBUG
-from .install import install_bundles, is_installed_clang_exist
+from .extract import is_done
+
+# the installer pulls in requests, tqdm and jupyter_client, a kernel launch never needs them: import on first use
+_LAZY_ATTRIBUTES = {
+    'list': 'downloader',
+    'download': 'downloader',
+    'get_dll_or_download': 'downloader',
+    'install_bundles': 'install',
+    'is_installed_clang_exist': 'install',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    import importlib
+    value = getattr(importlib.import_module('.' + _LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
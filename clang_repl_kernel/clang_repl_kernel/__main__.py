@@ -1,12 +1,14 @@
 from ipykernel.kernelapp import IPKernelApp
-from . import ClangReplKernel, ClangReplConfig, install_bundles
+from . import ClangReplKernel, ClangReplConfig
 import sys
 
 if __name__ == '__main__':
     # when parameter has '--install-default-toolchain' then install the default toolchain
     if '--install-default-toolchain' in sys.argv:
-        print("Installing default toolchain...", ClangReplConfig.platform())
-        install_bundles(ClangReplConfig.platform())
+        from .install import install_bundles
+        platform_system = ClangReplConfig.get_default_platform()
+        print("Installing default toolchain...", platform_system)
+        install_bundles(platform_system)
         sys.exit(0)
     if '--interactive' in sys.argv:
         ClangReplKernel.interactive = True
@@ -25,7 +27,7 @@ if __name__ == '__main__':
                     code = code[:-1] + new_code
                 if code.strip() == '%quit':
                     break
-                kernel.do_execute(code, False, custom_send_response=send_response)
+                kernel.execute_code(code, send_response)
             except EOFError:
                 break
         sys.exit(0)
@@ -0,0 +1,28 @@
+import pytest
+
+from .fake_repl import make_shell
+
+
+@pytest.fixture
+def fake_shell():
+    """Factory of shells running the fake clang-repl with the given options, killed after the test."""
+    shells = []
+
+    def _make(*options, run=True):
+        a_shell = make_shell(*options)
+        shells.append(a_shell)
+        if run:
+            a_shell.run()
+        return a_shell
+
+    yield _make
+    for a_shell in shells:
+        a_shell.kill()
+
+
+@pytest.fixture(params=[True, False], ids=['batch', 'per_line'])
+def shell(request, fake_shell):
+    a_shell = fake_shell(run=False)
+    a_shell.batch_submit = request.param
+    a_shell.run()
+    return a_shell
@@ -0,0 +1,165 @@
+import re
+
+# comments, string and character literals and preprocessor lines carry no dependencies, except '#define NAME'
+_NOISE = re.compile(r'//[^\n]*|/\*.*?\*/|R"(?P<delim>[^(\s]*)\(.*?\)(?P=delim)"|"(?:\\.|[^"\\\n])*"'
+                    r"|'(?:\\.|[^'\\\n])*'|^[ \t]*#[^\n]*", re.DOTALL | re.MULTILINE)
+_DEFINE = re.compile(r'^[ \t]*#[ \t]*define[ \t]+([A-Za-z_]\w*)', re.MULTILINE)
+# includes, '%lib' lines and using-directives change the session without declaring a name
+_SESSION_STATE = re.compile(r'^[ \t]*[#%]|\busing[ \t]+namespace\b', re.MULTILINE)
+# what a cell that only prints uses; any other name may be a journaled variable or a header function that changes
+# the session, like 'a = 5;', 'v.push_back(3);' or 'std::srand(1);'
+OUTPUT_NAMES = {'std', 'cout', 'cerr', 'clog', 'endl', 'flush', 'printf', 'puts', 'pcout'}
+_TOKEN = re.compile(r'[A-Za-z_]\w*|::|->|[{}()\[\];,=<>*&.]|\S')
+
+TYPE_KEYWORDS = {
+    'auto', 'bool', 'char', 'char8_t', 'char16_t', 'char32_t', 'const', 'constexpr', 'consteval', 'constinit',
+    'double', 'extern', 'float', 'inline', 'int', 'long', 'mutable', 'short', 'signed', 'static', 'thread_local',
+    'unsigned', 'void', 'volatile', 'wchar_t',
+}
+KEYWORDS = TYPE_KEYWORDS | {
+    'alignas', 'alignof', 'and', 'asm', 'break', 'case', 'catch', 'class', 'co_await', 'co_return', 'co_yield',
+    'concept', 'const_cast', 'continue', 'decltype', 'default', 'delete', 'do', 'dynamic_cast', 'else', 'enum',
+    'explicit', 'export', 'false', 'for', 'friend', 'goto', 'if', 'namespace', 'new', 'noexcept', 'not', 'nullptr',
+    'operator', 'or', 'private', 'protected', 'public', 'register', 'reinterpret_cast', 'requires', 'return',
+    'sizeof', 'static_assert', 'static_cast', 'struct', 'switch', 'template', 'this', 'throw', 'true', 'try',
+    'typedef', 'typeid', 'typename', 'union', 'using', 'virtual', 'while',
+}
+_TAG_KEYWORDS = {'struct', 'class', 'union', 'enum', 'namespace', 'concept'}
+# what follows the name in a declaration: 'int a = 1;', 'int f(', 'S s{', 'int a[3];', 'int a, b;'
+_DECLARATOR_END = {'=', '(', '{', ';', '[', ','}
+
+
+def _is_name(token):
+    return token[0].isalpha() or token[0] == '_'
+
+
+def _enumerators(tokens, start):
+    names = []
+    expect_name = True
+    for token in tokens[start:]:
+        if token == '}':
+            break
+        if expect_name and _is_name(token):
+            names.append(token)
+        expect_name = token == ','
+    return names
+
+
+def _scan(code):
+    # (declared, functions, referenced); functions are the declared names followed by '(', overloads may share them
+    declared = set(_DEFINE.findall(code))
+    functions = set()
+    tokens = _TOKEN.findall(_NOISE.sub(' ', code))
+    referenced = set(token for token in tokens if _is_name(token) and token not in KEYWORDS)
+    depth = 0
+    declaration = False
+    for idx, token in enumerate(tokens):
+        if token in ('(', '{', '['):
+            depth += 1
+            continue
+        if token in (')', '}', ']'):
+            depth = max(0, depth - 1)
+            if depth == 0 and token == '}':
+                declaration = False
+            continue
+        if depth > 0:
+            continue
+        if token == ';':
+            declaration = False
+            continue
+        if not _is_name(token) or token in KEYWORDS:
+            continue
+        previous = tokens[idx - 1] if idx > 0 else None
+        following = tokens[idx + 1] if idx + 1 < len(tokens) else None
+        if previous == 'namespace' and idx > 1 and tokens[idx - 2] == 'using':
+            # 'using namespace std;' only makes names visible
+            continue
+        if previous in _TAG_KEYWORDS or (previous == 'using' and following == '='):
+            declared.add(token)
+            declaration = True
+            if previous == 'enum' and following == '{':
+                # the enumerators of an unscoped enum are namespace scope names too
+                declared.update(_enumerators(tokens, idx + 2))
+        elif following in _DECLARATOR_END and previous is not None and (
+                previous in TYPE_KEYWORDS or previous in ('>', '*', '&')
+                or (_is_name(previous) and previous not in KEYWORDS)
+                or (previous == ',' and declaration)):
+            declared.add(token)
+            declaration = True
+            if following == '(':
+                functions.add(token)
+    return declared, functions, referenced
+
+
+def analyze(code):
+    """Returns (declared, referenced): the names a cell defines at namespace scope and every name it uses.
+
+    A fast tokenizer instead of a parser: a declared name follows a type (a name, a type keyword, '>', '*' or '&')
+    or a struct/class/enum/namespace/using keyword, at brace and parenthesis depth 0.
+    """
+    declared, _, referenced = _scan(code)
+    return declared, referenced
+
+
+class DependencyIndex:
+    """Which journaled cells depend on which, by the names one declares and a later one references."""
+
+    def __init__(self, codes):
+        self.analyses = [analyze(code) for code in codes]
+        self.stateful = [_SESSION_STATE.search(code) is not None for code in codes]
+
+    def depends_on(self, later, earlier):
+        return len(self.analyses[later][1] & self.analyses[earlier][0]) > 0
+
+    def only_prints(self, idx):
+        return len(self.analyses[idx][0]) == 0 and not self.stateful[idx] and self.analyses[idx][1] <= OUTPUT_NAMES
+
+    def plan(self, edited, new_code):
+        """Cells to replay around the new code of cell ``edited``, as (before, after, skipped, dependents) index
+        lists.
+
+        Every cell that does more than print runs again, in its original order, so the new clang-repl ends in the
+        state the old one had: ``before`` the new code the earlier cells and the later ones the new code uses,
+        ``after`` it the other later cells. ``dependents`` are those of ``after`` that use the edited cell, directly
+        or through other cells; ``skipped`` the cells that only print.
+        """
+        old_declared = self.analyses[edited][0]
+        self.analyses[edited] = analyze(new_code)
+        # a dependent of a name the edit removed is still replayed, to show the error it now gets
+        self.analyses[edited] = (self.analyses[edited][0] | old_declared, self.analyses[edited][1])
+        dependents = set()
+        for later in range(edited + 1, len(self.analyses)):
+            if any(self.depends_on(later, earlier) for earlier in [edited] + sorted(dependents)):
+                dependents.add(later)
+        replayed = [idx for idx in range(len(self.analyses))
+                    if idx != edited and (idx in dependents or not self.only_prints(idx))]
+        # the new code may use a later cell that does not use it, that one runs before it
+        early = set()
+        pending = [edited]
+        while pending:
+            cell = pending.pop()
+            for later in replayed:
+                if later > edited and later not in early and later not in dependents and self.depends_on(cell, later):
+                    early.add(later)
+                    pending.append(later)
+        before = [idx for idx in replayed if idx < edited or idx in early]
+        after = [idx for idx in replayed if idx > edited and idx not in early]
+        skipped = [idx for idx in range(len(self.analyses)) if idx != edited and idx not in replayed]
+        return before, after, skipped, sorted(dependents)
+
+
+def find_edited(entries, code, cell_id):
+    """Index of the journaled cell the new code replaces: the same notebook cell, else the first cell that
+    declares a type or variable the new code declares again, which clang-repl would reject as a redefinition.
+    A shared function name is not taken for an edit, the new code may be an overload."""
+    if cell_id is not None:
+        for idx, entry in enumerate(entries):
+            if entry.cell_id == cell_id:
+                return idx
+    declared, functions, _ = _scan(code)
+    declared -= functions
+    for idx, entry in enumerate(entries):
+        old_declared, old_functions, _ = _scan(entry.code)
+        if len((old_declared - old_functions) & declared) > 0:
+            return idx
+    return None
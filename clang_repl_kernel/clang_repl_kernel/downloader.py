@@ -6,6 +6,11 @@ from tqdm import tqdm
 import stat
 import requests
 import platform
+import time
+from .fetch import fetch
+from .store import ToolchainStore
+from .extract import extract_parallel, write_marker, is_done
+from .lazy import LAZY_ZIP_NAME, LazyToolchain
 
 # The WebDAV URL to list files from
 url = "http://webdav.yoonhome.com/PublicShare/llvm/18.1.8"
@@ -48,80 +53,102 @@ def get_dll_or_download(platform, file_name, extract_dir):
     file_url = f"http://webdav.yoonhome.com/PublicShare/llvm_lib/{platform}/{file_name}"
     download_file = _download(extract_dir, file_name, file_url)
 
-def is_done(extract_dir):
-    done_file = os.path.join(extract_dir, "done")
-    return os.path.exists(done_file)
-
 def extract_with_progress(zip_path, extract_dir):
     print("Extracting", zip_path, "to", extract_dir)
-    print("Reading zip file... Please wait.")
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        # Get list of all file info objects in the zip
-        members = zip_ref.infolist()
-        # Iterate over each file with a progress bar
-        for member in tqdm(members, desc="Extracting", unit="file"):
-            zip_ref.extract(member, extract_dir)
-
-def download(file_name, extract_dir):
-    print("Downloading clang_repl binary from " + file_name)
+        total = len(zip_ref.infolist())
+    # members are extracted on a thread pool, executable bits are set as the files are written
+    with tqdm(total=total, desc="Extracting", unit="file") as progress_bar:
+        return extract_parallel(zip_path, extract_dir, progress=progress_bar.update)
+
+
+def print_timings(timings):
+    phases = ', '.join('%s %.2f s' % (phase, timings[phase])
+                       for phase in ('download', 'verify', 'list', 'directories', 'extract', 'link')
+                       if phase in timings)
+    print("Install phases: %s (%d files, %d bytes)" % (phases, timings.get('files', 0), timings.get('bytes', 0)))
+
+def _expected_sha256(file_url):
+    # a '<bundle>.sha256' next to the bundle is used to verify it when the server has one
+    try:
+        response = requests.get(file_url + '.sha256', auth=auth, timeout=30)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200 or len(response.text.split()) == 0:
+        return None
+    return response.text.split()[0]
+
+
+def download(file_name, extract_dir, store_dir=None, lazy=False, headers=(), trace=None, refresh=False):
+    """Installs the bundle ``file_name`` into ``extract_dir``. With ``store_dir`` the bundle is downloaded and
+    extracted once into that shared store and ``extract_dir`` links to it; ``refresh`` downloads it again even if
+    the store has a bundle of that name. With ``lazy`` the zip is kept in
+    ``extract_dir`` and only the tools, the libraries, the closure of ``headers`` and the files listed in the
+    ``trace`` file are extracted; the kernel extracts further headers as cells include them."""
     # URL of the file you want to download
     file_url = f"http://webdav.yoonhome.com/PublicShare/llvm/18.1.8/{file_name}"
+    if lazy:
+        # a lazy install writes into its own directory, it cannot be a link into the shared store
+        if os.path.islink(extract_dir):
+            os.remove(extract_dir)
+        print("Downloading clang_repl binary from " + file_name)
+        started = time.perf_counter()
+        download_file = _download(extract_dir, file_name, file_url)
+        download_time = time.perf_counter() - started
+        zip_path = os.path.join(extract_dir, LAZY_ZIP_NAME)
+        os.replace(download_file, zip_path)
+        timings = LazyToolchain(zip_path, extract_dir).install(headers, trace)
+        timings['download'] = download_time
+        print_timings(timings)
+        return zip_path
+
+    if store_dir is not None:
+        store = ToolchainStore(store_dir)
+        timings = {}
+        digest = None if refresh else store.lookup(file_name)
+        if digest is None:
+            print("Downloading clang_repl binary from " + file_name)
+            started = time.perf_counter()
+            download_file = _download(store.download_dir, file_name, file_url)
+            timings['download'] = time.perf_counter() - started
+            digest = store.add(download_file, file_name, _expected_sha256(file_url))
+            timings.update(store.timings)
+            os.remove(download_file)
+        else:
+            print("Using " + file_name + " from the toolchain store " + store_dir)
+        started = time.perf_counter()
+        store.link(digest, extract_dir)
+        timings['link'] = time.perf_counter() - started
+        print_timings(timings)
+        return None
+
+    print("Downloading clang_repl binary from " + file_name)
+    started = time.perf_counter()
     download_file = _download(extract_dir, file_name, file_url)
+    download_time = time.perf_counter() - started
 
     # extract the downloaded file
-    extract_with_progress(download_file, extract_dir)
+    timings = extract_with_progress(download_file, extract_dir)
+    timings['download'] = download_time
 
     # Remove the zip file
     os.remove(download_file)
 
-    # write done file
-    done_file = os.path.join(extract_dir, "done")
-    with open(done_file, "w") as f:
-        f.write("done")
-
-    if platform.system() != "Windows":
-        bin_dir = os.path.join(extract_dir, "bin")
-        if os.path.exists(bin_dir):
-            for root, dirs, files in os.walk(bin_dir):
-                for file in files:
-                    filepath = os.path.join(root, file)
-                    # Get current permissions.
-                    current_mode = os.stat(filepath).st_mode
-                    # Add executable bits for user, group, and others.
-                    new_mode = current_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
-                    os.chmod(filepath, new_mode)
+    # the done file goes last and in one step, is_done() never sees a half extracted toolchain
+    write_marker(os.path.join(extract_dir, "done"), "done")
+    print_timings(timings)
 
     return download_file
 
 
 def _download(extract_dir, file_name, file_url):
-    # Perform a GET request with streaming enabled (for large files)
-    response = requests.get(file_url, auth=auth, stream=True)
-    
-    # Ensure the extraction directory exists
-    if not os.path.exists(extract_dir):
-        os.makedirs(extract_dir)
-    
     download_file = os.path.join(extract_dir, file_name)
-
-    # delete the file if it already exists
-    if os.path.exists(download_file):
-        os.remove(download_file)
-    
-    if response.status_code == 200:
-        total_size = int(response.headers.get('content-length', 0))
-        # Open the file and wrap the write loop with tqdm for the progress bar
-        with open(download_file, "wb") as f, tqdm(
-            total=total_size, unit='B', unit_scale=True, desc=file_name
-        ) as progress_bar:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    progress_bar.update(len(chunk))
-        print("Download completed:", download_file)
-    else:
-        print("Failed to download file:", response.status_code)
-        print(response.text)
-    
+    # ranges are fetched in parallel, an interrupted download continues from its .part file next time
+    with tqdm(unit='B', unit_scale=True, desc=file_name) as progress_bar:
+        def _on_size(size):
+            progress_bar.total = size
+            progress_bar.refresh()
+
+        fetch(file_url, download_file, auth=auth, progress=progress_bar.update, on_size=_on_size)
+    print("Download completed:", download_file)
     return download_file
-
@@ -0,0 +1,142 @@
+"""A scriptable stand-in for clang-repl, to test and benchmark the kernel I/O without an LLVM toolchain.
+
+It speaks the prompt protocol of clang-repl: ``clang-repl> `` before every statement and ``clang-repl...   ``
+after a line continued with a backslash. Every statement is echoed back as ``ran: <statement>``; a few
+statements trigger a behaviour instead of real C++:
+
+    ``sleep``           anywhere in the statement, sleeps 0.2 s
+    ``hang``            runs until SIGINT, which ends the process like a crash in clang-repl would
+    ``hang_survive``    runs until SIGINT, then prints ``interrupted`` and returns to the prompt
+    ``lines(N)``        prints N lines
+    ``bytes(N)``        prints N bytes without a newline
+    ``crash(N)``        exits with status N
+    ``fail``            prints a clang compile error instead of running
+    ``print(TEXT)``     prints TEXT on a line of its own
+
+Options change the behaviour of the whole session:
+
+    --latency SECONDS   sleeps before answering every line
+    --chunk BYTES       writes everything, prompts included, in pieces of at most BYTES bytes
+    --chunk-delay S     sleeps between those pieces
+    --crash-after N     exits after N statements
+    --crash-on TEXT     exits when a statement equals TEXT
+    --prompt-cont TEXT  continuation prompt, ``clang-repl... `` for the shell echo kernel
+
+Unknown arguments, like the ``--Xcc=`` flags the kernel passes to clang-repl, are ignored.
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+PROMPT = 'clang-repl> '
+PROMPT_CONT = 'clang-repl...   '
+
+
+def make_shell(*options):
+    """Returns a Shell that runs this fake REPL with the given options instead of clang-repl."""
+    from .kernel import Shell
+    shell = Shell('test')
+    shell._prog, shell.tool_found = sys.executable, True
+    # the command line goes through the shell, so an option like '#include <cstdio>' must be quoted
+    quote = subprocess.list2cmdline if os.name == 'nt' else shlex.join
+    shell.args = [quote([__file__] + list(options))]
+    return shell
+
+
+def _count(statement, name):
+    return int(statement[len(name) + 1:statement.index(')')])
+
+
+class FakeRepl:
+    def __init__(self, out, latency=0.0, chunk=0, chunk_delay=0.0, crash_after=0, crash_on=None,
+                 prompt_cont=PROMPT_CONT):
+        self.out = out
+        self.prompt_cont = prompt_cont
+        self.latency = latency
+        self.chunk = chunk
+        self.chunk_delay = chunk_delay
+        self.crash_after = crash_after
+        self.crash_on = crash_on
+        self.statements = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        if self.chunk <= 0:
+            self.out.write(data)
+            return
+        for idx in range(0, len(data), self.chunk):
+            self.out.write(data[idx:idx + self.chunk])
+            self.out.flush()
+            if self.chunk_delay > 0:
+                time.sleep(self.chunk_delay)
+
+    def run_statement(self, statement):
+        self.statements += 1
+        if statement == self.crash_on or (self.crash_after > 0 and self.statements > self.crash_after):
+            self.out.flush()
+            sys.exit(1)
+        if statement.startswith('crash('):
+            self.out.flush()
+            sys.exit(_count(statement, 'crash'))
+        if 'sleep' in statement:
+            time.sleep(0.2)
+        if statement.startswith('hang'):
+            try:
+                while True:
+                    time.sleep(0.01)
+            except KeyboardInterrupt:
+                if statement.startswith('hang_survive'):
+                    self.write('interrupted\n')
+                else:
+                    raise
+        if statement.startswith('lines('):
+            self.write(''.join('line %d\n' % idx for idx in range(_count(statement, 'lines'))))
+        if statement.startswith('bytes('):
+            self.write('x' * _count(statement, 'bytes'))
+        if statement.startswith('print('):
+            self.write(statement[len('print('):statement.rindex(')')] + '\n')
+        if statement.startswith('fail'):
+            self.write('input_line_%d:1:1: error: unknown type name \'fail\'\nerror: Parsing failed.\n'
+                       % self.statements)
+            return
+        if not statement.startswith('%lib') and not statement.startswith('#'):
+            self.write('ran: ' + statement + '\n')
+
+    def serve(self, lines):
+        self.write(PROMPT)
+        self.out.flush()
+        pending = ''
+        for line in lines:
+            if self.latency > 0:
+                time.sleep(self.latency)
+            line = line.rstrip('\n')
+            if line.endswith('\\'):
+                pending += line[:-1]
+                self.write(self.prompt_cont)
+            else:
+                statement = pending + line
+                pending = ''
+                self.run_statement(statement)
+                self.write(PROMPT)
+            self.out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='clang-repl stand-in')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--chunk', type=int, default=0)
+    parser.add_argument('--chunk-delay', type=float, default=0.0)
+    parser.add_argument('--crash-after', type=int, default=0)
+    parser.add_argument('--crash-on')
+    parser.add_argument('--prompt-cont', default=PROMPT_CONT)
+    args, _ = parser.parse_known_args(argv)
+    repl = FakeRepl(sys.stdout.buffer, args.latency, args.chunk, args.chunk_delay, args.crash_after, args.crash_on,
+                    args.prompt_cont)
+    repl.serve(sys.stdin)
+
+
+if __name__ == '__main__':
+    main()
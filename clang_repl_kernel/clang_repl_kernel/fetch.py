@@ -0,0 +1,178 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_WORKERS = 4
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_RETRIES = 3
+# seconds to connect and seconds without a byte before a request fails and is retried
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 60
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+def make_session(workers=DEFAULT_WORKERS, auth=None):
+    session = requests.Session()
+    # one pooled connection per worker, so the ranges do not wait for each other
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.auth = auth
+    return session
+
+
+class RangedDownload:
+    """Downloads ``url`` to ``path`` in byte ranges fetched by ``workers`` threads.
+
+    The data goes to ``path + '.part'`` and the finished ranges are recorded in ``path + '.part.json'``, so a
+    download that was interrupted continues with the missing ranges the next time, as long as the size and the
+    ETag or Last-Modified of the file did not change. A server without range support gets one plain GET.
+    ``on_size(size)`` is called once the size is known and ``progress(nbytes)`` from the worker threads as data
+    arrives.
+    """
+
+    def __init__(self, url, path, auth=None, workers=DEFAULT_WORKERS, part_size=DEFAULT_PART_SIZE,
+                 retries=DEFAULT_RETRIES, session=None, progress=None, on_size=None,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.url = url
+        self.path = path
+        self.part_path = path + '.part'
+        self.state_path = path + '.part.json'
+        self.workers = workers
+        self.part_size = part_size
+        self.retries = retries
+        self.session = session if session is not None else make_session(workers, auth)
+        self.progress = progress
+        self.on_size = on_size
+        self.timeout = timeout
+        self.size = None
+        self.validator = None
+        self.done = set()
+        self.ranged = False
+        self._lock = threading.Lock()
+
+    def _report(self, nbytes):
+        if self.progress is not None:
+            with self._lock:
+                self.progress(nbytes)
+
+    def probe(self):
+        """Asks for the first byte: a 206 answer tells the size and that ranges work, anything else is the
+        whole file, which is returned to be streamed as it is."""
+        response = self.session.get(self.url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=self.timeout)
+        if response.status_code == 206:
+            match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+            if match is not None:
+                response.close()
+                self.ranged = True
+                self.size = int(match.group(3))
+                self.validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                return None
+        if response.status_code != 200:
+            text = response.text
+            response.close()
+            raise Exception('Failed to download %s: %d %s' % (self.url, response.status_code, text[:200]))
+        if 'Content-Length' in response.headers:
+            self.size = int(response.headers['Content-Length'])
+        return response
+
+    def parts(self):
+        return [(idx, start, min(start + self.part_size, self.size) - 1)
+                for idx, start in enumerate(range(0, self.size, self.part_size))]
+
+    def _load_state(self):
+        # only resume a partial file of the very same remote file cut into the same parts
+        expected = {'url': self.url, 'size': self.size, 'validator': self.validator, 'part_size': self.part_size}
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        # without an ETag or Last-Modified a bundle of the same size could be another one, start over
+        if (state is not None and self.validator is not None
+                and all(state.get(key) == value for key, value in expected.items())
+                and os.path.exists(self.part_path) and os.path.getsize(self.part_path) == self.size):
+            self.done = set(state.get('done', []))
+            return
+        self.done = set()
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.size)
+        self._save_state()
+
+    def _save_state(self):
+        state = {'url': self.url, 'size': self.size, 'validator': self.validator, 'part_size': self.part_size,
+                 'done': sorted(self.done)}
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _fetch_part(self, part):
+        idx, start, end = part
+        for attempt in range(self.retries + 1):
+            received = 0
+            try:
+                response = self.session.get(self.url, headers={'Range': 'bytes=%d-%d' % (start, end)}, stream=True,
+                                            timeout=self.timeout)
+                with response:
+                    match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                    if response.status_code != 206 or match is None or int(match.group(1)) != start:
+                        raise Exception('unexpected answer to the range %d-%d: %d' % (start, end,
+                                                                                     response.status_code))
+                    with open(self.part_path, 'r+b', buffering=WRITE_BUFFER_SIZE) as f:
+                        f.seek(start)
+                        for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                            f.write(chunk)
+                            received += len(chunk)
+                            self._report(len(chunk))
+                if received != end - start + 1:
+                    raise Exception('range %d-%d ended after %d bytes' % (start, end, received))
+            except Exception:
+                # the bytes of a failed attempt come again with the retry
+                self._report(-received)
+                if attempt == self.retries:
+                    raise
+                continue
+            with self._lock:
+                self.done.add(idx)
+                self._save_state()
+            return
+
+    def _stream(self, response):
+        with response, open(self.part_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+            for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                f.write(chunk)
+                self._report(len(chunk))
+
+    def run(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        response = self.probe()
+        if self.on_size is not None:
+            self.on_size(self.size)
+        if response is not None:
+            self._stream(response)
+        else:
+            self._load_state()
+            self._report(sum(end - start + 1 for idx, start, end in self.parts() if idx in self.done))
+            missing = [part for part in self.parts() if part[0] not in self.done]
+            if len(missing) > 0:
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                    # list() raises the first error of a part once all workers stopped
+                    list(executor.map(self._fetch_part, missing))
+        os.replace(self.part_path, self.path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return self.path
+
+
+def fetch(url, path, auth=None, workers=DEFAULT_WORKERS, part_size=DEFAULT_PART_SIZE, progress=None, on_size=None):
+    return RangedDownload(url, path, auth, workers, part_size, progress=progress, on_size=on_size).run()
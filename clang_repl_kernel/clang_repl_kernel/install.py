@@ -10,7 +10,11 @@ import platform
 
 from jupyter_client.kernelspec import KernelSpecManager
 from tempfile import TemporaryDirectory
-from . import ClangReplConfig, download, is_done, update_platform_system
+from . import ClangReplConfig, is_done, update_platform_system
+from .downloader import download
+from .kernel import get_workaround_statements
+from .lazy import cell_includes
+from .store import ToolchainStore
 
 kernel_json = {
     "argv": [ClangReplConfig.PYTHON_EXE, "-m", "clang_repl_kernel", "-f", "{connection_file}"],
@@ -20,39 +24,69 @@ kernel_json = {
 }
 
 
-def install_my_kernel_spec(user=True, prefix=None, args=None, suffix=None, name_suffix='',
-                           platform_system=platform.system(), installed_clang_executable=None):
+CPP_STANDARDS = ['c++14', 'c++17', 'c++20', 'c++23']
+
+
+def kernel_env():
+    env = dict(kernel_json['env'])
+    env.update(os.environ)
+    if len(os.environ) == 0:
+        print("No environment variables found. Please set CPLUS_INCLUDE_PATH manually")
+        env['EMPTY'] = 'True'
+    return env
+
+
+def _write_kernel_spec(spec_dir, args, name_suffix, env):
+    # a fresh dict per spec, a shallow copy of kernel_json would share its argv list between specs
+    local_kernel_json = {
+        "argv": kernel_json['argv'] + list(args),
+        "display_name": kernel_json['display_name'] + name_suffix,
+        "language": kernel_json['language'],
+        "env": env,
+    }
+    os.makedirs(spec_dir, exist_ok=True)
+    # if os support chmod
+    if hasattr(os, 'chmod'):
+        os.chmod(spec_dir, 0o755)  # Starts off as 700, not user readable
+    with open(os.path.join(spec_dir, 'kernel.json'), 'w') as f:
+        json.dump(local_kernel_json, f, sort_keys=True)
+    # requires logo files in kernel root directory
+    cur_path = os.path.dirname(os.path.realpath(__file__))
+    for logo in ["logo_32X32.png", "logo_64X64.png"]:
+        if os.path.exists(os.path.join(cur_path, logo)):
+            shutil.copy(os.path.join(cur_path, logo), spec_dir)
+
+
+def install_kernel_specs(user=True, prefix=None, standards=CPP_STANDARDS):
+    """Writes the kernel spec of every C++ standard in one pass, the toolchain is not touched."""
+    env = kernel_env()
+    for key in env:
+        print(key + " = " + env[key])
+    kernel_spec_manager = KernelSpecManager()
     with TemporaryDirectory() as td:
-        # if os support chmod
-        if hasattr(os, 'chmod'):
-            os.chmod(td, 0o755)  # Starts off as 700, not user readable
-        local_kernel_json = kernel_json.copy()
-        local_kernel_json['argv'].extend(args)
-        local_kernel_json['display_name'] += name_suffix
-        my_env = os.environ.copy()
-        for key in my_env:
-            local_kernel_json['env'][key] = my_env[key]
-            print(key + " = " + my_env[key])
-        if len(my_env) == 0:
-            print("No environment variables found. Please set CPLUS_INCLUDE_PATH manually")
-            local_kernel_json['env']['EMPTY'] = 'True'
-
-        with open(os.path.join(td, 'kernel.json'), 'w') as f:
-            json.dump(local_kernel_json, f, sort_keys=True)
-        print('Installing Jupyter kernel spec')
-        # requires logo files in kernel root directory
-        cur_path = os.path.dirname(os.path.realpath(__file__))
-        for logo in ["logo_32X32.png", "logo_64X64.png"]:
-            try:
-                shutil.copy(os.path.join(cur_path, logo), td)
-            except FileNotFoundError:
-                print("Custom logo files not found. Default logos will be used.")
+        for std in standards:
+            version = std.replace('c++', '')
+            spec_dir = os.path.join(td, 'clang_repl_cpp' + version)
+            _write_kernel_spec(spec_dir, ['--std=' + std], ' (C++' + version + ')', env)
+            print('Installing Jupyter kernel spec for ' + std)
+            kernel_spec_manager.install_kernel_spec(spec_dir, 'clang_repl_cpp' + version, user=user, prefix=prefix)
+
 
-        clang_repl_file = 'clang_repl' + suffix
+def install(user=True, prefix=None, platform_system=platform.system(), installed_clang_executable=None,
+            standards=CPP_STANDARDS, lazy=None, lazy_trace=None):
+    """Provides the toolchain once and then installs the kernel specs of all C++ standards."""
+    install_bundles(platform_system, installed_clang_executable, lazy=lazy, lazy_trace=lazy_trace)
+    install_kernel_specs(user, prefix, standards)
 
-        install_bundles(platform_system, installed_clang_executable)
 
-        KernelSpecManager().install_kernel_spec(td, clang_repl_file, user=user, prefix=prefix)
+def install_my_kernel_spec(user=True, prefix=None, args=None, suffix=None, name_suffix='',
+                           platform_system=platform.system(), installed_clang_executable=None):
+    # a single spec; install() does all standards with one toolchain check
+    install_bundles(platform_system, installed_clang_executable)
+    with TemporaryDirectory() as td:
+        _write_kernel_spec(td, args or [], name_suffix, kernel_env())
+        print('Installing Jupyter kernel spec')
+        KernelSpecManager().install_kernel_spec(td, 'clang_repl' + (suffix or ''), user=user, prefix=prefix)
 
 
 def get_filename_from_response(url):
@@ -87,6 +121,8 @@ def _is_installed_clang_exist(platform_system):
     return False
 
 def is_installed_clang_exist(platform_system=None):
+    if not os.path.isdir(ClangReplConfig.CLANG_BASE_DIR):
+        return _is_installed_clang_exist(platform_system)
     for platform_system_path in os.listdir(ClangReplConfig.CLANG_BASE_DIR):
         if _is_installed_clang_exist(platform_system_path):
             return True
@@ -94,9 +130,14 @@ def is_installed_clang_exist(platform_system=None):
 
 
 
-def install_bundles(platform_system, installed_clang_executable=None, force_install=False):
+def bootstrap_headers():
+    # the headers every session includes before the first cell, extracted up front by a lazy install
+    return list(ClangReplConfig.HEADERS) + cell_includes('\n'.join(get_workaround_statements()))
+
+
+def install_bundles(platform_system, installed_clang_executable=None, force_install=False, lazy=None,
+                    lazy_trace=None):
     platform_system = update_platform_system(platform_system)
-    clang_installed = is_installed_clang_exist()
 
     if installed_clang_executable is not None:
         r_idx = installed_clang_executable.rfind('clang-repl')
@@ -112,10 +153,16 @@ def install_bundles(platform_system, installed_clang_executable=None, force_inst
             f.write(clang_repl_dir)
         return
 
-    if force_install or not clang_installed:
+    # the directory scan is only needed when a download is not forced anyway
+    if force_install or not is_installed_clang_exist():
         zip_filename = platform_system+".zip"
+        # the scan above may have left another platform set, or none at all in a fresh process
+        ClangReplConfig.set_platform(platform_system)
         extract_dir = ClangReplConfig.get_install_dir()
-        download(zip_filename, extract_dir)
+        if lazy is None:
+            lazy = ClangReplConfig.LAZY_EXTRACT
+        download(zip_filename, extract_dir, ClangReplConfig.TOOLCHAIN_STORE_DIR or None, lazy=lazy,
+                 headers=bootstrap_headers() if lazy else (), trace=lazy_trace, refresh=force_install)
 
 
 
@@ -140,22 +187,33 @@ def main(argv=None):
                     default=platform.system())
     ap.add_argument('--installed-clang-executable',
                     help="Installed clang executable path (Can not be used with --platform-system)")
+    ap.add_argument('--store-gc', action='store_true',
+                    help="Remove the toolchains of the shared store that no install links to, then exit")
+    ap.add_argument('--lazy-extract', action='store_true', default=None,
+                    help="Keep the toolchain zip and extract only the files that are used, headers as cells "
+                         "include them")
+    ap.add_argument('--lazy-trace',
+                    help="With --lazy-extract, also extract the files listed in this trace, e.g. the "
+                         "lazy_trace.txt of another install")
     args = ap.parse_args(argv)
 
+    if args.store_gc:
+        if not ClangReplConfig.TOOLCHAIN_STORE_DIR:
+            print('No toolchain store, set CLANG_REPL_KERNEL_STORE')
+            return
+        for digest in ToolchainStore(ClangReplConfig.TOOLCHAIN_STORE_DIR).gc():
+            print('Removed ' + digest)
+        return
+
     if args.sys_prefix:
         args.prefix = sys.prefix
     if not args.prefix and not _is_root():
         args.user = True
 
-    install_my_kernel_spec(user=args.user, prefix=args.prefix,
-                           args=['--std=c++14'], suffix='_cpp14', name_suffix=' (C++14)', platform_system=args.platform_system, installed_clang_executable=args.installed_clang_executable)
-    install_my_kernel_spec(user=args.user, prefix=args.prefix,
-                           args=['--std=c++17'], suffix='_cpp17', name_suffix=' (C++17)', platform_system=args.platform_system, installed_clang_executable=args.installed_clang_executable)
-    install_my_kernel_spec(user=args.user, prefix=args.prefix,
-                           args=['--std=c++20'], suffix='_cpp20', name_suffix=' (C++20)', platform_system=args.platform_system, installed_clang_executable=args.installed_clang_executable)
-    install_my_kernel_spec(user=args.user, prefix=args.prefix,
-                           args=['--std=c++23'], suffix='_cpp23', name_suffix=' (C++23)', platform_system=args.platform_system, installed_clang_executable=args.installed_clang_executable)
+    install(user=args.user, prefix=args.prefix, platform_system=args.platform_system,
+            installed_clang_executable=args.installed_clang_executable, lazy=args.lazy_extract,
+            lazy_trace=args.lazy_trace)
+
 
-is_installed_clang_exist()
 if __name__ == '__main__':
     main()
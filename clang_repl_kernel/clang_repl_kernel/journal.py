@@ -0,0 +1,59 @@
+class JournalEntry:
+    def __init__(self, code, seconds, cell_id=None, execution_count=None):
+        # the code as sent to clang-repl and the seconds it took
+        self.code = code
+        self.seconds = seconds or 0.0
+        self.cell_id = cell_id
+        self.execution_count = execution_count
+
+    def label(self):
+        return 'In [%s]' % (self.execution_count if self.execution_count is not None else '?')
+
+
+class SessionJournal:
+    """The cells that ran to the prompt without an error, timeout or interrupt, to replay them in a new clang-repl.
+
+    ``args`` are the clang-repl arguments, ``--std`` among them, the cells ran with; ``%lib`` lines are part of the
+    cells themselves. Cells that only print, ``%%timeit`` and ``%<<``, are not recorded.
+    """
+
+    def __init__(self, args=()):
+        self.args = list(args)
+        self.cells = []
+
+    def __len__(self):
+        return len(self.cells)
+
+    def record(self, code, seconds, cell_id=None, execution_count=None):
+        self.cells.append(JournalEntry(code, seconds, cell_id, execution_count))
+
+    def clear(self):
+        self.cells = []
+
+    def original_time(self):
+        return sum(entry.seconds for entry in self.cells)
+
+    def replay_code(self):
+        return replay_code(self.cells)
+
+
+def replay_code(entries):
+    # one submission, the statements of all cells in their order
+    return '\n'.join(entry.code for entry in entries)
+
+
+def is_journaled(code):
+    stripped = code.lstrip()
+    return not stripped.startswith('%%timeit') and not stripped.startswith('%<<')
+
+
+def parse_restart_magic(code):
+    """Returns None for a cell that is not ``%restart``, else whether ``--replay`` was given."""
+    words = code.split()
+    if len(words) == 0 or words[0] != '%restart':
+        return None
+    if words[1:] == []:
+        return False
+    if words[1:] == ['--replay']:
+        return True
+    raise ValueError('usage: %restart [--replay], got: ' + repr(code.strip()))
@@ -1,17 +1,30 @@
 import asyncio
 from ipykernel.kernelbase import Kernel
-import errno
 from enum import Enum
-from subprocess import check_output
 import subprocess
 import os
 import sys
 import platform
 import logging
-from . import is_done
+import signal
+import threading
+from .extract import is_done
+from .reader import ChunkReader, LineSender
+from .pool import ShellPool
+from .pch import PrecompiledPreamble, split_preamble, make_header
+from .output import OutputAggregator, OutputBudget, DiagnosticScanner
+from .watchdog import Watchdog
+from .metrics import CellMetrics, SessionStats
+from .timeit_magic import make_timeit_code
+from .lazy import open_lazy, cell_includes
+from .resolver import ResolveCache
+from .journal import SessionJournal, is_journaled, parse_restart_magic, replay_code
+from .depgraph import DependencyIndex, analyze, find_edited
+import shutil
 import time
 
 CLANG_REPL_DEBUG = False
+BOOTSTRAP_MARKER = 'clang_repl_kernel_ready_'
 
 LINUX_WORKAROUND = """class printf_streambuf : public std::streambuf {\
 private:\
@@ -60,6 +73,21 @@ MACOS_WORKAROUND = """"""
 workarounds = [LINUX_WORKAROUND, WINDOW_WORKAROUND, MACOS_WORKAROUND]
 
 
+def get_workaround_statements():
+    # the workaround continues lines with '\\', join them back into one statement each
+    statements = []
+    accumulated_line = ""
+    for line in workarounds[ClangReplConfig.PLATFORM_NAME_ENUM.value].splitlines():
+        if line.endswith('\\'):
+            accumulated_line += line[:-1]
+            continue
+        else:
+            accumulated_line += line
+        statements.append(accumulated_line)
+        accumulated_line = ""
+    return statements
+
+
 def update_platform_system(platform_system):
     if platform_system == 'Windows':
         platform_system = 'WinMG64'
@@ -69,15 +97,8 @@ def update_platform_system(platform_system):
 
 
 def is_tool(name):
-    try:
-        import subprocess, os
-        my_env = os.environ.copy()
-        devnull = open(os.devnull)
-        subprocess.Popen([name], stdout=devnull, stderr=devnull, env=my_env).communicate()
-    except OSError as e:
-        if e.errno == errno.ENOENT:
-            return False
-    return True
+    # a PATH lookup in process, nothing is started
+    return shutil.which(name) is not None
 
 
 def find_prog(prog):
@@ -89,7 +110,7 @@ def find_prog(prog):
     os_dir = None
     if platform.system() == "Windows":
         # find first directory start with 'Win'
-        for dir in os.listdir(ClangReplConfig.CLANG_BASE_DIR):
+        for dir in ClangReplConfig.list_base_dir():
             if dir.startswith('Win') and os.path.isdir(os.path.join(ClangReplConfig.CLANG_BASE_DIR, dir)):
                 os_dir = dir
                 break
@@ -101,20 +122,59 @@ def find_prog(prog):
         if os.path.isfile(embedded_prog) and os.path.exists(embedded_prog):
             return embedded_prog, False
 
-    if is_tool(prog):
-        cmd = "where" if platform.system() == "Windows" else "which"
-        out = check_output([cmd, prog])
-        out = out.decode('utf-8')
-        for line in out.splitlines():
-            if len(line.strip()) > 0:
-                out = line.strip()
-                break
-        assert os.path.isfile(out)
-        assert os.path.exists(out)
-        return out, True
+    found = shutil.which(prog)
+    if found is not None:
+        return os.path.abspath(found), True
     return None, False
 
 
+def _resolve_toolchain(binary):
+    if os.path.exists(ClangReplConfig.get_install_clang_config_file()):
+        with open(ClangReplConfig.get_install_clang_config_file(), 'r') as f:
+            ClangReplConfig.set_user_defined_bin_path(f.read().strip())
+    elif len(ClangReplConfig.get_available_bin_path()) == 0:
+        raise Exception('Cannot find any installed clang for this platform')
+    ClangReplConfig.set_platform(ClangReplConfig.get_default_platform())
+    prog, tool_found = find_prog(binary)
+    return {
+        'platform': ClangReplConfig.platform(),
+        'user_bin_path': ClangReplConfig.USER_DEFINED_BIN_PATH,
+        'prog': prog,
+        'tool_found': tool_found,
+        'dylib_dirs': ClangReplConfig.get_dynlib_dir(),
+        'c_include': ClangReplConfig.get_c_include(),
+        'cpp_include': ClangReplConfig.get_cpp_include(),
+    }
+
+
+def resolve_toolchain(binary):
+    """Sets the platform and returns where the toolchain is: the program, whether it was found on PATH, and the
+    library and include directories. The answer is cached in RESOLVE_CACHE_FILE until the install changes."""
+    cache = ResolveCache(ClangReplConfig.RESOLVE_CACHE_FILE) if ClangReplConfig.RESOLVE_CACHE_FILE else None
+    key = os.pathsep.join([binary, ClangReplConfig.CLANG_BASE_DIR, os.environ.get('PATH', '')])
+    resolved = cache.get(key) if cache is not None else None
+    if resolved is not None:
+        if resolved['user_bin_path'] is not None:
+            ClangReplConfig.set_user_defined_bin_path(resolved['user_bin_path'])
+        ClangReplConfig.set_platform(resolved['platform'])
+        return resolved
+    resolved = _resolve_toolchain(binary)
+    if cache is not None and resolved['prog'] is not None:
+        # a new or removed platform directory, a changed installed_clang.txt, a reinstall or a replaced binary
+        cache.put(key, resolved, [ClangReplConfig.CLANG_BASE_DIR, ClangReplConfig.get_install_clang_config_file(),
+                                  os.path.join(ClangReplConfig.get_install_dir(), 'done'), resolved['prog']])
+    return resolved
+
+
+def get_arg_value(name, default=None, convert=str):
+    # kernel options are passed as '--name=value' in the kernel spec argv, the last one wins
+    prefix = '--' + name + '='
+    for an_input in reversed(sys.argv):
+        if an_input.startswith(prefix):
+            return convert(an_input[len(prefix):])
+    return default
+
+
 class ShellStatus(Enum):
     COMPLETE = 0
     CONTINUE = 1
@@ -178,17 +238,62 @@ class ClangReplConfig:
         PLATFORM_NAME_ENUM = PlatformPath.Platform.MacOS
     else:
         pass
+    # created by the installer, not at import
     CLANG_BASE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'clang')
-    if not os.path.exists(CLANG_BASE_DIR):
-        os.makedirs(CLANG_BASE_DIR)
     PYTHON_CLANG_DLL_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dll')
+    # set CLANG_REPL_KERNEL_STORE to a directory every kernel user can read, e.g. /var/cache/clang_repl_kernel, to
+    # extract bundles once into that store and link them into CLANG_BASE_DIR of every install on the machine; unset,
+    # bundles are extracted into CLANG_BASE_DIR itself
+    TOOLCHAIN_STORE_DIR = os.environ.get('CLANG_REPL_KERNEL_STORE', '')
+    # keep the bundle zip and extract only the tools, the libraries and the headers cells include, as they include
+    # them; set CLANG_REPL_KERNEL_LAZY_EXTRACT=1 or pass '--lazy-extract' to the installer
+    LAZY_EXTRACT = os.environ.get('CLANG_REPL_KERNEL_LAZY_EXTRACT', '') not in ('', '0')
+    # where the kernel remembers the located toolchain between starts, an empty CLANG_REPL_KERNEL_RESOLVE_CACHE
+    # looks it up every time
+    RESOLVE_CACHE_FILE = os.environ.get('CLANG_REPL_KERNEL_RESOLVE_CACHE',
+                                        os.path.join(os.path.expanduser('~'), '.cache', 'clang_repl_kernel',
+                                                     'resolved_toolchain.json'))
     BANNER_NAME = 'clang-repl'
+    # write a whole cell in one go instead of waiting for the prompt of every line
+    BATCH_SUBMIT = True
+    BATCH_INLINE_WRITE_LIMIT = 4096
+    # bootstrapped clang-repl processes kept ready for restarts, '--pool-size=N' enables it; off by default, a spare
+    # lives as long as the kernel and only pays off for sessions that restart
+    POOL_SIZE = 0
+    # precompile the bootstrap headers with the clang next to clang-repl, falls back to parsing them
+    USE_PCH = True
+    # per user, the package directory may belong to root; the PCH goes to <PCH_CACHE_DIR>/pch
+    PCH_CACHE_DIR = os.environ.get('CLANG_REPL_KERNEL_PCH_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'clang_repl_kernel'))
+    # output lines of a cell are batched into one stream message per window or byte budget,
+    # '--output-flush-interval=SECONDS' and '--output-flush-bytes=N' override them, an interval of 0 sends every line
+    OUTPUT_FLUSH_INTERVAL = 0.05
+    OUTPUT_FLUSH_BYTES = 64 * 1024
+    # a line is cut into pieces once this much is buffered without a newline
+    OUTPUT_MAX_PENDING_BYTES = 256 * 1024
+    # output of a cell beyond this many bytes goes to a temporary file, '--output-limit=N' overrides it, 0 disables it
+    OUTPUT_LIMIT = 16 * 1024 * 1024
+    # seconds a cell may run before it is interrupted, '--timeout=N' or '%timeout N' in a cell override it, 0 disables
+    # it; clang-repl is killed and restarted if the interrupt does not bring the prompt back within the grace time
+    CELL_TIMEOUT = 0
+    TIMEOUT_KILL_GRACE = 3.0
+    # clang-repl starts in the background, a cell that arrives before it is ready reports the wait this often
+    BOOTSTRAP_PROGRESS_INTERVAL = 1.0
+    # a cell that redefines journaled cells restarts clang-repl and replays only the cells it needs and the cells
+    # that use it, '--selective-replay=0' leaves redefinitions to clang-repl
+    SELECTIVE_REPLAY = True
     PREFER_BUNDLE = True  # if platform.system() == 'Windows' else False
     # BIN_DIR = os.path.join(CLANG_BASE_DIR, platform.system())
     # BIN_PATH = os.path.join(BIN_DIR, BIN)
     _platform = None
     PLATFORM_BIT = None
 
+    @staticmethod
+    def list_base_dir():
+        if not os.path.isdir(ClangReplConfig.CLANG_BASE_DIR):
+            return []
+        return os.listdir(ClangReplConfig.CLANG_BASE_DIR)
+
     @staticmethod
     def get_install_clang_config_file():
         return os.path.join(ClangReplConfig.CLANG_BASE_DIR, ClangReplConfig.INSTALL_CLANG_CONFIG_FILE_NAME)
@@ -275,7 +380,7 @@ class ClangReplConfig:
     @classmethod
     def get_available_bin_path(cls):
         bin_path = []
-        for a_dir in os.listdir(ClangReplConfig.CLANG_BASE_DIR):
+        for a_dir in ClangReplConfig.list_base_dir():
             a_dir_pullpath = os.path.join(ClangReplConfig.CLANG_BASE_DIR, a_dir)
             if os.path.isdir(a_dir_pullpath) and is_done(a_dir_pullpath):
                 bin_path.append(a_dir)
@@ -294,20 +399,21 @@ class ClangReplConfig:
             return ClangReplConfig.USER_DEFINED_BIN_PATH
 
         platformdirs = PlatformPath.PATH[ClangReplConfig.PLATFORM_NAME_ENUM.value]
-        if len(ClangReplConfig.get_available_bin_path()) == 0:
+        available = ClangReplConfig.get_available_bin_path()
+        if len(available) == 0:
             import platform
             bits, _ = platform.architecture()
             if bits == '32bit':
                 return platformdirs[PlatformPath.BIT.BIT32.value]
             return platformdirs[PlatformPath.BIT.BIT64.value]
 
-        for bin_path in ClangReplConfig.get_available_bin_path():
+        for bin_path in available:
             if platformdirs[PlatformPath.BIT.BIT64.value] in bin_path:
                 return bin_path
             if platformdirs[PlatformPath.BIT.BIT32.value] in bin_path:
                 return bin_path
 
-        return ClangReplConfig.get_available_bin_path()[0]
+        return available[0]
 
     @staticmethod
     def get_default_platform():
@@ -335,6 +441,15 @@ class Shell:
         self.tool_found = None
         self._prog = None
         self.loop = None
+        self.reader = None
+        self.batch_submit = ClangReplConfig.BATCH_SUBMIT
+        self.use_pch = ClangReplConfig.USE_PCH
+        self.preamble = None
+        self.executing = False
+        self.interrupted = False
+        self.timed_out = False
+        self.elapsed = None
+        self.metrics = None
         self.args = []
         logging.basicConfig(stream=sys.stdout, level=logging.INFO)
         self.logger = logging.getLogger('LOGGER_NAME')
@@ -346,7 +461,7 @@ class Shell:
     def get_available_bin_path():
         # get directory under ClangReplConfig.CLANG_BASE_DIR
         bin_path = []
-        for a_dir in os.listdir(ClangReplConfig.CLANG_BASE_DIR):
+        for a_dir in ClangReplConfig.list_base_dir():
             if os.path.isdir(os.path.join(ClangReplConfig.CLANG_BASE_DIR, a_dir)):
                 bin_path.append(a_dir)
         return bin_path
@@ -376,12 +491,17 @@ class Shell:
         self.process.kill()
         self.run()
 
-    def _run(self, program, tool_found):
-        if not os.path.exists(program):
-            raise Exception('Cannot find: ' + program + " in " + os.getcwd() +
-                            " in src dir: " + os.path.dirname(os.path.realpath(__file__)))
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
 
-        program_with_args = [program] + self.args
+    def kill(self):
+        self.del_loop()
+        if self.is_alive():
+            self.process.kill()
+            self.process.wait()
+
+    def _spawn(self, program, extra_args):
+        program_with_args = [program] + self.args + extra_args
         env = self.env
         program_path = str(os.path.dirname(program)) + os.pathsep + os.getcwd() + os.pathsep
         if env['PATH'] is not None and not env['PATH'].startswith(program_path):
@@ -391,6 +511,13 @@ class Shell:
         # logger.warning('This too')
         # self.logger.info(key + " = " + env[key])
         program_with_args = " ".join(program_with_args)
+        if os.name == 'nt':
+            group_args = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            # 'exec' makes clang-repl itself the child instead of 'sh', and its own process group keeps the
+            # frontend's SIGINT to the kernel from reaching it; interrupt() relays it instead
+            program_with_args = 'exec ' + program_with_args
+            group_args = {'start_new_session': True}
         self.process = subprocess.Popen(
             program_with_args,
             # args=[],
@@ -398,38 +525,89 @@ class Shell:
             # bufsize=1,
             shell=True,
             stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT, stdin=subprocess.PIPE, env=env)
-        outs = ''
-        read_size = len(self.banner)
+            stderr=subprocess.STDOUT, stdin=subprocess.PIPE, env=env, **group_args)
+        self.reader = ChunkReader(self.process.stdout.fileno(), [self.banner_bytes, self.banner_cont_bytes],
+                                  max_pending=ClangReplConfig.OUTPUT_MAX_PENDING_BYTES)
+        outs = []
         while self.process.returncode is None:
-            stdout_data = self.process.stdout.read(read_size)
-            decoded = stdout_data.decode('utf-8')
-            read_size = 1
-            outs += decoded
-            if self.check_endswith(outs, self.banner):
+            prompt = self.reader.read_until_prompt(lambda text, complete: outs.append(text))
+            if prompt is None:
+                return False, ''.join(outs)
+            if prompt == self.banner_bytes:
                 break
+        return True, ''.join(outs)
+
+    def get_preamble(self, program):
+        if not self.use_pch:
+            return None
+        compile_flags = [arg[len('--Xcc='):] for arg in self.args if arg.startswith('--Xcc=')]
+        declarations, _ = split_preamble(get_workaround_statements())
+        return PrecompiledPreamble.for_program(program, ClangReplConfig.BIN_CLANG, compile_flags,
+                                               ClangReplConfig.platform(),
+                                               make_header(ClangReplConfig.HEADERS, declarations),
+                                               ClangReplConfig.PCH_CACHE_DIR)
 
-        def _silent_response(msg):
-            pass
-
-        for dylib in ClangReplConfig.DLIB:
-            self.do_execute('%lib ' + dylib + '\n', _silent_response)
-            assert self.process.returncode is None
+    def _run(self, program, tool_found):
+        if not os.path.exists(program):
+            raise Exception('Cannot find: ' + program + " in " + os.getcwd() +
+                            " in src dir: " + os.path.dirname(os.path.realpath(__file__)))
 
-        for header in ClangReplConfig.HEADERS:
-            self.do_execute('#include <' + header + '>\n', _silent_response)
-            assert self.process.returncode is None
+        preamble = self.get_preamble(program)
+        if preamble is not None and preamble.ensure(self.env) is None:
+            preamble = None
+        started, outs = self._spawn(program, preamble.repl_args() if preamble is not None else [])
+        if preamble is not None and (not started or 'error' in outs):
+            # clang-repl rejected the precompiled preamble, remember it and parse the headers instead
+            preamble.mark_failed(outs)
+            self.kill()
+            preamble = None
+            self._spawn(program, [])
+        self.preamble = preamble
+
+        steps = ['%lib ' + dylib for dylib in ClangReplConfig.DLIB]
+        statements = get_workaround_statements()
+        if preamble is None:
+            steps += ['#include <' + header + '>' for header in ClangReplConfig.HEADERS]
+        else:
+            _, statements = split_preamble(statements)
+        self._bootstrap(steps + statements)
+
+    def _bootstrap(self, steps):
+        # the whole preamble goes out in one write, the echoed marker proves every step went through
+        marker = BOOTSTRAP_MARKER + str(os.getpid())
+        lines = steps + ['std::cout << "' + marker + '" << std::endl;']
+        start = time.perf_counter()
+        writer = self._write_batch(''.join(line + '\n' for line in lines).encode('utf-8'))
+        finished = []
+        outputs = []
+        for _ in lines:
+            outs = []
+            prompt = self.reader.read_until_prompt(lambda text, complete: outs.append(text))
+            finished.append(time.perf_counter())
+            outputs.append(''.join(outs))
+            if prompt is None:
+                break
+        if writer is not None:
+            writer.join()
+        if len(outputs) == len(lines) and marker in outputs[-1] and self.is_alive():
+            return
+        raise Exception(self.bootstrap_report(lines, start, finished, outputs))
 
-        accumulated_line = ""
-        for line in workarounds[ClangReplConfig.PLATFORM_NAME_ENUM.value].splitlines():
-            if line.endswith('\\'):
-                accumulated_line += line[:-1]
+    @staticmethod
+    def bootstrap_report(lines, start, finished, outputs):
+        report = ['clang-repl bootstrap failed after ' + str(len(finished)) + ' of ' + str(len(lines)) +
+                  ' steps (%.3f s):' % (finished[-1] - start if len(finished) > 0 else 0.0)]
+        last = start
+        for idx, line in enumerate(lines):
+            if idx >= len(finished):
+                report.append('  [not run]           ' + line)
                 continue
-            else:
-                accumulated_line += line
-            self.do_execute(accumulated_line, _silent_response)
-            accumulated_line = ""
-            assert self.process.returncode is None
+            status = 'failed' if idx == len(finished) - 1 else 'ok'
+            report.append('  [%-7s] %8.3f s  %s' % (status, finished[idx] - last, line))
+            if len(outputs[idx].strip()) > 0:
+                report.append('            output: ' + outputs[idx].strip())
+            last = finished[idx]
+        return '\n'.join(report)
 
     def run(self):
         program, tool_found = self.prog()
@@ -458,114 +636,139 @@ class Shell:
 
         return False
 
+    @staticmethod
+    def split_command(command):
+        # '\' in each line except the last line
+        lines = [line for line in command.splitlines() if len(line) > 0]
+        if len(lines) == 0:
+            return []
+        command_lines = []
+        for line in lines[:-1]:
+            line_strip = line.strip()
+            if line_strip.startswith('#'):
+                # preprocessor lines are not continued, clang-repl answers them with its main prompt
+                if line_strip.endswith('\\'):
+                    line = line_strip[:-1]
+            elif not line_strip.endswith('\\'):
+                line = line.rstrip() + '\\'
+            command_lines.append(line + '\n')
+        last_line = lines[-1]
+        if last_line.rstrip().endswith('\\'):
+            last_line = last_line.rstrip()[:-1]
+        command_lines.append(last_line + '\n')
+        return command_lines
+
+    def _write(self, data):
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError):
+            pass  # the reader sees the end of the stream
+
+    def _write_batch(self, data):
+        if len(data) <= ClangReplConfig.BATCH_INLINE_WRITE_LIMIT:
+            self._write(data)
+            return None
+        # clang-repl answers every line with a prompt while we are still writing, so a large cell
+        # is written from another thread to keep both pipes draining
+        writer = threading.Thread(target=self._write, args=[data], daemon=True)
+        writer.start()
+        return writer
+
     def _do_execute(self, command, send_func):
         if CLANG_REPL_DEBUG:
             print("Command: ", command)
         if self.check_input_err(command):
             return
-        command_lines = []
-        # '\' in each line except the last line
-        lines = [line for line in command.splitlines() if len(line) > 0]
-        for idx in range(len(lines) - 1):
-            command_lines.append(lines[idx] + '\n')
-        command_lines.append(lines[-1])
-        command_lines[-1] += '\n'
-
-        for idx in range(len(command_lines) - 1):
-            cur_command = command_lines[idx]
-            cur_command_strip = cur_command.encode('utf-8').strip()
-            if cur_command_strip.startswith(b'#'):
-                if cur_command_strip.endswith(b'\\'):
-                    cur_command = cur_command_strip[:-1] + '\n'
-            elif not cur_command_strip.endswith(b'\\'):
-                cur_command = cur_command.rstrip() + '\\\n'
-            outs = bytearray()
-            self.process.stdin.write(cur_command.encode('utf-8'))
-            self.process.stdin.flush()
+        command_lines = self.split_command(command)
+        if len(command_lines) == 0:
+            return
 
-            while self.process.returncode is None:
-                stdout_data = self.process.stdout.read(1)
-                outs += stdout_data
-                if CLANG_REPL_DEBUG:
-                    print("outs: ", outs, ", stdout_data: ", stdout_data)
-                if len(stdout_data) == 0:
-                    out, err = self.process.communicate()
-                    print("End of process, out: ", out, ", error code: ", err)
-                    return
-                if not (outs == self.banner_cont_bytes[:len(outs)]) and not (outs == self.banner_bytes[:len(outs)]):
-                    self.handle_err()
-                    return
-                if len(outs) >= len(self.banner_bytes):
-                    banner_part = outs[len(outs) - len(self.banner_bytes):]
-                    if banner_part == self.banner_bytes:
-                        decoded = str(outs, 'utf-8')
-                        decoded = decoded[:decoded.rfind(self.banner)]
-                        if len(decoded) > 0:
-                            send_func(decoded)
-                        break
-                if len(outs) >= len(self.banner_cont_bytes):
-                    banner_part = outs[len(outs) - len(self.banner_cont_bytes):]
-                    if banner_part == self.banner_cont_bytes:
-                        decoded = str(outs, 'utf-8')
-                        decoded = decoded[:decoded.rfind(self.banner_cont)]
-                        if len(decoded) > 0:
-                            send_func(decoded)
-                        break
-
-        cur_command = command_lines[-1]
-        if cur_command.rstrip().endswith('\\'):
-            cur_command = cur_command.rstrip()[:-1] + '\n'
-        outs = bytearray()
-        self.process.stdin.write(cur_command.encode('utf-8'))
-        self.process.stdin.flush()
-        last_newline = None
-        while self.process.returncode is None:
-            stdout_data = self.process.stdout.read(1)
-            outs += stdout_data
-            if CLANG_REPL_DEBUG:
-                print("outs: ", outs, ", stdout_data: ", stdout_data)
-            if len(stdout_data) == 0:
-                out, err = self.process.communicate()
-                print("End of process, out: ", out, ", error code: ", err)
+        writer = None
+        if self.batch_submit:
+            writer = self._write_batch(''.join(command_lines).encode('utf-8'))
+
+        # every line is answered by one prompt; output can only precede the last one, except for errors
+        for cur_command in command_lines[:-1]:
+            if not self.batch_submit:
+                self._write(cur_command.encode('utf-8'))
+            outs = []
+            if self._read_until_prompt(lambda text, complete: outs.append(text)) is None:
+                self._end_of_process()
                 return
-            if len(outs) >= len(self.banner_bytes):
-                banner_part = outs[len(outs) - len(self.banner_bytes):]
-                if banner_part == self.banner_bytes:
-                    decoded = str(outs, 'utf-8')
-                    decoded = decoded[:decoded.rfind(self.banner)]
-                    if len(decoded) > 0:
-                        send_func(decoded)
-                    break
-            if outs[-1] == 0xA:  # == '\n'
-                decoded = str(outs, 'utf-8')
-                if last_newline is not None:
-                    decoded = last_newline + decoded
-
-                if decoded.endswith('\r\n'):
-                    last_newline = '\r\n'
-                    decoded = decoded[:-2]
-                elif decoded.endswith('\n'):
-                    last_newline = '\n'
-                    decoded = decoded[:-1]
-                else:
-                    assert False
-
-                if len(decoded) > 0:
-                    send_func(decoded)
-                outs = bytearray()
-
-    def do_execute(self, command, send_func):
-
-        return self._do_execute(command, send_func)
-
-    def do_execute_sync(self, command):
+            decoded = ''.join(outs)
+            if len(decoded) > 0:
+                send_func(decoded)
+
+        if not self.batch_submit:
+            self._write(command_lines[-1].encode('utf-8'))
+        if self._read_until_prompt(LineSender(send_func)) is None:
+            self._end_of_process()
+        if writer is not None:
+            writer.join()
+
+    def _read_until_prompt(self, on_output):
+        metrics = self.metrics
+
+        def _on_output(text, complete):
+            metrics.count_output(text)
+            on_output(text, complete)
+
+        return self.reader.read_until_prompt(_on_output)
+
+    def _end_of_process(self):
+        out, err = self.process.communicate()
+        print("End of process, out: ", out, ", error code: ", err)
+
+    def kill_process(self):
+        if self.is_alive():
+            self.process.kill()
+
+    def do_execute(self, command, send_func, timeout=None):
+        self.interrupted = False
+        self.timed_out = False
+        self.executing = True
+        self.metrics = CellMetrics(self.process.pid if self.is_alive() else None)
+        self.reader.first_read = None
+        watchdog = None
+        if timeout is not None and timeout > 0:
+            watchdog = Watchdog(timeout, self.interrupt, self.kill_process, ClangReplConfig.TIMEOUT_KILL_GRACE).start()
+
+        def _send_func(msg):
+            # output arriving after an interrupt belongs to the aborted run
+            if not self.interrupted:
+                send_func(msg)
+
+        try:
+            return self._do_execute(command, _send_func)
+        finally:
+            self.executing = False
+            self.metrics.finish(self.reader.first_read)
+            if watchdog is not None:
+                watchdog.cancel()
+                self.timed_out = watchdog.expired
+                self.elapsed = watchdog.elapsed
+
+    def interrupt(self):
+        """Delivers SIGINT to clang-repl; the running do_execute drops the rest of the output up to the next prompt."""
+        if not self.executing or not self.is_alive():
+            return False
+        self.interrupted = True
+        if os.name == 'nt':
+            self.process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(self.process.pid, signal.SIGINT)
+        return True
+
+    def do_execute_sync(self, command, timeout=None):
         response_message = []
 
         def _send_response(msg):
             response_message.append(msg)
 
         import threading
-        _kernel_thread = threading.Thread(target=self.do_execute, args=[command, _send_response], daemon=True)
+        _kernel_thread = threading.Thread(target=self.do_execute, args=[command, _send_response, timeout],
+                                          daemon=True)
         _kernel_thread.start()
 
         _kernel_thread.join()
@@ -605,94 +808,382 @@ class ClangReplKernel(Kernel):
     banner = "Clang Repl kernel - clang repl interpreter for jupyter"
 
     inputs = []
+    timeit_count = 0
 
     @staticmethod
     def arg_inputs(an_input):
         ClangReplKernel.inputs.append(an_input)
 
-    def __init__(self, **kwargs):
+    def __init__(self, shell=None, shell_factory=None, **kwargs):
+        """``shell``, a configured Shell that is already running, makes a kernel in test mode: no toolchain is
+        looked up and nothing is started, restarts take a new shell from ``shell_factory``."""
         super().__init__(**kwargs)
+        if shell is not None:
+            self.my_shell = shell
+            self.lazy_toolchain = None
+            self.shell_pool = ShellPool(shell_factory if shell_factory is not None else self._create_shell, 0)
+            self._init_session()
+            self.shell_ready.set()
+            return
 
-        if os.path.exists(ClangReplConfig.get_install_clang_config_file()):
-            with open(ClangReplConfig.get_install_clang_config_file(), 'r') as f:
-                ClangReplConfig.set_user_defined_bin_path(f.read().strip())
-        else:
-            platforms = ClangReplConfig.get_available_bin_path()
-            if len(platforms) == 0:
-                raise Exception('Cannot find any installed clang for this platform')
-
-        ClangReplConfig.set_platform(ClangReplConfig.get_default_platform())
+        # no process is started to locate clang-repl, and the answer of a previous start is reused
+        toolchain = resolve_toolchain(ClangReplConfig.BIN)
 
         if os.name == 'nt':
             self.my_shell = WinShell(ClangReplConfig.platform())
         else:
             self.my_shell = BashShell(ClangReplConfig.platform())
+        if toolchain['prog'] is not None:
+            self.my_shell._prog, self.my_shell.tool_found = toolchain['prog'], toolchain['tool_found']
 
-        self.std_arg = 'c++23'
-        for an_input in reversed(sys.argv):
-            if an_input.startswith('--std='):
-                self.std_arg = an_input[6:]
-                break
+        self.std_arg = get_arg_value('std', 'c++23')
         self.my_shell.args = ['--Xcc=-std=' + self.std_arg]
 
-        for dy_libpath in ClangReplConfig.get_dynlib_dir():
+        for dy_libpath in toolchain['dylib_dirs']:
             if not ClangReplConfig.DYLIB_PATH_ENV in self.my_shell.env:
                 self.my_shell.env[ClangReplConfig.DYLIB_PATH_ENV] = ""
             self.my_shell.env[ClangReplConfig.DYLIB_PATH_ENV] = dy_libpath + os.pathsep + self.my_shell.env[
                 ClangReplConfig.DYLIB_PATH_ENV]
 
         self.my_shell.env["CPATH"] = os.pathsep.join(
-            filter(None, [self.my_shell.env.get("CPATH", ""), ClangReplConfig.get_c_include()])
+            filter(None, [self.my_shell.env.get("CPATH", ""), toolchain['c_include']])
         )
         self.my_shell.env["CPLUS_INCLUDE_PATH"] = os.pathsep.join(
-            filter(None, [self.my_shell.env.get("CPLUS_INCLUDE_PATH", ""), ClangReplConfig.get_cpp_include()])
+            filter(None, [self.my_shell.env.get("CPLUS_INCLUDE_PATH", ""), toolchain['cpp_include']])
         )
+
+        # an install made with lazy extraction writes the headers of a cell right before it runs
+        self.lazy_toolchain = open_lazy(ClangReplConfig.get_install_dir()) \
+            if ClangReplConfig.USER_DEFINED_INSTALL_PATH is None else None
+
+        self.shell_pool = ShellPool.for_key((tuple(self.my_shell.args), ClangReplConfig.platform()),
+                                            self._create_shell,
+                                            get_arg_value('pool-size', ClangReplConfig.POOL_SIZE, int))
+        self._init_session()
         if not ClangReplKernel.ClangReplKernel_InTest:
-            self.my_shell.run()
+            # kernel_info and the other requests are answered while clang-repl boots, the first cell waits for it
+            self.start_bootstrap()
+        else:
+            self.shell_ready.set()
+
+    def _init_session(self):
+        # the per session state and the '--name=value' options, in one place for every way to make a kernel
+        self.shell_ready = threading.Event()
+        self.bootstrap_error = None
+        self.bootstrap_time = None
+        self.shutting_down = False
+        self.output_flush_interval = get_arg_value('output-flush-interval', ClangReplConfig.OUTPUT_FLUSH_INTERVAL,
+                                                   float)
+        self.output_flush_bytes = get_arg_value('output-flush-bytes', ClangReplConfig.OUTPUT_FLUSH_BYTES, int)
+        self.output_lines_produced = 0
+        self.output_messages_sent = 0
+        self.output_limit = get_arg_value('output-limit', ClangReplConfig.OUTPUT_LIMIT, int)
+        self.cell_timeout = get_arg_value('timeout', ClangReplConfig.CELL_TIMEOUT, float)
+        self.session_stats = SessionStats()
+        self.last_metrics = None
+        self.journal = SessionJournal(self.my_shell.args)
+        self.selective_replay = get_arg_value('selective-replay', ClangReplConfig.SELECTIVE_REPLAY,
+                                              lambda value: value not in ('0', 'false', 'False'))
+
+    def _create_shell(self):
+        if os.name == 'nt':
+            shell = WinShell(ClangReplConfig.platform())
+        else:
+            shell = BashShell(ClangReplConfig.platform())
+        shell.args = list(self.my_shell.args)
+        shell.env = self.my_shell.env
+        shell._prog, shell.tool_found = self.my_shell._prog, self.my_shell.tool_found
+        return shell
+
+    def start_bootstrap(self):
+        self.shell_ready.clear()
+        self.bootstrap_error = None
+        threading.Thread(target=self._bootstrap_shell, daemon=True).start()
+
+    def _bootstrap_shell(self):
+        started = time.perf_counter()
+        try:
+            self.my_shell.prog()
+            shell = self.shell_pool.acquire()
+            if self.shutting_down:
+                shell.kill()
+            else:
+                self.my_shell = shell
+        except Exception as e:
+            self.bootstrap_error = e
+        self.bootstrap_time = time.perf_counter() - started
+        self.shell_ready.set()
+
+    def wait_shell(self, send_status):
+        """Blocks until the background bootstrap is done and returns an error reply if it failed; the wait is
+        reported through ``send_status`` every BOOTSTRAP_PROGRESS_INTERVAL seconds."""
+        started = time.perf_counter()
+        waited = False
+        while not self.shell_ready.wait(ClangReplConfig.BOOTSTRAP_PROGRESS_INTERVAL):
+            waited = True
+            send_status('Starting clang-repl... %.0f s\n' % (time.perf_counter() - started))
+        if self.bootstrap_error is not None:
+            error = self.bootstrap_error
+            # the next cell tries again
+            self.start_bootstrap()
+            return self._error_reply('ClangReplStartError', 'clang-repl could not be started: %s' % error)
+        if waited:
+            send_status('clang-repl is ready after %.1f s\n' % self.bootstrap_time)
+        return None
+
+    def restart_shell(self):
+        self.my_shell.kill()
+        self.my_shell = self.shell_pool.acquire()
 
     def do_shutdown(self, restart):
         """Override in subclasses to do things when the frontend shuts down the
         kernel.
         """
-        self.my_shell.kill_and_run()
+        if restart:
+            self.shell_ready.wait()
+            try:
+                self.restart_shell()
+            except Exception as e:
+                # the shutdown is answered, the next cell reports the error and tries again
+                self.bootstrap_error = e
+        else:
+            # a bootstrap still running kills its shell once it has it
+            self.shutting_down = True
+            self.my_shell.kill()
+            self.shell_pool.close()
         return {"status": "ok", "restart": restart}
 
-    def do_execute(self, code, silent, store_history=True, user_expressions=None, allow_stdin=False, *, cell_id=None,
-                   custom_send_response=None,
-                   **kwargs):
-        def _send_response(msg):
-            stream_content = {'name': 'stdout', 'text': msg}
-            self.send_response(self.iopub_socket, 'stream', stream_content)
+    def _error_reply(self, ename, evalue):
+        return {
+            'status': 'error',
+            'execution_count': self.execution_count,
+            'ename': ename,
+            'evalue': evalue,
+            'traceback': [ename + ': ' + evalue],
+        }
+
+    def pre_handler_hook(self):
+        # SIGINT, from the frontend or from interrupt_request, goes to clang-repl instead of raising in the kernel
+        self.saved_sigint_handler = signal.signal(signal.SIGINT, self._relay_interrupt)
+
+    def post_handler_hook(self):
+        signal.signal(signal.SIGINT, self.saved_sigint_handler)
 
-        send_response = custom_send_response if custom_send_response is not None else _send_response
+    def _relay_interrupt(self, signum, frame):
+        self.my_shell.interrupt()
 
+    @staticmethod
+    def transform_code(code):
+        if code.lstrip().startswith('%%timeit'):
+            # every timed cell defines its own functions, clang-repl does not allow redefinitions
+            ClangReplKernel.timeit_count += 1
+            return make_timeit_code(code, ClangReplKernel.timeit_count)
         if code.strip().startswith('%<<'):
             code = code.strip()[3:]
             code = code[:-1] if code.endswith(';') else code
             code = "std::cout << " + code + " << std::endl;"
         if ClangReplConfig.PLATFORM_NAME_ENUM == PlatformPath.Platform.Linux:
             code.replace("std::cout", "pcout")
-        # self.execution_count += 1
-        self.my_shell.do_execute(code, send_response)
+        return code
+
+    def _send_stream(self, msg):
+        stream_content = {'name': 'stdout', 'text': msg}
+        self.send_response(self.iopub_socket, 'stream', stream_content)
 
+    @staticmethod
+    def parse_timeout_magic(code):
+        # '%timeout SECONDS' on the first line of a cell overrides the kernel wide timeout, 0 disables it
+        stripped = code.lstrip()
+        if not stripped.startswith('%timeout'):
+            return None, code
+        first_line, _, rest = stripped.partition('\n')
+        value = first_line[len('%timeout'):].strip()
+        try:
+            timeout = float(value)
+        except ValueError:
+            raise ValueError('%timeout expects a number of seconds, got: ' + repr(value))
+        return timeout, rest
+
+    def stats_report(self):
+        extra = {'shell pool': self.shell_pool.stats(),
+                 'bootstrap': '%.2f s' % self.bootstrap_time if self.bootstrap_time is not None else 'n/a',
+                 'stream messages': '%d for %d output lines' % (self.output_messages_sent, self.output_lines_produced)}
+        return self.session_stats.report(extra)
+
+    def _replay_hint(self):
+        if len(self.journal) == 0:
+            return ''
+        return ', %%restart --replay runs the %d cells of the lost one again' % len(self.journal)
+
+    def restart_magic(self, replay, send_response):
+        """``%restart`` starts a new clang-repl and forgets the journal; ``%restart --replay`` sends the journaled
+        cells to the new one in one submission with their output suppressed."""
+        self.restart_shell()
+        if not replay:
+            self.journal.clear()
+            send_response('clang-repl restarted\n')
+        elif len(self.journal) > 0:
+            elapsed, error = self.replay(self.journal.cells)
+            if error is not None:
+                return error
+            send_response('Replayed %d cells in %.2f s, they took %.2f s when they ran\n'
+                          % (len(self.journal), elapsed, self.journal.original_time()))
+        else:
+            send_response('clang-repl restarted, nothing to replay\n')
         return {
             'status': 'ok',
-            # The base class increments the execution count
             'execution_count': self.execution_count,
             'payload': [],
             'user_expressions': {},
         }
 
-    def do_execute_sync(self, code):
-
-        if code.strip().startswith('%<<'):
-            code = code.strip()[3:]
-            code = code[:-1] if code.endswith(';') else code
-            code = "std::cout << " + code + " << std::endl;"
-        if ClangReplConfig.PLATFORM_NAME_ENUM == PlatformPath.Platform.Linux:
-            code.replace("std::cout", "pcout")
+    def replay(self, entries):
+        """Sends journal entries to clang-repl in one submission with their output suppressed; returns the seconds
+        it took and an error reply if clang-repl did not survive it, after which the journal is empty."""
+        started = time.perf_counter()
+        output = []
+        if len(entries) > 0:
+            self.my_shell.do_execute(replay_code(entries), output.append, 0)
+        elapsed = time.perf_counter() - started
+        if self.my_shell.is_alive():
+            return elapsed, None
+        self.restart_shell()
+        self.journal.clear()
+        return elapsed, self._error_reply('ReplayError', 'clang-repl exited during the replay, a new session was '
+                                                         'started: ' + ''.join(output)[-1000:])
+
+    def prepare_edit(self, code, cell_id):
+        """For a cell that redefines a journaled cell: restarts clang-repl and replays the cells that run before the
+        new code. Returns (edited index, replayed before, to replay after, skipped, dependents, replay seconds),
+        None for a new cell."""
+        edited = find_edited(self.journal.cells, code, cell_id)
+        if edited is None:
+            return None
+        if len(analyze(self.journal.cells[edited].code)[0]) == 0:
+            # the old code defined nothing, clang-repl can take the new code as it is
+            return edited, None, [], [], [], 0.0
+        before, after, skipped, dependents = DependencyIndex([entry.code for entry in self.journal.cells]).plan(
+            edited, code)
+        self.restart_shell()
+        elapsed, error = self.replay([self.journal.cells[idx] for idx in before])
+        if error is not None:
+            raise Exception(error['evalue'])
+        return edited, before, after, skipped, dependents, elapsed
+
+    def finish_edit(self, edit, code, seconds, cell_id, succeeded, send_status):
+        """Replays the cells after the edited one and makes the journal what the new clang-repl has run."""
+        edited, before, after, skipped, dependents, elapsed = edit
+        entries = self.journal.cells
+        if before is None:
+            del entries[edited]
+            if succeeded:
+                self.journal.record(code, seconds, cell_id, self.execution_count)
+            return None
+        # without the new code the cells that use it would only fail
+        after = after if succeeded else [idx for idx in after if idx not in dependents]
+        if len(after) > 0:
+            after_elapsed, error = self.replay([entries[idx] for idx in after])
+            if error is not None:
+                return error
+            elapsed += after_elapsed
+        # the journal in the order the new clang-repl ran the cells
+        self.journal.cells = [entries[idx] for idx in before]
+        if succeeded:
+            self.journal.record(code, seconds, cell_id, self.execution_count)
+        self.journal.cells += [entries[idx] for idx in after]
+
+        def labels(indexes):
+            return ', '.join(entries[idx].label() for idx in indexes) or 'none'
+
+        report = 'Redefined %s: restarted clang-repl and replayed %s before it and %s after it in %.2f s' % (
+            entries[edited].label(), labels(before), labels(after), elapsed)
+        if len(skipped) > 0:
+            report += '; %s only printed and were not run again, %.2f s saved' % (
+                labels(skipped), sum(entries[idx].seconds for idx in skipped))
+        if not succeeded and len(dependents) > 0:
+            report += '; the new code failed, %s that use it were not replayed' % labels(dependents)
+        send_status(report + '\n')
+        return None
+
+    def _send_status(self, msg):
+        self.send_response(self.iopub_socket, 'stream', {'name': 'stderr', 'text': msg})
+
+    def execute_code(self, code, send_response, send_status=None, cell_id=None):
+        """Runs a cell on the calling thread and blocks until clang-repl is back at its prompt. Waiting for the
+        bootstrap is reported through ``send_status``, the cell output by default."""
+        self.last_metrics = None
+        if code.strip() == '%stats':
+            send_response(self.stats_report())
+            return {
+                'status': 'ok',
+                'execution_count': self.execution_count,
+                'payload': [],
+                'user_expressions': {},
+            }
+        try:
+            timeout, code = self.parse_timeout_magic(code)
+            replay = parse_restart_magic(code)
+            journaled = is_journaled(code)
+            code = self.transform_code(code)
+        except ValueError as e:
+            return self._error_reply('UsageError', str(e))
+        if self.lazy_toolchain is not None:
+            try:
+                self.lazy_toolchain.ensure_headers(cell_includes(code))
+            except Exception as e:
+                return self._error_reply('LazyExtractError', 'the headers of the cell could not be extracted: %s' % e)
+        error = self.wait_shell(send_status if send_status is not None else send_response)
+        if error is not None:
+            return error
+        if replay is not None:
+            return self.restart_magic(replay, send_response)
+        edit = None
+        if journaled and self.selective_replay:
+            try:
+                edit = self.prepare_edit(code, cell_id)
+            except Exception as e:
+                return self._error_reply('ReplayError', str(e))
+        if timeout is None:
+            timeout = self.cell_timeout
         # self.execution_count += 1
-        output = self.my_shell.do_execute_sync(code)
+        budget = OutputBudget(send_response, self.output_limit)
+        diagnostics = DiagnosticScanner(budget.write)
+        try:
+            self.my_shell.do_execute(code, diagnostics.write, timeout)
+        finally:
+            # the spill file is closed and reported even if the cell could not be run
+            budget.close()
+        self.last_metrics = self.my_shell.metrics
+        self.session_stats.add(self.last_metrics)
+
+        interrupted = self.my_shell.interrupted
+        timed_out = self.my_shell.timed_out
+        elapsed = self.my_shell.elapsed
+        # a cell clang-repl rejected left nothing behind to replay
+        succeeded = self.my_shell.is_alive() and not timed_out and not interrupted and not diagnostics.failed
+        if edit is not None:
+            error = self.finish_edit(edit, code, self.last_metrics.prompt, cell_id, succeeded,
+                                     send_status if send_status is not None else send_response)
+            if error is not None:
+                return error
+        elif journaled and succeeded:
+            self.journal.record(code, self.last_metrics.prompt, cell_id, self.execution_count)
+        if not self.my_shell.is_alive():
+            self.restart_shell()
+            if timed_out:
+                return self._error_reply('TimeoutError', 'cell exceeded the %g s timeout, clang-repl was killed after '
+                                                         '%.1f s and a new session was started' % (timeout, elapsed)
+                                         + self._replay_hint())
+            if interrupted:
+                return self._error_reply('KeyboardInterrupt', 'clang-repl was stopped by the interrupt, '
+                                                              'a new session was started' + self._replay_hint())
+            return self._error_reply('ClangReplExited', 'clang-repl exited, a new session was started'
+                                     + self._replay_hint())
+        if timed_out:
+            return self._error_reply('TimeoutError', 'cell exceeded the %g s timeout and was interrupted after %.1f s'
+                                     % (timeout, elapsed))
+        if interrupted:
+            return self._error_reply('KeyboardInterrupt', 'execution interrupted')
 
         return {
             'status': 'ok',
@@ -700,9 +1191,55 @@ class ClangReplKernel(Kernel):
             'execution_count': self.execution_count,
             'payload': [],
             'user_expressions': {},
-            'output': output
         }
 
+    async def do_execute(self, code, silent, store_history=True, user_expressions=None, allow_stdin=False, *,
+                         cell_id=None, custom_send_response=None, **kwargs):
+        # the blocking pipe I/O runs on a worker thread while the event loop keeps serving IOPub, interrupts and
+        # other requests; output lines are coalesced into few stream messages on the way
+        send_response = custom_send_response if custom_send_response is not None else self._send_stream
+        loop = asyncio.get_running_loop()
+
+        def _schedule(delay, callback):
+            loop.call_soon_threadsafe(loop.call_later, delay, callback)
+
+        if self.output_flush_interval > 0:
+            aggregator = OutputAggregator(send_response, self.output_flush_bytes, self.output_flush_interval,
+                                          _schedule)
+        else:
+            aggregator = OutputAggregator(lambda msg: loop.call_soon_threadsafe(send_response, msg), 0)
+        # the bootstrap progress goes to stderr, apart from the cell output
+        send_status = None if custom_send_response is not None else \
+            lambda msg: loop.call_soon_threadsafe(self._send_status, msg)
+        started = time.perf_counter()
+        try:
+            reply = await loop.run_in_executor(None, self.execute_code, code, aggregator.write, send_status,
+                                               cell_id)
+        finally:
+            # the prompt is back, whatever is still pending goes out now
+            aggregator.close()
+            self.output_lines_produced += aggregator.lines_produced
+            self.output_messages_sent += aggregator.messages_sent
+        if self.last_metrics is not None:
+            # kernel_wall minus prompt is the time spent in the kernel around clang-repl
+            self.last_metrics.kernel_wall = time.perf_counter() - started
+        if reply['status'] == 'error' and custom_send_response is None:
+            self.send_response(self.iopub_socket, 'error',
+                               {key: reply[key] for key in ('ename', 'evalue', 'traceback')})
+        return reply
+
+    def finish_metadata(self, parent, metadata, reply_content):
+        metadata = super().finish_metadata(parent, metadata, reply_content)
+        if self.last_metrics is not None:
+            metadata['clang_repl_metrics'] = self.last_metrics.as_dict()
+        return metadata
+
+    def do_execute_sync(self, code):
+        response_message = []
+        reply = self.execute_code(code, response_message.append)
+        reply['output'] = ''.join(response_message)
+        return reply
+
     def do_clear(self):
         pass
 
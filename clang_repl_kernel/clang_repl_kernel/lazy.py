@@ -0,0 +1,164 @@
+import fnmatch
+import os
+import posixpath
+import re
+import threading
+import zipfile
+
+from .extract import extract_parallel, write_marker
+
+# the zip the install was made from, its presence marks a lazy install
+LAZY_ZIP_NAME = 'bundle.zip'
+TRACE_FILE_NAME = 'lazy_trace.txt'
+
+# what clang-repl needs before any header is parsed: the tools and the shared libraries they load, the ones the
+# kernel loads with '%lib' among them, from <triple>/lib like ClangReplConfig.get_dynlib_dir()
+MANIFEST = [
+    'bin/clang-repl', 'bin/clang-repl.exe', 'bin/clang', 'bin/clang.exe', 'bin/*.dll',
+    'lib/*.so', 'lib/*.so.*', 'lib/*.dylib', 'lib/*.dll',
+    '*/lib/*.so', '*/lib/*.so.*', '*/lib/*.dylib', '*/lib/*.dll', '*/bin/*.dll',
+    # the clang builtin headers, small and reached through '#include_next' and the compiler itself
+    'lib/clang/*/include/*',
+]
+
+_INCLUDE = re.compile(rb'^[ \t]*#[ \t]*(include|include_next|import)[ \t]*([<"])([^>"\r\n]+)[>"]', re.MULTILINE)
+_CELL_INCLUDE = re.compile(r'^[ \t]*#[ \t]*include[ \t]*[<"]([^>"\r\n]+)[>"]', re.MULTILINE)
+
+
+def cell_includes(code):
+    return _CELL_INCLUDE.findall(code)
+
+
+class LazyToolchain:
+    """A toolchain installed from a kept zip with only the files that are used written to disk.
+
+    ``install`` writes the MANIFEST files and whatever the trace file lists. ``ensure_headers`` writes a header
+    together with every header it includes, found by following the ``#include`` lines inside the zip, right before
+    a cell needs them, and adds them to the trace so the next install of this toolchain writes them up front.
+    """
+
+    def __init__(self, zip_path, root):
+        self.zip_path = zip_path
+        self.root = root
+        self.trace_path = os.path.join(root, TRACE_FILE_NAME)
+        self._names = None
+        self._include_roots = None
+        self._resolved = set()
+        self._lock = threading.Lock()
+
+    @property
+    def names(self):
+        if self._names is None:
+            with zipfile.ZipFile(self.zip_path, 'r') as zip_ref:
+                self._names = set(info.filename for info in zip_ref.infolist() if not info.is_dir())
+        return self._names
+
+    def include_roots(self):
+        # the directories clang searches: include/, include/c++/v1/, include/<triple>/c++/v1/, lib/clang/N/include/
+        if self._include_roots is None:
+            roots = set()
+            for name in self.names:
+                parts = name.split('/')
+                for idx, part in enumerate(parts[:-1]):
+                    if part == 'include':
+                        roots.add('/'.join(parts[:idx + 1]) + '/')
+                        if parts[idx + 1:idx + 3] == ['c++', 'v1']:
+                            roots.add('/'.join(parts[:idx + 3]) + '/')
+                        elif len(parts) > idx + 4 and parts[idx + 2:idx + 4] == ['c++', 'v1']:
+                            roots.add('/'.join(parts[:idx + 4]) + '/')
+            # libc++, then the clang builtin headers, then the C headers, the order clang uses
+            self._include_roots = sorted(roots, key=lambda root: (
+                0 if root.endswith('c++/v1/') else 1 if root.startswith('lib/clang/') else 2, root))
+        return self._include_roots
+
+    def resolve(self, header, quoted_from=None, next_after=None):
+        """The member ``header`` names; ``next_after`` is the member with an ``#include_next``, the search then
+        starts at the root after the one that member was found in."""
+        if quoted_from is not None:
+            candidate = posixpath.normpath(posixpath.join(posixpath.dirname(quoted_from), header))
+            if candidate in self.names:
+                return candidate
+        roots = self.include_roots()
+        if next_after is not None:
+            containing = [idx for idx, root in enumerate(roots) if next_after.startswith(root)]
+            if len(containing) > 0:
+                # the innermost root, 'include/c++/v1/' rather than 'include/'
+                roots = roots[max(containing, key=lambda idx: len(roots[idx])) + 1:]
+        for root in roots:
+            if root + header in self.names:
+                return root + header
+        return None
+
+    def header_closure(self, headers):
+        """Members of the given headers and of all headers they include, conditional includes too."""
+        found = set()
+        with zipfile.ZipFile(self.zip_path, 'r') as zip_ref:
+            pending = [name for name in (self.resolve(header) for header in headers) if name is not None]
+            while pending:
+                name = pending.pop()
+                if name in found:
+                    continue
+                found.add(name)
+                for directive, kind, header in _INCLUDE.findall(zip_ref.read(name)):
+                    header = header.decode('utf-8', errors='replace')
+                    if directive == b'include_next':
+                        member = self.resolve(header, next_after=name)
+                    else:
+                        member = self.resolve(header, name if kind == b'"' else None)
+                    if member is not None and member not in found:
+                        pending.append(member)
+        return found
+
+    def materialize(self, names):
+        missing = [name for name in names if not os.path.exists(os.path.join(self.root, *name.split('/')))]
+        if len(missing) > 0:
+            extract_parallel(self.zip_path, self.root, names=missing)
+        return missing
+
+    def read_trace(self):
+        try:
+            with open(self.trace_path) as f:
+                return [line.strip() for line in f if line.strip()]
+        except OSError:
+            return []
+
+    def record(self, names):
+        known = set(self.read_trace())
+        new = sorted(set(names) - known)
+        if len(new) > 0:
+            with open(self.trace_path, 'a') as f:
+                f.write(''.join(name + '\n' for name in new))
+
+    def ensure_headers(self, headers):
+        """Writes the given headers and their includes to disk if they are not there yet; returns the new files."""
+        headers = [header for header in headers if header not in self._resolved]
+        if len(headers) == 0:
+            return []
+        with self._lock:
+            names = self.header_closure(headers)
+            missing = self.materialize(names)
+            self.record(names)
+            self._resolved.update(headers)
+        return missing
+
+    def install(self, headers=(), trace=None):
+        """Writes the manifest, the traced files and the closure of ``headers``, then the done marker."""
+        manifest = set(name for name in self.names if any(fnmatch.fnmatch(name, pattern) for pattern in MANIFEST))
+        wanted = set(manifest)
+        if trace is not None and os.path.abspath(trace) != os.path.abspath(self.trace_path):
+            with open(trace) as f:
+                self.record(line.strip() for line in f if line.strip())
+        wanted.update(name for name in self.read_trace() if name in self.names)
+        wanted.update(self.header_closure(headers))
+        timings = extract_parallel(self.zip_path, self.root, names=wanted)
+        # the manifest is written by every install anyway
+        self.record(name for name in wanted if name not in manifest)
+        write_marker(os.path.join(self.root, 'done'), 'lazy')
+        return timings
+
+
+def open_lazy(root):
+    """Returns the LazyToolchain of an install made with lazy extraction, None for a fully extracted one."""
+    if root is None or not os.path.exists(os.path.join(root, LAZY_ZIP_NAME)):
+        return None
+    return LazyToolchain(os.path.join(root, LAZY_ZIP_NAME), root)
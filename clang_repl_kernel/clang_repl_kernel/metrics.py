@@ -0,0 +1,133 @@
+import os
+import time
+
+# upper bounds in seconds of the wall time buckets shown by %stats
+HISTOGRAM_BUCKETS = [0.001, 0.01, 0.1, 1.0, 10.0, 60.0]
+
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = _PAGE_SIZE = None
+
+
+def read_proc_usage(pid):
+    """Returns (cpu seconds, resident bytes) of a process from /proc, or None where /proc is not available."""
+    if _CLOCK_TICKS is None or pid is None:
+        return None
+    try:
+        with open('/proc/%d/stat' % pid, 'rb') as f:
+            stat = f.read()
+        with open('/proc/%d/statm' % pid, 'rb') as f:
+            statm = f.read()
+    except OSError:
+        return None
+    # the command name may contain spaces, the fields are counted from its closing parenthesis
+    fields = stat[stat.rindex(b')') + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS  # utime and stime
+    rss = int(statm.split()[1]) * _PAGE_SIZE
+    return cpu, rss
+
+
+class CellMetrics:
+    """Timings and resource usage of one cell as seen from the kernel.
+
+    ``first_byte`` and ``prompt`` are seconds since the first line was written to clang-repl; cpu and rss deltas
+    cover clang-repl itself, so they include parsing, code generation and the user code it ran.
+    """
+
+    def __init__(self, pid=None):
+        self.pid = pid
+        self.started = time.perf_counter()
+        self.first_byte = None
+        self.prompt = None
+        self.output_bytes = 0
+        self.output_lines = 0
+        self.kernel_wall = None
+        self._usage = read_proc_usage(pid)
+        self.cpu = None
+        self.rss = None
+        self.rss_delta = None
+
+    def count_output(self, text):
+        self.output_bytes += len(text.encode('utf-8'))
+        self.output_lines += text.count('\n')
+
+    def finish(self, first_read=None):
+        self.prompt = time.perf_counter() - self.started
+        if first_read is not None:
+            self.first_byte = max(0.0, first_read - self.started)
+        usage = read_proc_usage(self.pid)
+        if self._usage is not None and usage is not None:
+            self.cpu = usage[0] - self._usage[0]
+            self.rss = usage[1]
+            self.rss_delta = usage[1] - self._usage[1]
+
+    def as_dict(self):
+        return {
+            'first_byte': self.first_byte,
+            'prompt': self.prompt,
+            'kernel_wall': self.kernel_wall,
+            'output_bytes': self.output_bytes,
+            'output_lines': self.output_lines,
+            'cpu': self.cpu,
+            'rss': self.rss,
+            'rss_delta': self.rss_delta,
+        }
+
+
+class SessionStats:
+    """Keeps the metrics of every cell of a session and renders them for the %stats magic."""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.cells = []
+
+    def add(self, metrics):
+        self.cells.append(metrics)
+
+    def histogram(self, key='prompt'):
+        counts = [0] * (len(self.buckets) + 1)
+        for cell in self.cells:
+            value = getattr(cell, key)
+            if value is None:
+                continue
+            idx = 0
+            while idx < len(self.buckets) and value >= self.buckets[idx]:
+                idx += 1
+            counts[idx] += 1
+        return counts
+
+    @staticmethod
+    def _bucket_label(low, high):
+        def fmt(seconds):
+            return '%gms' % (seconds * 1000) if seconds < 1 else '%gs' % seconds
+        if low is None:
+            return '< ' + fmt(high)
+        if high is None:
+            return '>= ' + fmt(low)
+        return fmt(low) + ' - ' + fmt(high)
+
+    def report(self, extra=None):
+        lines = ['cells: %d' % len(self.cells)]
+        if len(self.cells) > 0:
+            prompt = [cell.prompt for cell in self.cells if cell.prompt is not None]
+            first_byte = [cell.first_byte for cell in self.cells if cell.first_byte is not None]
+            cpu = [cell.cpu for cell in self.cells if cell.cpu is not None]
+            lines.append('time to prompt: total %.3f s, max %.3f s' % (sum(prompt), max(prompt, default=0)))
+            if len(first_byte) > 0:
+                lines.append('time to first byte: mean %.3f s' % (sum(first_byte) / len(first_byte)))
+            if len(cpu) > 0:
+                lines.append('clang-repl cpu: total %.3f s' % sum(cpu))
+            lines.append('output: %d bytes, %d lines' % (sum(cell.output_bytes for cell in self.cells),
+                                                        sum(cell.output_lines for cell in self.cells)))
+            counts = self.histogram()
+            width = max(counts)
+            bounds = [None] + self.buckets + [None]
+            lines.append('time to prompt histogram:')
+            for idx, count in enumerate(counts):
+                label = self._bucket_label(bounds[idx], bounds[idx + 1])
+                lines.append('  %-14s %4d %s' % (label, count, '#' * (count * 40 // width if width else 0)))
+        for name, value in (extra or {}).items():
+            lines.append('%s: %s' % (name, value))
+        return '\n'.join(lines)
@@ -0,0 +1,138 @@
+import re
+import tempfile
+import threading
+
+
+class OutputAggregator:
+    """Coalesces output lines of a cell into few IOPub stream messages.
+
+    ``write`` may be called from any thread. Pending text goes out once ``max_bytes`` are buffered or ``interval``
+    seconds after the first pending line, whichever comes first, and on ``close`` when the prompt is back.
+    ``schedule(delay, callback)`` must run ``callback`` on the thread that owns ``send_response`` after ``delay``
+    seconds; without it text is only sent when the buffer is full or closed.
+    """
+
+    def __init__(self, send_response, max_bytes=64 * 1024, interval=0.05, schedule=None):
+        self.send_response = send_response
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.schedule = schedule
+        self.lines_produced = 0
+        self.messages_sent = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._scheduled = False
+        self._flush_now_scheduled = False
+        self._open_line = False
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self._pending.append(text)
+            self._pending_bytes += len(text)
+            # the reader hands over pieces of lines, a line counts once its newline arrives or on close
+            self.lines_produced += text.count('\n')
+            if len(text) > 0:
+                self._open_line = not text.endswith('\n')
+            full = self._pending_bytes >= self.max_bytes
+            first = not self._scheduled
+            self._scheduled = True
+            # one immediate flush is enough for everything that comes before it runs
+            flush_now = full and not self._flush_now_scheduled
+            if flush_now:
+                self._flush_now_scheduled = True
+        if self.schedule is None:
+            if full:
+                self.flush()
+        elif flush_now:
+            self.schedule(0, self.flush)
+        elif first:
+            self.schedule(self.interval, self.flush)
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._pending_bytes = 0
+            self._scheduled = False
+            self._flush_now_scheduled = False
+            if len(pending) > 0:
+                self.messages_sent += 1
+        if len(pending) > 0:
+            self.send_response(''.join(pending))
+
+    def close(self):
+        with self._lock:
+            if self._open_line:
+                self.lines_produced += 1
+                self._open_line = False
+        self.flush()
+
+
+
+class OutputBudget:
+    """Streams the output of a cell until ``limit`` bytes were sent, the remainder is spilled to a temporary file.
+
+    ``close`` reports the path and size of the spill file to the notebook. A limit of 0 disables the budget.
+    """
+
+    def __init__(self, send_response, limit, spill_dir=None):
+        self.send_response = send_response
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.sent_bytes = 0
+        self.spilled_bytes = 0
+        self.spill = None
+
+    @property
+    def spill_path(self):
+        return self.spill.name if self.spill is not None else None
+
+    def write(self, text):
+        if self.spill is None:
+            data = text.encode('utf-8')
+            if self.limit <= 0 or self.sent_bytes + len(data) <= self.limit:
+                self.sent_bytes += len(data)
+                self.send_response(text)
+                return
+            # cut at the remaining budget without splitting a character
+            head = data[:self.limit - self.sent_bytes].decode('utf-8', errors='ignore')
+            if len(head) > 0:
+                self.sent_bytes += len(head.encode('utf-8'))
+                self.send_response(head)
+            text = text[len(head):]
+            self.spill = tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', prefix='clang_repl_output_',
+                                                     suffix='.txt', dir=self.spill_dir, delete=False)
+        self.spill.write(text)
+        self.spilled_bytes += len(text.encode('utf-8'))
+
+    def close(self):
+        if self.spill is None:
+            return
+        self.spill.close()
+        self.send_response('\n[output limit of %d bytes reached, the remaining %d bytes were written to %s]' %
+                           (self.limit, self.spilled_bytes, self.spill.name))
+
+
+# how clang-repl reports a cell it rejected: 'input_line_3:1:1: error: ...' and a closing 'error: Parsing failed.';
+# a program printing 'error: ...' itself is not matched
+_DIAGNOSTIC = re.compile(r'^(?:input_line_\d+:\d+:\d+: (?:fatal )?error: |error: Parsing failed\.$)', re.MULTILINE)
+
+
+class DiagnosticScanner:
+    """Passes the output of a cell on to ``send_response`` and notes whether clang-repl reported an error in it.
+
+    Lines may arrive in pieces, the unfinished last line is kept to be scanned with the rest of it.
+    """
+
+    def __init__(self, send_response):
+        self.send_response = send_response
+        self.failed = False
+        self._partial = ''
+
+    def write(self, text):
+        if not self.failed:
+            lines = self._partial + text
+            self.failed = _DIAGNOSTIC.search(lines) is not None
+            self._partial = lines[lines.rfind('\n') + 1:]
+        self.send_response(text)
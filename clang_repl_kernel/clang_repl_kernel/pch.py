@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import subprocess
+
+PCH_DIR_NAME = 'pch'
+PCH_BUILD_TIMEOUT = 300
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [os.path.realpath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def split_preamble(statements):
+    # type declarations can be precompiled, anything that defines or runs something stays in the JIT
+    declarations = []
+    runtime = []
+    for statement in statements:
+        if statement.lstrip().startswith(('class ', 'struct ')):
+            declarations.append(statement)
+        else:
+            runtime.append(statement)
+    return declarations, runtime
+
+
+def make_header(headers, declarations):
+    lines = ['#include <' + header + '>' for header in headers]
+    lines.extend(declarations)
+    return '\n'.join(lines) + '\n'
+
+
+class PrecompiledPreamble:
+    """Precompiled header of the bootstrap headers and declarations for one clang-repl setup.
+
+    It lives under ``<base_dir>/pch/<key>`` where the key hashes the clang-repl and clang binaries, the compile
+    flags, the platform and the header text, so a changed toolchain or ``--std`` gets a fresh build.
+    """
+
+    def __init__(self, repl_program, clang_program, compile_flags, platform_name, header_text, base_dir):
+        self.repl_program = repl_program
+        self.clang_program = clang_program
+        self.compile_flags = list(compile_flags)
+        self.platform_name = platform_name
+        self.header_text = header_text
+        self.key = self._make_key()
+        self.dir = os.path.join(base_dir, PCH_DIR_NAME, self.key[:16])
+        self.header_path = os.path.join(self.dir, 'preamble.h')
+        self.pch_path = os.path.join(self.dir, 'preamble.pch')
+        self.key_path = os.path.join(self.dir, 'key')
+        self.failed_path = os.path.join(self.dir, 'failed')
+
+    def _make_key(self):
+        key = {
+            'repl': _file_signature(self.repl_program),
+            'clang': _file_signature(self.clang_program),
+            'flags': self.compile_flags,
+            'platform': self.platform_name,
+            'header': hashlib.sha256(self.header_text.encode('utf-8')).hexdigest(),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_failed(self):
+        return os.path.exists(self.failed_path)
+
+    def is_valid(self):
+        if self.is_failed() or not os.path.isfile(self.pch_path) or not os.path.isfile(self.key_path):
+            return False
+        with open(self.key_path, 'r') as f:
+            return f.read().strip() == self.key
+
+    def build_command(self, output_path):
+        # clang-repl parses with incremental extensions on, the PCH language options have to match
+        return [self.clang_program, '-x', 'c++-header'] + self.compile_flags + \
+            ['-Xclang', '-fincremental-extensions', self.header_path, '-o', output_path]
+
+    def _write_atomic(self, path, data):
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def build(self, env=None):
+        tmp_pch_path = self.pch_path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            self._write_atomic(self.header_path, self.header_text)
+        except OSError:
+            # a cache directory this user cannot write, the headers are parsed instead
+            return False
+        try:
+            result = subprocess.run(self.build_command(tmp_pch_path), env=env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, timeout=PCH_BUILD_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.mark_failed(str(e))
+            return False
+        if result.returncode != 0 or not os.path.isfile(tmp_pch_path):
+            self.mark_failed(result.stdout.decode('utf-8', errors='replace'))
+            return False
+        try:
+            os.replace(tmp_pch_path, self.pch_path)
+            self._write_atomic(self.key_path, self.key)
+        except OSError:
+            return False
+        return True
+
+    def ensure(self, env=None):
+        """Returns the PCH path, building it first if needed, or None when it cannot be used."""
+        try:
+            if self.is_failed():
+                return None
+            if self.is_valid() or self.build(env):
+                return self.pch_path
+        except OSError:
+            pass
+        return None
+
+    def mark_failed(self, reason):
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            self._write_atomic(self.failed_path, reason)
+        except OSError:
+            # not remembered, the next start tries again
+            pass
+
+    def repl_args(self):
+        return ['--Xcc=-include-pch', '--Xcc=' + self.pch_path]
+
+    @staticmethod
+    def for_program(repl_program, clang_name, compile_flags, platform_name, header_text, base_dir):
+        clang_program = os.path.join(os.path.dirname(repl_program), clang_name)
+        if not os.path.isfile(clang_program):
+            # only the clang from the same toolchain produces a PCH clang-repl accepts
+            return None
+        return PrecompiledPreamble(repl_program, clang_program, compile_flags, platform_name, header_text, base_dir)
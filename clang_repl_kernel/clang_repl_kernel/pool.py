@@ -0,0 +1,102 @@
+import logging
+import threading
+
+
+class ShellPool:
+    """Keeps already bootstrapped clang-repl shells ready so a restart does not wait for the preamble.
+
+    There is one pool per key, the tuple of clang-repl arguments (``--std``) and platform. ``factory`` returns a
+    configured Shell which is not started yet; spares are started in a background thread.
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, factory, size=1):
+        self.factory = factory
+        self.size = size
+        self.ready = []
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._filler = None
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def for_key(cls, key, factory, size=1):
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None or pool.closed:
+                pool = cls(factory, size)
+                cls._pools[key] = pool
+            else:
+                pool.factory = factory
+                pool.size = size
+            return pool
+
+    def _spawn(self):
+        shell = self.factory()
+        shell.run()
+        return shell
+
+    def acquire(self):
+        shell = None
+        with self._lock:
+            while len(self.ready) > 0 and shell is None:
+                shell = self.ready.pop(0)
+                if not shell.is_alive():
+                    shell = None
+            if shell is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if shell is None:
+            shell = self._spawn()
+        self.refill()
+        return shell
+
+    def refill(self):
+        with self._lock:
+            if self.closed or len(self.ready) >= self.size:
+                return
+            if self._filler is not None and self._filler.is_alive():
+                return
+            self._filler = threading.Thread(target=self._fill, daemon=True)
+            self._filler.start()
+
+    def _fill(self):
+        while True:
+            with self._lock:
+                if self.closed or len(self.ready) >= self.size:
+                    return
+            try:
+                shell = self._spawn()
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                self.logger.warning("Cannot prepare clang-repl for the pool: %s", e)
+                return
+            with self._lock:
+                if self.closed:
+                    shell.kill()
+                    return
+                self.ready.append(shell)
+
+    def wait_ready(self, timeout=None):
+        filler = self._filler
+        if filler is not None:
+            filler.join(timeout)
+        return len(self.ready)
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size, 'ready': len(self.ready), 'hits': self.hits, 'misses': self.misses,
+                    'failures': self.failures}
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            ready, self.ready = self.ready, []
+        for shell in ready:
+            shell.kill()
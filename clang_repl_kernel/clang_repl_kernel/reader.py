@@ -0,0 +1,139 @@
+import os
+import time
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_PENDING = 256 * 1024
+
+
+def utf8_boundary(data, idx):
+    # move back to the first byte of a character so a multi byte sequence is not cut in two
+    while idx > 0 and (data[idx] & 0xC0) == 0x80:
+        idx -= 1
+    return idx
+
+
+class PromptMatcher:
+    """Finds the earliest of several prompts in a growing byte buffer.
+
+    A prompt may be split across two reads, so after an unsuccessful search only the last
+    ``keep`` bytes need to be scanned again once more data arrives.
+    """
+
+    def __init__(self, prompts):
+        self.prompts = [prompt.encode('utf-8') if isinstance(prompt, str) else bytes(prompt) for prompt in prompts]
+        self.keep = max(len(prompt) for prompt in self.prompts) - 1
+
+    def search(self, data, start=0):
+        found_idx, found = -1, None
+        for prompt in self.prompts:
+            idx = data.find(prompt, start)
+            if idx != -1 and (found_idx == -1 or idx < found_idx):
+                found_idx, found = idx, prompt
+        return found_idx, found
+
+    def resume_from(self, length):
+        return max(0, length - self.keep)
+
+
+class ChunkReader:
+    """Reads the output of the REPL in large chunks straight from the pipe file descriptor.
+
+    Output in front of a prompt is handed to ``on_output(text, complete)`` in bulk: ``complete`` is True when
+    ``text`` is a block of whole lines (ending with a newline) and False for a trailing fragment.
+    Bytes following a prompt stay buffered for the next call. A line longer than ``max_pending`` bytes is handed
+    out in fragments so a child that never writes a newline cannot grow the buffer without limit.
+    """
+
+    def __init__(self, fd, prompts, chunk_size=DEFAULT_CHUNK_SIZE, max_pending=DEFAULT_MAX_PENDING):
+        self.fd = fd
+        self.matcher = PromptMatcher(prompts)
+        self.chunk_size = chunk_size
+        self.max_pending = max(max_pending, self.matcher.keep + 4)
+        self.buffer = bytearray()
+        self.eof = False
+        # perf_counter of the first read since it was last reset to None, for the time to first byte metric
+        self.first_read = None
+        self._scan_from = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def fill(self):
+        data = os.read(self.fd, self.chunk_size)
+        if len(data) == 0:
+            self.eof = True
+            return False
+        if self.first_read is None:
+            self.first_read = time.perf_counter()
+        self.buffer += data
+        return True
+
+    def _take(self, length):
+        text = self.buffer[:length].decode('utf-8', errors='replace')
+        del self.buffer[:length]
+        return text
+
+    def _emit(self, length, on_output):
+        if length == 0:
+            return
+        newline = self.buffer.rfind(b'\n', 0, length)
+        if newline != -1:
+            on_output(self._take(newline + 1), True)
+            length -= newline + 1
+        if length > 0:
+            on_output(self._take(length), False)
+
+    def read_until_prompt(self, on_output):
+        """Returns the prompt (bytes) that ended the output, or None at the end of the stream."""
+        while True:
+            idx, prompt = self.matcher.search(self.buffer, self._scan_from)
+            if idx != -1:
+                self._emit(idx, on_output)
+                del self.buffer[:len(prompt)]
+                self._scan_from = 0
+                return prompt
+            # a prompt never contains a newline, so every complete line can go out now
+            newline = self.buffer.rfind(b'\n')
+            if newline != -1:
+                on_output(self._take(newline + 1), True)
+            elif len(self.buffer) > self.max_pending:
+                # keep only what could still be the start of a prompt
+                on_output(self._take(utf8_boundary(self.buffer, len(self.buffer) - self.matcher.keep)), False)
+            self._scan_from = self.matcher.resume_from(len(self.buffer))
+            if self.eof or not self.fill():
+                self._emit(len(self.buffer), on_output)
+                return None
+
+
+class LineSender:
+    """Sends complete lines one by one the way the REPL protocol always did.
+
+    A line goes out without its line ending; the ending is put in front of the next line or fragment instead,
+    so the final line of a cell never carries a trailing newline.
+    """
+
+    def __init__(self, send_func):
+        self.send_func = send_func
+        self.last_newline = None
+
+    def __call__(self, text, complete):
+        if not complete:
+            if self.last_newline is not None:
+                text = self.last_newline + text
+                self.last_newline = None
+            if len(text) > 0:
+                self.send_func(text)
+            return
+        lines = text.split('\n')
+        lines.pop()  # text ends with a newline
+        for line in lines:
+            if line.endswith('\r'):
+                newline = '\r\n'
+                line = line[:-1]
+            else:
+                newline = '\n'
+            if self.last_newline is not None:
+                line = self.last_newline + line
+            self.last_newline = newline
+            if len(line) > 0:
+                self.send_func(line)
@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+
+
+def stamp_of(paths):
+    # the modification time of each path, None for a missing one: an install, upgrade or removal changes it
+    stamp = []
+    for path in paths:
+        try:
+            stamp.append([path, os.stat(path).st_mtime_ns])
+        except OSError:
+            stamp.append([path, None])
+    return stamp
+
+
+class ResolveCache:
+    """Toolchain locations kept in a small JSON file, each entry valid while the stamp of its paths is unchanged.
+
+    Several kernels may start at once: the file is replaced in one step and an unreadable one counts as empty.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, key):
+        entry = self._load().get(key)
+        if not isinstance(entry, dict) or 'stamp' not in entry:
+            return None
+        if stamp_of(path for path, _ in entry['stamp']) != entry['stamp']:
+            return None
+        return entry['value']
+
+    def put(self, key, value, paths):
+        entries = self._load()
+        entries[key] = {'stamp': stamp_of(paths), 'value': value}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.resolve.', dir=directory)
+        except OSError:
+            # a read-only home only costs the lookup on the next start
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.remove(tmp_path)
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from tqdm import tqdm
+
+from .extract import extract_parallel, write_marker
+
+DONE_FILE = 'done'
+HASH_BLOCK_SIZE = 1024 * 1024
+# an unfinished extraction older than this was abandoned
+STALE_EXTRACT_SECONDS = 24 * 3600
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ToolchainStore:
+    """Toolchain bundles extracted once per content hash and linked into every install that uses them.
+
+    Layout under ``root``::
+
+        bundles/<sha256>/   the extracted bundle, with a 'done' file once complete
+        names/<file name>   sha256 of the bundle last added under that name, so other installs skip the download
+        refs/<key>.json     one per linked install directory, for garbage collection
+        downloads/          where bundles are downloaded to before they are added
+
+    Installs are symlinks to the bundle directory, or trees of hardlinks where symlinks are not allowed or the
+    store is private to its user, so every kernel process maps the same files. A private store on another file
+    system is copied from.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        # seconds per phase of the last add()
+        self.timings = {}
+        self.bundles_dir = os.path.join(root, 'bundles')
+        self.names_dir = os.path.join(root, 'names')
+        self.refs_dir = os.path.join(root, 'refs')
+        self.download_dir = os.path.join(root, 'downloads')
+        for directory in (self.bundles_dir, self.names_dir, self.refs_dir, self.download_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def bundle_dir(self, digest):
+        return os.path.join(self.bundles_dir, digest)
+
+    def has(self, digest):
+        return os.path.exists(os.path.join(self.bundle_dir(digest), DONE_FILE))
+
+    def lookup(self, name):
+        try:
+            with open(os.path.join(self.names_dir, name)) as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        return digest if self.has(digest) else None
+
+    def add(self, zip_path, name=None, expected_sha256=None):
+        """Extracts a bundle unless the store already has it; returns its sha256."""
+        started = time.perf_counter()
+        digest = sha256_of(zip_path)
+        self.timings = {'verify': time.perf_counter() - started}
+        if expected_sha256 is not None and digest != expected_sha256.lower():
+            raise Exception('Checksum mismatch for %s: expected %s, got %s' % (zip_path, expected_sha256, digest))
+        if not self.has(digest):
+            # extract next to the final place and rename, a concurrent add of the same bundle cannot see half of it
+            tmp_dir = tempfile.mkdtemp(prefix=digest[:16] + '.', dir=self.bundles_dir)
+            try:
+                with tqdm(desc="Extracting", unit="file") as progress_bar:
+                    self.timings.update(extract_parallel(zip_path, tmp_dir, progress=progress_bar.update))
+                write_marker(os.path.join(tmp_dir, DONE_FILE), digest)
+                if os.path.exists(self.bundle_dir(digest)):
+                    shutil.rmtree(self.bundle_dir(digest))
+                os.replace(tmp_dir, self.bundle_dir(digest))
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                if not self.has(digest):
+                    raise
+        if name is not None:
+            with open(os.path.join(self.names_dir, name), 'w') as f:
+                f.write(digest)
+        return digest
+
+    @staticmethod
+    def _readable_by_others(path):
+        # a symlink only works for the users who may enter every directory up to the bundle, e.g. not a ~/.cache
+        if os.name == 'nt':
+            return True
+        path = os.path.abspath(path)
+        while True:
+            if not os.stat(path).st_mode & stat.S_IXOTH:
+                return False
+            parent = os.path.dirname(path)
+            if parent == path:
+                return True
+            path = parent
+
+    @staticmethod
+    def _ref_key(target):
+        return hashlib.sha256(os.path.abspath(target).encode('utf-8')).hexdigest()[:32]
+
+    def link(self, digest, target):
+        """Makes ``target`` show the bundle; an existing target directory is replaced."""
+        source = self.bundle_dir(digest)
+        if os.path.islink(target) or os.path.isfile(target):
+            os.remove(target)
+        elif os.path.isdir(target):
+            shutil.rmtree(target)
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        kind = None
+        if self._readable_by_others(source):
+            try:
+                os.symlink(source, target, target_is_directory=True)
+                kind = 'symlink'
+            except OSError:
+                # no symlink privilege, typical on Windows
+                pass
+        if kind is None:
+            # hardlinked files keep their own permissions, whoever may read the store
+            kind = 'hardlink'
+            for root, dirs, files in os.walk(source):
+                dest_root = os.path.join(target, os.path.relpath(root, source))
+                os.makedirs(dest_root, exist_ok=True)
+                for file in files:
+                    try:
+                        os.link(os.path.join(root, file), os.path.join(dest_root, file))
+                    except OSError:
+                        # the store is on another file system
+                        shutil.copy2(os.path.join(root, file), os.path.join(dest_root, file))
+                        kind = 'copy'
+        with open(os.path.join(self.refs_dir, self._ref_key(target) + '.json'), 'w') as f:
+            json.dump({'target': os.path.abspath(target), 'digest': digest, 'kind': kind}, f)
+        return kind
+
+    @staticmethod
+    def _is_live(ref, source):
+        target = ref['target']
+        if ref.get('kind') == 'symlink':
+            return os.path.islink(target) and os.path.realpath(target) == os.path.realpath(source)
+        done_file = os.path.join(target, DONE_FILE)
+        source_done = os.path.join(source, DONE_FILE)
+        return os.path.exists(done_file) and os.path.exists(source_done) and os.path.samefile(done_file,
+                                                                                                  source_done)
+
+    def references(self):
+        """Returns the digests used by installs that still exist, dropping the records of removed ones."""
+        used = set()
+        for ref_file in os.listdir(self.refs_dir):
+            path = os.path.join(self.refs_dir, ref_file)
+            try:
+                with open(path) as f:
+                    ref = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if self._is_live(ref, self.bundle_dir(ref['digest'])):
+                used.add(ref['digest'])
+            else:
+                os.remove(path)
+        return used
+
+    def gc(self):
+        """Removes the bundles no install links to anymore, along with unfinished extractions; returns their
+        digests."""
+        used = self.references()
+        removed = []
+        for entry in os.listdir(self.bundles_dir):
+            path = os.path.join(self.bundles_dir, entry)
+            if entry in used or ('.' in entry and time.time() - os.path.getmtime(path) < STALE_EXTRACT_SECONDS):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(entry)
+        for name in os.listdir(self.names_dir):
+            if self.lookup(name) is None:
+                os.remove(os.path.join(self.names_dir, name))
+        return removed
@@ -0,0 +1,50 @@
+from .depgraph import DependencyIndex, analyze, find_edited
+from .journal import JournalEntry
+
+
+def test_declared_and_referenced_names():
+    assert analyze('int a = 1, b;') == ({'a', 'b'}, {'a', 'b'})
+    assert analyze('struct S { int x; };')[0] == {'S'}
+    assert analyze('template <typename T> T add(T a, T b) { return a + b; }')[0] == {'add'}
+    assert analyze('std::vector<int> v{1, 2};')[0] == {'v'}
+    assert analyze('enum Color { red, green = 2 };')[0] == {'Color', 'red', 'green'}
+    assert analyze('#define N 3\nusing V = std::array<int, N>;')[0] == {'N', 'V'}
+    # expression statements declare nothing
+    for code in ('a = 5;', 'f(1);', 'delete p;', 'x.y = 2;', 'std::cout << a << std::endl;', 'void S::g() {}'):
+        assert analyze(code)[0] == set(), code
+    # a using-directive only makes names visible
+    assert analyze('#include <iostream>\nusing namespace std;')[0] == set()
+    # names in comments and strings are not used
+    assert analyze('const char* s = "int z = q;"; // w\n/* r */')[1] == {'s'}
+
+
+def test_plan_replays_every_cell_that_does_more_than_print():
+    codes = ['struct P { int x; };', 'int other = 1;', 'int h(int v) { return v; }', 'P p{h(1)};', 'int q = p.x;',
+             'int r = other;', 'std::cout << other;', 'std::cout << "done" << std::endl;']
+    # the new clang-repl needs other, h and r too, in their order; only the cell that prints a literal is left out
+    assert DependencyIndex(codes).plan(0, 'struct P { int x, y; };') == ([], [1, 2, 3, 4, 5, 6], [7], [3, 4])
+    # the new code may use a cell that comes later
+    assert DependencyIndex(codes).plan(0, 'struct P { int x = other; };') == ([1], [2, 3, 4, 5, 6], [7], [3, 4])
+    # a header and a using-directive declare no name but are replayed
+    codes = ['#include <iostream>\nusing namespace std;', 'int helper() { return 1; }', 'struct S { int a; };',
+             'int y = helper();']
+    assert DependencyIndex(codes).plan(2, 'struct S { int a, b; };') == ([0, 1], [3], [], [])
+
+
+def test_plan_replays_assignments_and_method_calls():
+    codes = ['#include <vector>', 'int a = 1;', 'std::vector<int> v;', 'a = 5;', 'v.push_back(3);', 'std::srand(1);',
+             'struct P { int x; };']
+    # none of them declares a name, each changes the session
+    assert DependencyIndex(codes).plan(6, 'struct P { int x, y; };') == ([0, 1, 2, 3, 4, 5], [], [], [])
+    assert DependencyIndex(codes).plan(1, 'int a = 2;') == ([0], [2, 3, 4, 5, 6], [], [3])
+
+
+def test_edited_cell_by_id_or_redefinition():
+    entries = [JournalEntry('int a = 1;', 0.1, 'x'), JournalEntry('int b = a;', 0.1, 'y')]
+    assert find_edited(entries, 'int b = 2;', 'y') == 1
+    assert find_edited(entries, 'int a = 3;', None) == 0
+    assert find_edited(entries, 'int c = 3;', 'z') is None
+    # a second using-directive and an overload are new cells, not edits
+    entries = [JournalEntry('using namespace std;', 0.1), JournalEntry('void f(int v) {}', 0.1)]
+    assert find_edited(entries, 'using namespace std;\nint z;', None) is None
+    assert find_edited(entries, 'void f(double v) {}', None) is None
@@ -0,0 +1,43 @@
+import os
+import zipfile
+
+import pytest
+
+from .extract import extract_parallel, write_marker
+
+
+def test_parallel_extraction(tmp_path):
+    bundle = tmp_path / 'bundle.zip'
+    contents = {'bin/clang-repl': b'\x7fELF' * 1000, 'lib/libc++.so': os.urandom(3 * 1024 * 1024),
+                'include/c++/v1/vector': b'#pragma once\n', 'empty/': b''}
+    with zipfile.ZipFile(bundle, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, data in contents.items():
+            zip_ref.writestr(name, data)
+    extracted = []
+    timings = extract_parallel(str(bundle), str(tmp_path / 'out'), workers=3, progress=extracted.append)
+    for name, data in contents.items():
+        if name.endswith('/'):
+            assert os.path.isdir(tmp_path / 'out' / name)
+        else:
+            assert (tmp_path / 'out' / name).read_bytes() == data
+    assert len(extracted) == timings['files'] == 3
+    assert set(timings) >= {'list', 'directories', 'extract'}
+    if os.name != 'nt':
+        assert os.access(tmp_path / 'out' / 'bin' / 'clang-repl', os.X_OK)
+        assert not os.access(tmp_path / 'out' / 'include' / 'c++' / 'v1' / 'vector', os.X_OK)
+
+
+def test_member_outside_of_target_is_refused(tmp_path):
+    bundle = tmp_path / 'bundle.zip'
+    with zipfile.ZipFile(bundle, 'w') as zip_ref:
+        zip_ref.writestr('../escape', b'x')
+    with pytest.raises(Exception, match='Refusing'):
+        extract_parallel(str(bundle), str(tmp_path / 'out'))
+    assert not (tmp_path / 'escape').exists()
+
+
+def test_marker_is_replaced_in_one_step(tmp_path):
+    write_marker(str(tmp_path / 'done'), 'first')
+    write_marker(str(tmp_path / 'done'), 'second')
+    assert (tmp_path / 'done').read_text() == 'second'
+    assert os.listdir(tmp_path) == ['done']
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from .fetch import RangedDownload, fetch
+
+DATA = bytes(range(256)) * 4099  # not a multiple of the part size
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        header = self.headers.get('Range')
+        with server.lock:
+            server.requests.append(header)
+        if header is None or not server.ranges:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(DATA)))
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+        start, end = (int(value) for value in header[len('bytes='):].split('-'))
+        end = min(end, len(DATA) - 1)
+        body = DATA[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(DATA)))
+        self.send_header('Content-Length', str(len(body)))
+        if server.etag:
+            self.send_header('ETag', '"v1"')
+        self.end_headers()
+        if start in server.stall_at:
+            # the server stops sending without closing the connection
+            server.stall_at.discard(start)
+            server.release.wait(5)
+            return
+        if start in server.cut_at and end > start:
+            # the connection drops in the middle of the range
+            server.cut_at.discard(start)
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.ranges = True
+    httpd.cut_at = set()
+    httpd.etag = True
+    httpd.stall_at = set()
+    httpd.release = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = 'http://127.0.0.1:%d/bundle.zip' % httpd.server_address[1]
+    yield httpd
+    httpd.release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_ranges_in_parallel(server, tmp_path):
+    progress = []
+    path = fetch(server.url, str(tmp_path / 'bundle.zip'), workers=4, part_size=100000, progress=progress.append)
+    assert read(path) == DATA
+    assert sum(progress) == len(DATA)
+    # the probe plus one request per part
+    assert len(server.requests) == 1 + (len(DATA) + 99999) // 100000
+    assert not os.path.exists(path + '.part') and not os.path.exists(path + '.part.json')
+
+
+def test_resume_after_interruption(server, tmp_path):
+    path = str(tmp_path / 'bundle.zip')
+    server.cut_at = {200000}
+    with pytest.raises(Exception):
+        RangedDownload(server.url, path, workers=2, part_size=100000, retries=0).run()
+    with open(path + '.part.json') as f:
+        done = json.load(f)['done']
+    assert len(done) > 0 and 2 not in done
+
+    server.requests.clear()
+    RangedDownload(server.url, path, workers=2, part_size=100000).run()
+    assert read(path) == DATA
+    # the parts finished before the interruption are not fetched again
+    fetched = server.requests[1:]
+    assert 'bytes=200000-299999' in fetched
+    assert all('bytes=%d-%d' % (idx * 100000, idx * 100000 + 99999) not in fetched for idx in done)
+    assert len(fetched) == 11 - len(done)
+
+
+def test_no_resume_without_a_validator(server, tmp_path):
+    path = str(tmp_path / 'bundle.zip')
+    server.etag = False
+    server.cut_at = {200000}
+    with pytest.raises(Exception):
+        RangedDownload(server.url, path, workers=2, part_size=100000, retries=0).run()
+
+    server.requests.clear()
+    RangedDownload(server.url, path, workers=2, part_size=100000).run()
+    assert read(path) == DATA
+    # the same size alone does not tell it is the same bundle, every part is fetched again
+    assert len(server.requests) == 1 + 11
+
+
+def test_stalled_range_is_retried(server, tmp_path):
+    server.stall_at = {100000}
+    path = RangedDownload(server.url, str(tmp_path / 'bundle.zip'), part_size=100000,
+                          timeout=(5, 0.5)).run()
+    assert read(path) == DATA
+    assert server.requests.count('bytes=100000-199999') == 2
+
+
+def test_retry_within_one_run(server, tmp_path):
+    server.cut_at = {0}
+    path = fetch(server.url, str(tmp_path / 'bundle.zip'), part_size=300000)
+    assert read(path) == DATA
+
+
+def test_single_stream_without_ranges(server, tmp_path):
+    server.ranges = False
+    sizes = []
+    path = fetch(server.url, str(tmp_path / 'dir' / 'bundle.zip'), on_size=sizes.append)
+    assert read(path) == DATA
+    assert sizes == [len(DATA)]
+    assert len(server.requests) == 1
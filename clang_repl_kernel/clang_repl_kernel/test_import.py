@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+# microseconds the modules of the package may spend on their own top level code, ipykernel excluded
+IMPORT_BUDGET_US = 150000
+# the installer's dependencies, a kernel launch must not load them
+INSTALLER_MODULES = ['requests', 'tqdm', 'xml.etree', 'clang_repl_kernel.downloader', 'clang_repl_kernel.install',
+                     'clang_repl_kernel.fetch', 'clang_repl_kernel.store']
+
+
+def import_times(statement):
+    # -X importtime reports 'import time: self [us] | cumulative | module' on stderr
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        fields = line[len('import time:'):].split('|')
+        if not line.startswith('import time:') or not fields[0].strip().isdigit():
+            continue
+        times[fields[2].strip()] = int(fields[0])
+    return times
+
+
+def test_kernel_launch_imports_no_installer():
+    times = import_times('import clang_repl_kernel, clang_repl_kernel.kernel')
+    assert 'clang_repl_kernel.kernel' in times
+    assert [module for module in INSTALLER_MODULES if module in times] == []
+    own = sum(us for module, us in times.items() if module.startswith('clang_repl_kernel'))
+    assert own < IMPORT_BUDGET_US, 'package import took %d us' % own
+
+
+def test_installer_names_resolve_on_use():
+    import clang_repl_kernel
+    from .install import install_bundles
+    from .downloader import download
+    assert clang_repl_kernel.install_bundles is install_bundles
+    assert clang_repl_kernel.download is download
@@ -0,0 +1,49 @@
+import json
+import os
+
+from . import ClangReplConfig
+from . import install as install_module
+
+
+def test_all_standards_in_one_pass(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(install_module, 'install_bundles', lambda *args, **kwargs: calls.append(args))
+    install_module.install(False, prefix=str(tmp_path), platform_system='Linux')
+    assert len(calls) == 1
+
+    kernels_dir = tmp_path / 'share' / 'jupyter' / 'kernels'
+    assert sorted(os.listdir(kernels_dir)) == ['clang_repl_cpp14', 'clang_repl_cpp17', 'clang_repl_cpp20',
+                                               'clang_repl_cpp23']
+    for version in ('14', '17', '20', '23'):
+        with open(kernels_dir / ('clang_repl_cpp' + version) / 'kernel.json') as f:
+            spec = json.load(f)
+        # every spec carries its own standard only
+        assert [arg for arg in spec['argv'] if arg.startswith('--std=')] == ['--std=c++' + version]
+        assert spec['display_name'] == 'Clang-Repl (C++' + version + ')'
+    assert install_module.kernel_json['argv'][-1] == '{connection_file}'
+
+
+def test_installed_executable_skips_the_scan(tmp_path, monkeypatch):
+    monkeypatch.setattr(ClangReplConfig, 'CLANG_BASE_DIR', str(tmp_path / 'clang'))
+    monkeypatch.setattr(ClangReplConfig, 'USER_DEFINED_BIN_PATH', ClangReplConfig.USER_DEFINED_BIN_PATH)
+    monkeypatch.setattr(ClangReplConfig, 'USER_DEFINED_INSTALL_PATH', ClangReplConfig.USER_DEFINED_INSTALL_PATH)
+
+    def fail(*args):
+        raise AssertionError('no scan or download expected')
+
+    monkeypatch.setattr(install_module, 'is_installed_clang_exist', fail)
+    monkeypatch.setattr(install_module, 'download', fail)
+    install_module.install_bundles('Linux', str(tmp_path / 'llvm' / 'bin' / 'clang-repl'))
+    with open(ClangReplConfig.get_install_clang_config_file()) as f:
+        assert f.read() == str(tmp_path / 'llvm' / 'bin') + os.sep
+
+
+def test_forced_install_sets_the_platform(tmp_path, monkeypatch):
+    monkeypatch.setattr(ClangReplConfig, 'CLANG_BASE_DIR', str(tmp_path / 'clang'))
+    monkeypatch.setattr(ClangReplConfig, 'USER_DEFINED_INSTALL_PATH', None)
+    monkeypatch.setattr(ClangReplConfig, '_platform', None)
+    monkeypatch.setattr(ClangReplConfig, 'PLATFORM_BIT', ClangReplConfig.PLATFORM_BIT)
+    calls = []
+    monkeypatch.setattr(install_module, 'download', lambda *args, **kwargs: calls.append(args))
+    install_module.install_bundles('Linux', force_install=True, lazy=False)
+    assert calls[0][:2] == ('Lin64.zip', str(tmp_path / 'clang' / 'Lin64'))
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import platform
 
@@ -12,6 +13,10 @@ def convert_result(result):
         return result
 
 
+def execute(kernel, code):
+    return asyncio.run(kernel.do_execute(code, False))
+
+
 @pytest.fixture
 def setup_dir():
     # set env export CPLUS_INCLUDE_PATH=/mnt/c/cling/jupyter/llvm-project_linux/build/lib/clang/18/include
@@ -26,6 +31,8 @@ def setup_dir():
 def kernel():
     ClangReplKernel.ClangReplKernel_InTest = True
     result = MockedKernel()
+    # the assertions below look at single lines
+    result.output_flush_interval = 0
     result.my_shell._prog = ClangReplConfig.get_bin_path()
     result.my_shell.run()
     return result
@@ -106,8 +113,8 @@ def test_new(setup_dir, kernel):
 
 def test_hello(setup_dir, kernel):
     # Run the kernel
-    kernel.do_execute('#include<iostream>\n', False)
-    kernel.do_execute('std::cout<< "hello, world" << std::endl\n', False)
+    execute(kernel, '#include<iostream>\n')
+    execute(kernel, 'std::cout<< "hello, world" << std::endl\n')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
@@ -117,8 +124,8 @@ def test_hello(setup_dir, kernel):
 def test_version(setup_dir, kernel):
     # Run the kernel
     #kernel.do_execute('#include<cstdio>\nprintf("%ld", __cplusplus);\n', False)
-    kernel.do_execute('#include<iostream>\n', False)
-    kernel.do_execute('std::cout<< __cplusplus << std::endl\n', False)
+    execute(kernel, '#include<iostream>\n')
+    execute(kernel, 'std::cout<< __cplusplus << std::endl\n')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
@@ -128,7 +135,7 @@ def test_version(setup_dir, kernel):
 @pytest.mark.skip(reason="currently printf is not working")
 def test_printf(setup_dir, kernel):
     # Run the kernel
-    kernel.do_execute('#include<cstdio>\nprintf("hello, world");\n', False)
+    execute(kernel, '#include<cstdio>\nprintf("hello, world");\n')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
@@ -138,7 +145,7 @@ def test_printf(setup_dir, kernel):
 def test_hello_two_line(setup_dir, kernel):
     # Run the kernel
     #kernel.do_execute('#include<cstdio>\nprintf("hello\\n");\nprintf("world\\n");\n', False)
-    kernel.do_execute('#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\n', False)
+    execute(kernel, '#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\n')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
@@ -149,7 +156,7 @@ def test_hello_two_line(setup_dir, kernel):
 def test_hello_three_line(setup_dir, kernel):
     # Run the kernel
     #kernel.do_execute('#include<cstdio>\nprintf("hello\\n");\nprintf("world\\n");\nprintf("!\\n");\n', False)
-    kernel.do_execute('#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\nstd::cout<< "!" << std::endl;\n', False)
+    execute(kernel, '#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\nstd::cout<< "!" << std::endl;\n')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
@@ -160,7 +167,7 @@ def test_hello_three_line(setup_dir, kernel):
 def test_hello_three_line_no_newline(setup_dir, kernel):
     # Run the kernel
     #kernel.do_execute('#include<cstdio>\nprintf("hello\\n");\nprintf("world\\n");\nprintf("!\\n");', False)
-    kernel.do_execute('#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\nstd::cout<< "!" << std::endl;', False)
+    execute(kernel, '#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\nstd::cout<< "!" << std::endl;')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
@@ -171,7 +178,7 @@ def test_hello_three_line_no_newline(setup_dir, kernel):
 def test_hello_three_line_multiple_newline(setup_dir, kernel):
     # Run the kernel
     #kernel.do_execute('#include<cstdio>\nprintf("hello\\n");\nprintf("world\\n");\n\nprintf("!\\n");\n', False)
-    kernel.do_execute('#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\n\nstd::cout<< "!" << std::endl;\n', False)
+    execute(kernel, '#include<iostream>\nstd::cout<< "hello" << std::endl;\nstd::cout<< "world" << std::endl;\n\nstd::cout<< "!" << std::endl;\n')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
@@ -181,8 +188,8 @@ def test_hello_three_line_multiple_newline(setup_dir, kernel):
 
 def test_builtin_out(setup_dir, kernel):
     # Run the kernel
-    kernel.do_execute('#include<iostream>\n', False)
-    kernel.do_execute('%<< "hello, world"\n', False)
+    execute(kernel, '#include<iostream>\n')
+    execute(kernel, '%<< "hello, world"\n')
     # assert kernel.execution_count == 1
     assert kernel.stream == kernel.iopub_socket
     assert kernel.msg_or_type == 'stream'
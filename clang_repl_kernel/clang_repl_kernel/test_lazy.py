@@ -0,0 +1,79 @@
+import os
+import zipfile
+
+import pytest
+
+from .lazy import LAZY_ZIP_NAME, LazyToolchain, cell_includes, open_lazy
+
+BUNDLE = {
+    'bin/clang-repl': b'\x7fELF',
+    'x86_64-linux-gnu/lib/libc++.so.1': b'\x7fELF',
+    'x86_64-linux-gnu/lib/libunwind.so': b'\x7fELF',
+    'x86_64-linux-gnu/include/c++/v1/iostream': b'#include <ostream>\n#include "__config"\n',
+    'x86_64-linux-gnu/include/c++/v1/ostream': b'#  include <cstdio>\n',
+    'x86_64-linux-gnu/include/c++/v1/__config': b'#pragma once\n',
+    'x86_64-linux-gnu/include/c++/v1/cstdio': b'#include_next <stdio.h>\n',
+    'x86_64-linux-gnu/include/c++/v1/vector': b'#include "__config"\n',
+    'x86_64-linux-gnu/include/stdio.h': b'#include <bits/types.h>\n#include <missing.h>\n',
+    'x86_64-linux-gnu/include/bits/types.h': b'\n',
+    'lib/clang/18/include/stddef.h': b'\n',
+    'share/man/clang.1': b'big',
+}
+
+
+@pytest.fixture
+def toolchain(tmp_path):
+    with zipfile.ZipFile(tmp_path / LAZY_ZIP_NAME, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, data in BUNDLE.items():
+            zip_ref.writestr(name, data)
+    return open_lazy(str(tmp_path))
+
+
+def extracted(root):
+    return sorted(os.path.relpath(os.path.join(dir_path, name), root).replace(os.sep, '/')
+                  for dir_path, _, names in os.walk(root) for name in names)
+
+
+def test_install_writes_manifest_and_bootstrap_closure(toolchain, tmp_path):
+    toolchain.install(['iostream'])
+    assert extracted(str(tmp_path)) == sorted([
+        LAZY_ZIP_NAME, 'done', 'lazy_trace.txt', 'bin/clang-repl', 'x86_64-linux-gnu/lib/libc++.so.1',
+        'x86_64-linux-gnu/lib/libunwind.so', 'x86_64-linux-gnu/include/c++/v1/iostream',
+        'x86_64-linux-gnu/include/c++/v1/ostream', 'x86_64-linux-gnu/include/c++/v1/__config',
+        'x86_64-linux-gnu/include/c++/v1/cstdio', 'x86_64-linux-gnu/include/stdio.h',
+        'x86_64-linux-gnu/include/bits/types.h', 'lib/clang/18/include/stddef.h'])
+    assert 'x86_64-linux-gnu/include/c++/v1/vector' not in toolchain.read_trace()
+    assert 'x86_64-linux-gnu/lib/libc++.so.1' not in toolchain.read_trace()
+
+
+def test_headers_of_a_cell_are_extracted_once(toolchain, tmp_path):
+    toolchain.install()
+    assert not (tmp_path / 'x86_64-linux-gnu' / 'include' / 'c++' / 'v1' / 'vector').exists()
+    assert cell_includes('#include <vector>\n  # include "lib.h"\nint x;') == ['vector', 'lib.h']
+    assert sorted(toolchain.ensure_headers(['vector', 'lib.h'])) == ['x86_64-linux-gnu/include/c++/v1/__config',
+                                                                     'x86_64-linux-gnu/include/c++/v1/vector']
+    assert (tmp_path / 'x86_64-linux-gnu' / 'include' / 'c++' / 'v1' / 'vector').exists()
+    assert toolchain.ensure_headers(['vector']) == []
+
+    # a new install of the same toolchain takes the traced headers up front
+    other = tmp_path / 'other'
+    other.mkdir()
+    os.link(toolchain.zip_path, other / LAZY_ZIP_NAME)
+    LazyToolchain(str(other / LAZY_ZIP_NAME), str(other)).install(trace=toolchain.trace_path)
+    assert (other / 'x86_64-linux-gnu' / 'include' / 'c++' / 'v1' / 'vector').exists()
+
+
+def test_include_next_continues_after_the_including_root(tmp_path):
+    with zipfile.ZipFile(tmp_path / LAZY_ZIP_NAME, 'w') as zip_ref:
+        zip_ref.writestr('x86_64-linux-gnu/include/c++/v1/cstddef', b'#include <stddef.h>\n')
+        zip_ref.writestr('x86_64-linux-gnu/include/c++/v1/stddef.h', b'#include_next <stddef.h>\n')
+        zip_ref.writestr('lib/clang/18/include/stddef.h', b'\n')
+    toolchain = open_lazy(str(tmp_path))
+    assert toolchain.header_closure(['cstddef']) == {
+        'x86_64-linux-gnu/include/c++/v1/cstddef', 'x86_64-linux-gnu/include/c++/v1/stddef.h',
+        'lib/clang/18/include/stddef.h'}
+
+
+def test_full_install_is_not_lazy(tmp_path):
+    assert open_lazy(str(tmp_path)) is None
+    assert open_lazy(None) is None
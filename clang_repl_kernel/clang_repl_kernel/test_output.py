@@ -0,0 +1,102 @@
+from .output import DiagnosticScanner, OutputAggregator, OutputBudget
+
+
+class ManualClock:
+    def __init__(self):
+        self.timers = []
+
+    def schedule(self, delay, callback):
+        self.timers.append((delay, callback))
+
+    def fire(self):
+        timers, self.timers = self.timers, []
+        for _, callback in timers:
+            callback()
+
+
+def test_flush_after_window():
+    sent = []
+    clock = ManualClock()
+    aggregator = OutputAggregator(sent.append, max_bytes=1024, interval=0.05, schedule=clock.schedule)
+    aggregator.write('a')
+    aggregator.write('\nb')
+    assert sent == []
+    assert [delay for delay, _ in clock.timers] == [0.05]
+    clock.fire()
+    assert sent == ['a\nb']
+    aggregator.write('\nc')
+    aggregator.close()
+    assert sent == ['a\nb', '\nc']
+    assert (aggregator.lines_produced, aggregator.messages_sent) == (3, 2)
+
+
+def test_flush_on_byte_budget():
+    sent = []
+    clock = ManualClock()
+    aggregator = OutputAggregator(sent.append, max_bytes=4, interval=10, schedule=clock.schedule)
+    aggregator.write('ab')
+    aggregator.write('cd')
+    assert [delay for delay, _ in clock.timers] == [10, 0]
+    clock.fire()
+    assert sent == ['abcd']
+    aggregator.close()
+    assert sent == ['abcd']
+
+
+def test_full_buffer_schedules_one_flush():
+    sent = []
+    clock = ManualClock()
+    aggregator = OutputAggregator(sent.append, max_bytes=4, interval=10, schedule=clock.schedule)
+    for _ in range(100):
+        aggregator.write('line\n')
+    # the event loop is woken once for the immediate flush, not once per line
+    assert [delay for delay, _ in clock.timers] == [0]
+    clock.fire()
+    aggregator.write('par')
+    aggregator.write('t')
+    aggregator.close()
+    assert sent == ['line\n' * 100, 'part']
+    assert (aggregator.lines_produced, aggregator.messages_sent) == (101, 2)
+
+
+def test_without_scheduler_every_full_buffer_is_sent():
+    sent = []
+    aggregator = OutputAggregator(sent.append, max_bytes=0)
+    aggregator.write('a')
+    aggregator.write('\nb')
+    aggregator.close()
+    assert sent == ['a', '\nb']
+
+
+def test_budget_spills_remainder(tmp_path):
+    sent = []
+    budget = OutputBudget(sent.append, limit=5, spill_dir=str(tmp_path))
+    budget.write('abc')
+    budget.write('d가e')
+    budget.write('\nmore')
+    budget.close()
+    assert sent[:2] == ['abc', 'd']
+    assert str(budget.spilled_bytes) in sent[2] and budget.spill_path in sent[2]
+    with open(budget.spill_path, encoding='utf-8') as f:
+        assert f.read() == '가e\nmore'
+
+
+def test_budget_disabled():
+    sent = []
+    budget = OutputBudget(sent.append, limit=0)
+    budget.write('x' * 100)
+    budget.close()
+    assert sent == ['x' * 100]
+
+
+def test_diagnostic_split_across_writes():
+    sent = []
+    scanner = DiagnosticScanner(sent.append)
+    scanner.write('ran: error: is only text\nerror: invalid user input\ninput_line_3:1:1: err')
+    assert not scanner.failed
+    scanner.write('or: unknown type name\n')
+    assert scanner.failed and ''.join(sent).endswith('unknown type name\n')
+    assert scanner.failed
+    scanner = DiagnosticScanner(sent.append)
+    scanner.write('error: Parsing failed.\n')
+    assert scanner.failed
@@ -0,0 +1,78 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from .kernel import get_workaround_statements
+from .pch import PrecompiledPreamble, make_header, split_preamble
+
+# writes the file given after '-o', like clang does for a PCH
+FAKE_CLANG = """#!{python}
+import sys
+with open(sys.argv[sys.argv.index('-o') + 1], 'w') as f:
+    f.write('pch')
+"""
+
+
+def make_executable(path, text):
+    path.write_text(text)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+
+@pytest.fixture
+def toolchain(tmp_path):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    repl = make_executable(bin_dir / 'clang-repl', '')
+    make_executable(bin_dir / 'clang', FAKE_CLANG.format(python=sys.executable))
+    return repl, tmp_path / 'base'
+
+
+def test_split_preamble_keeps_definitions_in_jit():
+    declarations, runtime = split_preamble(get_workaround_statements())
+    assert all(statement.startswith('class ') for statement in declarations)
+    assert all(not statement.startswith('class ') for statement in runtime)
+    assert len(declarations) + len(runtime) == len(get_workaround_statements())
+    assert make_header(['cstdio'], ['struct A {};']) == '#include <cstdio>\nstruct A {};\n'
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="fake clang is a shell script")
+def test_build_once_and_rebuild_on_flag_change(toolchain):
+    repl, base_dir = toolchain
+    preamble = PrecompiledPreamble.for_program(repl, 'clang', ['-std=c++17'], 'Lin64', '#include <cstdio>\n', base_dir)
+    assert not preamble.is_valid()
+    assert preamble.ensure() == preamble.pch_path
+    assert preamble.is_valid()
+    assert preamble.repl_args() == ['--Xcc=-include-pch', '--Xcc=' + preamble.pch_path]
+
+    same = PrecompiledPreamble.for_program(repl, 'clang', ['-std=c++17'], 'Lin64', '#include <cstdio>\n', base_dir)
+    assert same.is_valid() and same.pch_path == preamble.pch_path
+
+    other = PrecompiledPreamble.for_program(repl, 'clang', ['-std=c++20'], 'Lin64', '#include <cstdio>\n', base_dir)
+    assert other.pch_path != preamble.pch_path
+    assert not other.is_valid()
+
+    preamble.mark_failed('rejected')
+    assert preamble.ensure() is None
+
+
+def test_no_pch_without_sibling_clang(tmp_path):
+    assert PrecompiledPreamble.for_program(str(tmp_path / 'clang-repl'), 'clang', [], 'Lin64', '', tmp_path) is None
+
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="fake clang is a shell script")
+def test_unwritable_cache_falls_back_to_parsing(toolchain, monkeypatch):
+    repl, base_dir = toolchain
+    preamble = PrecompiledPreamble.for_program(repl, 'clang', [], 'Lin64', '#include <cstdio>\n', base_dir)
+
+    def denied(*args, **kwargs):
+        raise PermissionError('read-only cache')
+
+    # a cache directory owned by another user
+    monkeypatch.setattr(os, 'makedirs', denied)
+    assert preamble.ensure() is None
+    preamble.mark_failed('rejected')
+    assert not preamble.is_failed()
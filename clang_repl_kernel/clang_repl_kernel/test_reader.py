@@ -0,0 +1,97 @@
+import os
+import threading
+
+from .reader import ChunkReader, LineSender, PromptMatcher, utf8_boundary
+
+BANNER = b'clang-repl> '
+BANNER_CONT = b'clang-repl...   '
+
+
+def make_reader(chunks, chunk_size=7):
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(b''.join(chunks))
+
+    # more than a pipe buffer worth of data blocks until the reader drains it
+    threading.Thread(target=write, daemon=True).start()
+    return ChunkReader(read_fd, [BANNER, BANNER_CONT], chunk_size=chunk_size)
+
+
+def collect(reader):
+    outputs = []
+    prompt = reader.read_until_prompt(lambda text, complete: outputs.append((text, complete)))
+    return prompt, outputs
+
+
+def test_matcher_earliest_prompt():
+    matcher = PromptMatcher([BANNER, BANNER_CONT])
+    assert matcher.search(b'abc' + BANNER_CONT + BANNER) == (3, BANNER_CONT)
+    assert matcher.search(b'abc') == (-1, None)
+    assert matcher.resume_from(100) == 100 - len(BANNER_CONT) + 1
+
+
+def test_prompt_split_across_chunks():
+    # chunk size smaller than the prompt forces every prompt to straddle reads
+    reader = make_reader([b'hello\nworld\n', BANNER])
+    prompt, outputs = collect(reader)
+    assert prompt == BANNER
+    assert ''.join(text for text, _ in outputs) == 'hello\nworld\n'
+    assert all(complete for _, complete in outputs)
+
+
+def test_fragment_before_prompt_and_leftover():
+    reader = make_reader([BANNER_CONT, b'partial', BANNER, b'next\n', BANNER], chunk_size=4096)
+    assert collect(reader) == (BANNER_CONT, [])
+    assert collect(reader) == (BANNER, [('partial', False)])
+    assert collect(reader) == (BANNER, [('next\n', True)])
+
+
+def test_end_of_stream():
+    reader = make_reader([b'line\ntail'])
+    prompt, outputs = collect(reader)
+    assert prompt is None
+    assert outputs[-1] == ('tail', False)
+    assert reader.eof
+
+
+def test_multibyte_text_split_across_chunks():
+    reader = make_reader(['한글\n'.encode('utf-8'), BANNER], chunk_size=1)
+    prompt, outputs = collect(reader)
+    assert prompt == BANNER
+    assert ''.join(text for text, _ in outputs) == '한글\n'
+
+
+def test_line_sender_keeps_line_protocol():
+    sent = []
+    sender = LineSender(sent.append)
+    sender('hello\r\nworld\n', True)
+    sender('\n', True)
+    sender('!', False)
+    assert sent == ['hello', '\r\nworld', '\n', '\n!']
+    sender(' continued\n', True)
+    assert sent[-1] == ' continued'
+
+
+def test_long_line_is_emitted_in_fragments():
+    text = ('가' * 100000).encode('utf-8')
+    reader = make_reader([text, b'\n', BANNER], chunk_size=4096)
+    reader.max_pending = 8192
+    largest = [0]
+
+    def on_output(out, complete):
+        largest[0] = max(largest[0], len(reader.buffer))
+        outputs.append(out)
+
+    outputs = []
+    assert reader.read_until_prompt(on_output) == BANNER
+    assert ''.join(outputs) == '가' * 100000 + '\n'
+    assert len(outputs) > 10
+    assert largest[0] <= 8192 + 4096
+
+
+def test_utf8_boundary():
+    data = 'a가'.encode('utf-8')
+    assert utf8_boundary(data, 2) == 1
+    assert utf8_boundary(data, 1) == 1
@@ -0,0 +1,71 @@
+import os
+import subprocess
+
+import pytest
+
+from . import ClangReplConfig
+from . import kernel as kernel_module
+from .resolver import ResolveCache
+
+
+@pytest.fixture
+def toolchain(tmp_path, monkeypatch):
+    # a bundled toolchain in a private clang dir, a private cache, and no way to start a process
+    base_dir = tmp_path / 'clang'
+    bin_dir = base_dir / 'Lin64' / 'bin'
+    bin_dir.mkdir(parents=True)
+    (base_dir / 'Lin64' / 'done').write_text('done')
+    binary = bin_dir / 'clang-repl'
+    binary.write_text('#!/bin/sh\n')
+    binary.chmod(0o755)
+    monkeypatch.setattr(ClangReplConfig, 'CLANG_BASE_DIR', str(base_dir))
+    monkeypatch.setattr(ClangReplConfig, 'RESOLVE_CACHE_FILE', str(tmp_path / 'cache' / 'resolved.json'))
+    monkeypatch.setattr(ClangReplConfig, 'USER_DEFINED_BIN_PATH', None)
+    monkeypatch.setattr(ClangReplConfig, 'USER_DEFINED_INSTALL_PATH', None)
+    monkeypatch.setattr(ClangReplConfig, '_platform', ClangReplConfig._platform)
+    monkeypatch.setattr(ClangReplConfig, 'PLATFORM_BIT', ClangReplConfig.PLATFORM_BIT)
+    monkeypatch.setattr(kernel_module.platform, 'system', lambda: 'Linux')
+
+    def no_process(*args, **kwargs):
+        raise AssertionError('no process may be started to find the toolchain')
+
+    monkeypatch.setattr(subprocess, 'Popen', no_process)
+    return binary
+
+
+def test_resolution_is_cached_until_the_install_changes(toolchain, monkeypatch):
+    resolved = kernel_module.resolve_toolchain('clang-repl')
+    assert resolved['prog'] == str(toolchain) and resolved['tool_found'] is False
+    assert resolved['cpp_include'].endswith(os.path.join('include', 'c++', 'v1'))
+
+    calls = []
+    original = kernel_module._resolve_toolchain
+    monkeypatch.setattr(kernel_module, '_resolve_toolchain', lambda binary: calls.append(binary) or original(binary))
+    assert kernel_module.resolve_toolchain('clang-repl') == resolved
+    assert calls == []
+
+    # a reinstall rewrites the binary
+    stat = os.stat(toolchain)
+    os.utime(toolchain, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert kernel_module.resolve_toolchain('clang-repl') == resolved
+    assert calls == ['clang-repl']
+
+
+def test_program_on_path_is_found_in_process(tmp_path, monkeypatch):
+    path_dir = tmp_path / 'path'
+    path_dir.mkdir()
+    (path_dir / 'my-repl').write_text('#!/bin/sh\n')
+    (path_dir / 'my-repl').chmod(0o755)
+    monkeypatch.setenv('PATH', str(path_dir))
+    assert kernel_module.find_prog('my-repl') == (str(path_dir / 'my-repl'), True)
+    assert kernel_module.find_prog('missing-repl') == (None, False)
+
+
+def test_unreadable_cache_counts_as_empty(tmp_path):
+    cache = ResolveCache(str(tmp_path / 'resolved.json'))
+    (tmp_path / 'resolved.json').write_text('{not json')
+    assert cache.get('key') is None
+    cache.put('key', {'prog': 'x'}, [str(tmp_path / 'missing')])
+    assert cache.get('key') == {'prog': 'x'}
+    (tmp_path / 'missing').write_text('now there')
+    assert cache.get('key') is None
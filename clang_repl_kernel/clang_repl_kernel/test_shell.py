@@ -0,0 +1,407 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from . import ClangReplKernel, ClangReplConfig, Shell
+from .fake_repl import make_shell
+from .journal import parse_restart_magic
+from .lazy import LAZY_ZIP_NAME, open_lazy
+from .pool import ShellPool
+from .watchdog import Watchdog
+
+
+def test_split_command():
+    assert Shell.split_command('int a = 1;\n\nint b = 2;') == ['int a = 1;\\\n', 'int b = 2;\n']
+    assert Shell.split_command('#include <cstdio>\\\nint a;\\\n') == ['#include <cstdio>\n', 'int a;\n']
+    assert Shell.split_command('\n\n') == []
+
+
+def test_multi_line_cell(shell):
+    output = shell.do_execute_sync('int a = 1;\nint b = 2;\nint c = 3;')
+    assert output == 'ran: int a = 1;int b = 2;int c = 3;'
+
+
+def test_large_cell_does_not_deadlock(shell):
+    lines = ['int v%d = %d;' % (idx, idx) for idx in range(5000)]
+    output = shell.do_execute_sync('\n'.join(lines))
+    assert output == 'ran: ' + ''.join(lines)
+    assert shell.do_execute_sync('int after = 0;') == 'ran: int after = 0;'
+
+
+def test_pool_hands_over_bootstrapped_shell():
+    pool = ShellPool(make_shell, size=1)
+    first = pool.acquire()
+    assert pool.wait_ready(30) == 1
+    second = pool.acquire()
+    assert second is not first and second.is_alive()
+    assert second.do_execute_sync('int a;') == 'ran: int a;'
+    pool.wait_ready(30)
+    assert pool.stats() == {'size': 1, 'ready': 1, 'hits': 1, 'misses': 1, 'failures': 0}
+    pool.close()
+    first.kill()
+    second.kill()
+    assert pool.stats()['ready'] == 0
+
+
+def test_bootstrap_failure_reports_steps(fake_shell):
+    with pytest.raises(Exception) as e:
+        fake_shell('--crash-on', '#include <cstdio>')
+    report = str(e.value)
+    assert report.startswith('clang-repl bootstrap failed')
+    assert '[ok     ]' in report
+    assert '[failed ]' in report and '#include <cstdio>' in report
+    assert '[not run]' in report
+
+
+def make_kernel(shell, flush_interval=0.05, shell_factory=make_shell):
+    kernel = ClangReplKernel(shell=shell, shell_factory=shell_factory)
+    kernel.output_flush_interval = flush_interval
+    kernel.output_limit = 0
+    return kernel
+
+
+def test_async_execute_keeps_event_loop_free(shell):
+    kernel = make_kernel(shell)
+    outputs = []
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        reply = await kernel.do_execute('sleep();', False, custom_send_response=outputs.append)
+        ticker.cancel()
+        return reply, ticks
+
+    reply, ticks = asyncio.run(run())
+    assert reply['status'] == 'ok'
+    assert outputs == ['ran: sleep();']
+    assert ticks >= 5
+
+
+@pytest.mark.parametrize('flush_interval', [0, 0.05])
+def test_output_is_coalesced(shell, flush_interval):
+    kernel = make_kernel(shell, flush_interval)
+    outputs = []
+    asyncio.run(kernel.do_execute('lines(20000);', False, custom_send_response=outputs.append))
+    expected = '\n'.join(['line %d' % idx for idx in range(20000)] + ['ran: lines(20000);'])
+    assert ''.join(outputs) == expected
+    assert kernel.output_lines_produced == 20001
+    assert kernel.output_messages_sent == len(outputs)
+    if flush_interval > 0:
+        assert len(outputs) < 20
+    else:
+        assert len(outputs) == 20001
+
+
+def test_output_over_limit_is_spilled(shell, tmp_path):
+    kernel = make_kernel(shell, 0.05)
+    kernel.output_limit = 1000
+    outputs = []
+    asyncio.run(kernel.do_execute('lines(1000);', False, custom_send_response=outputs.append))
+    text = ''.join(outputs)
+    shown, notice = text[:1000], text[1000:]
+    expected = '\n'.join(['line %d' % idx for idx in range(1000)] + ['ran: lines(1000);'])
+    assert expected.startswith(shown)
+    path = notice[notice.rindex(' ') + 1:-1]
+    with open(path, encoding='utf-8', newline='') as f:
+        assert shown + f.read() == expected
+    os.remove(path)
+
+
+def test_spill_is_closed_when_the_cell_fails(shell, monkeypatch):
+    kernel = make_kernel(shell)
+    kernel.output_limit = 10
+
+    def broken_pipe(code, send_response, timeout):
+        send_response('x' * 25)
+        raise OSError('pipe closed')
+
+    monkeypatch.setattr(kernel.my_shell, 'do_execute', broken_pipe)
+    outputs = []
+    with pytest.raises(OSError):
+        kernel.execute_code('int a;', outputs.append)
+    assert outputs[0] == 'x' * 10 and 'the remaining 15 bytes were written to' in outputs[1]
+    path = outputs[1][outputs[1].rindex(' ') + 1:-1]
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == 'x' * 15
+    os.remove(path)
+    shell.kill()
+
+
+def test_corrupt_lazy_bundle_is_an_error_reply(shell, tmp_path):
+    kernel = make_kernel(shell)
+    (tmp_path / LAZY_ZIP_NAME).write_bytes(b'not a zip')
+    kernel.lazy_toolchain = open_lazy(str(tmp_path))
+    reply = kernel.execute_code('#include <vector>', lambda msg: None)
+    assert reply['status'] == 'error' and reply['ename'] == 'LazyExtractError'
+    shell.kill()
+
+
+def interrupt_later(a_shell, delay=0.3):
+    def _interrupt():
+        time.sleep(delay)
+        a_shell.interrupt()
+
+    thread = threading.Thread(target=_interrupt, daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="SIGINT delivery to a process group")
+def test_interrupt_resynchronizes_on_prompt(shell):
+    thread = interrupt_later(shell)
+    assert shell.do_execute_sync('hang_survive();') == ''
+    thread.join()
+    assert shell.interrupted
+    assert shell.do_execute_sync('int a;') == 'ran: int a;'
+    assert not shell.interrupted
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="SIGINT delivery to a process group")
+def test_interrupt_that_stops_the_repl_restarts_it(shell):
+    kernel = make_kernel(shell)
+    interrupt_later(shell)
+    outputs = []
+    reply = asyncio.run(kernel.do_execute('hang();', False, custom_send_response=outputs.append))
+    assert reply['status'] == 'error' and reply['ename'] == 'KeyboardInterrupt'
+    assert outputs == []
+    assert kernel.my_shell is not shell and kernel.my_shell.is_alive()
+    assert kernel.my_shell.do_execute_sync('int a;') == 'ran: int a;'
+    kernel.my_shell.kill()
+
+
+def test_interrupt_when_idle_is_ignored(shell):
+    assert not shell.interrupt()
+    assert shell.do_execute_sync('int a;') == 'ran: int a;'
+
+
+def test_watchdog_kills_after_grace():
+    calls = []
+    watchdog = Watchdog(0.05, lambda: calls.append('interrupt'), lambda: calls.append('kill'), grace=0.05).start()
+    time.sleep(0.3)
+    watchdog.cancel()
+    assert calls == ['interrupt', 'kill']
+    assert watchdog.expired and watchdog.killed
+
+    watchdog = Watchdog(1, lambda: calls.append('late'), lambda: calls.append('late')).start()
+    watchdog.cancel()
+    assert not watchdog.expired and 'late' not in calls
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="SIGINT delivery to a process group")
+def test_timeout_interrupts_the_cell(shell):
+    kernel = make_kernel(shell)
+    reply = kernel.execute_code('%timeout 0.3\nhang_survive();', lambda msg: None)
+    assert reply['status'] == 'error' and reply['ename'] == 'TimeoutError'
+    assert kernel.my_shell is shell and shell.elapsed >= 0.3
+    assert kernel.execute_code('int a;', lambda msg: None)['status'] == 'ok'
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="SIGINT delivery to a process group")
+def test_timeout_that_stops_the_repl_restarts_it(shell):
+    kernel = make_kernel(shell)
+    kernel.cell_timeout = 0.3
+    reply = kernel.execute_code('hang();', lambda msg: None)
+    assert reply['status'] == 'error' and reply['ename'] == 'TimeoutError'
+    assert kernel.my_shell is not shell and kernel.my_shell.is_alive()
+    kernel.my_shell.kill()
+
+
+def test_timeout_magic_usage():
+    assert ClangReplKernel.parse_timeout_magic('%timeout 2.5\nint a;') == (2.5, 'int a;')
+    assert ClangReplKernel.parse_timeout_magic('int a;') == (None, 'int a;')
+    with pytest.raises(ValueError):
+        ClangReplKernel.parse_timeout_magic('%timeout soon\nint a;')
+
+
+def test_cell_metrics_and_stats_magic(shell):
+    kernel = make_kernel(shell)
+    reply = asyncio.run(kernel.do_execute('lines(3); sleep();', False, custom_send_response=lambda msg: None))
+    assert reply['status'] == 'ok'
+    metrics = kernel.finish_metadata({}, {}, reply)['clang_repl_metrics']
+    assert 0 <= metrics['first_byte'] <= metrics['prompt'] <= metrics['kernel_wall']
+    assert metrics['prompt'] >= 0.2
+    assert metrics['output_lines'] == 4 and metrics['output_bytes'] > 0
+    if sys.platform.startswith('linux'):
+        assert metrics['cpu'] >= 0 and metrics['rss'] > 0
+
+    outputs = []
+    asyncio.run(kernel.do_execute('%stats', False, custom_send_response=outputs.append))
+    report = ''.join(outputs)
+    assert report.startswith('cells: 1\n')
+    assert '100ms - 1s        1 #' in report
+    assert 'shell pool' in report
+
+
+def test_partial_writes_are_reassembled(fake_shell):
+    a_shell = fake_shell('--chunk', '3', '--latency', '0.01')
+    assert a_shell.do_execute_sync('lines(2);') == 'line 0\nline 1\nran: lines(2);'
+    assert a_shell.do_execute_sync('bytes(5);') == 'xxxxxran: bytes(5);'
+    assert a_shell.do_execute_sync('int a = 1;\nint b = 2;') == 'ran: int a = 1;int b = 2;'
+
+
+def test_crash_restarts_the_repl(shell):
+    kernel = make_kernel(shell)
+    reply = kernel.execute_code('crash(3);', lambda msg: None)
+    assert reply['status'] == 'error' and reply['ename'] == 'ClangReplExited'
+    assert kernel.my_shell is not shell
+    assert kernel.my_shell.do_execute_sync('int a;') == 'ran: int a;'
+    kernel.my_shell.kill()
+
+
+def test_first_cell_waits_for_background_bootstrap(monkeypatch):
+    monkeypatch.setattr(ClangReplConfig, 'BOOTSTRAP_PROGRESS_INTERVAL', 0.05)
+    template = make_shell('--latency', '0.05')
+    kernel = make_kernel(template, shell_factory=lambda: make_shell('--latency', '0.05'))
+    started = time.perf_counter()
+    kernel.start_bootstrap()
+    # the kernel is free to answer requests while clang-repl boots
+    assert time.perf_counter() - started < 0.05 and not kernel.shell_ready.is_set()
+
+    status, output = [], []
+    reply = kernel.execute_code('int a;', output.append, status.append)
+    assert reply['status'] == 'ok' and ''.join(output) == 'ran: int a;'
+    assert status[0].startswith('Starting clang-repl') and status[-1].startswith('clang-repl is ready')
+    assert kernel.my_shell is not template and kernel.bootstrap_time > 0
+    kernel.my_shell.kill()
+
+
+def test_failed_bootstrap_is_reported_and_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Exception('no toolchain')
+        return make_shell()
+
+    kernel = make_kernel(make_shell(), shell_factory=factory)
+    kernel.start_bootstrap()
+    reply = kernel.execute_code('int a;', lambda msg: None)
+    assert reply['status'] == 'error' and reply['ename'] == 'ClangReplStartError' and 'no toolchain' in reply['evalue']
+    output = []
+    assert kernel.execute_code('int a;', output.append)['status'] == 'ok'
+    assert ''.join(output) == 'ran: int a;' and len(attempts) == 2
+    kernel.my_shell.kill()
+
+
+def test_failed_restart_is_reported_by_the_next_cell(shell):
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Exception('no toolchain')
+        return make_shell()
+
+    kernel = make_kernel(shell, shell_factory=factory)
+    assert kernel.do_shutdown(True) == {'status': 'ok', 'restart': True}
+    reply = kernel.execute_code('int a;', lambda msg: None)
+    assert reply['ename'] == 'ClangReplStartError' and 'no toolchain' in reply['evalue']
+    output = []
+    assert kernel.execute_code('int a;', output.append)['status'] == 'ok'
+    assert ''.join(output) == 'ran: int a;' and len(attempts) == 2
+    kernel.my_shell.kill()
+
+
+def test_restart_replays_the_journal(shell):
+    kernel = make_kernel(shell)
+    for cell in ('int a = 1;', 'int b = 2;\nint c = 3;', '%<< a', 'crash(3);'):
+        kernel.execute_code(cell, lambda msg: None)
+    # the crash lost the session, the print cell and the crashing cell are not journaled
+    assert [entry.code for entry in kernel.journal.cells] == ['int a = 1;', 'int b = 2;\nint c = 3;']
+
+    output = []
+    replayed = []
+    kernel.shell_pool = ShellPool(lambda: replayed.append(make_shell()) or replayed[-1], 0)
+    assert kernel.execute_code('%restart --replay', output.append)['status'] == 'ok'
+    assert output[0].startswith('Replayed 2 cells in ')
+    assert len(replayed) == 1 and kernel.my_shell is replayed[0]
+    # the cells went to the new clang-repl, their output did not go to the cell
+    assert kernel.my_shell.metrics.output_bytes > 0 and len(output) == 1
+
+    output.clear()
+    assert kernel.execute_code('%restart', output.append)['status'] == 'ok'
+    assert output == ['clang-repl restarted\n'] and len(kernel.journal) == 0
+    kernel.my_shell.kill()
+    for a_shell in replayed:
+        a_shell.kill()
+
+
+def test_rejected_cell_is_not_journaled(shell):
+    kernel = make_kernel(shell)
+    output = []
+    assert kernel.execute_code('int a = 1;', output.append)['status'] == 'ok'
+    assert kernel.execute_code('fail b = 2;', output.append)['status'] == 'ok'
+    assert 'error: Parsing failed.' in ''.join(output)
+    assert [entry.code for entry in kernel.journal.cells] == ['int a = 1;']
+    # a program that prints an error message of its own ran fine
+    output.clear()
+    assert kernel.execute_code('print(error: invalid user input);', output.append)['status'] == 'ok'
+    assert ''.join(output).startswith('error: invalid user input\n')
+    assert [entry.code for entry in kernel.journal.cells] == ['int a = 1;', 'print(error: invalid user input);']
+    kernel.my_shell.kill()
+
+
+def test_failed_edit_keeps_the_cells_that_do_not_use_it(shell):
+    started = []
+    kernel = make_kernel(shell, shell_factory=lambda: started.append(make_shell()) or started[-1])
+    for count, (cell_id, code) in enumerate([('x', 'int a = 1;'), ('y', 'int b = a;'), ('z', 'int c = 3;')], 1):
+        kernel.execution_count = count
+        kernel.execute_code(code, lambda msg: None, cell_id=cell_id)
+    kernel.execution_count = 4
+    status = []
+    kernel.execute_code('fail a = 2;', lambda msg: None, status.append, cell_id='x')
+    assert 'replayed none before it and In [3] after it' in status[0]
+    assert 'the new code failed, In [2] that use it were not replayed' in status[0]
+    assert [entry.code for entry in kernel.journal.cells] == ['int c = 3;']
+    for a_shell in started:
+        a_shell.kill()
+
+
+def test_restart_magic_usage():
+    assert parse_restart_magic('int a;') is None
+    assert parse_restart_magic(' %restart ') is False
+    assert parse_restart_magic('%restart --replay\n') is True
+    kernel = make_kernel(make_shell())
+    assert kernel.execute_code('%restart now', lambda msg: None)['ename'] == 'UsageError'
+
+
+def test_edit_replays_only_dependent_cells(shell):
+    started = []
+    kernel = make_kernel(shell, shell_factory=lambda: started.append(make_shell()) or started[-1])
+    cells = [('a', 'struct Point { int x; };'), ('b', 'int unrelated = 1;'), ('c', 'int helper(int v) { return v; }'),
+             ('d', 'Point p{helper(2)};'), ('e', 'int q = p.x;'), ('f', 'std::cout << "sleep";')]
+    for count, (cell_id, code) in enumerate(cells, 1):
+        kernel.execution_count = count
+        assert kernel.execute_code(code, lambda msg: None, cell_id=cell_id)['status'] == 'ok'
+    assert started == []
+
+    kernel.execution_count = 7
+    status, output = [], []
+    reply = kernel.execute_code('struct Point { int x; int y; };', output.append, status.append, cell_id='a')
+    assert reply['status'] == 'ok' and ''.join(output) == 'ran: struct Point { int x; int y; };'
+    assert len(started) == 1 and kernel.my_shell is started[0]
+    # d uses Point, e uses p; b and c run again too, in their order; f only prints, which the fake REPL takes time for
+    assert status[0].startswith('Redefined In [1]: restarted clang-repl and replayed none before it and '
+                                'In [2], In [3], In [4], In [5] after it in ')
+    assert 'In [6] only printed and were not run again' in status[0]
+    assert [entry.execution_count for entry in kernel.journal.cells] == [7, 2, 3, 4, 5]
+
+    # a cell that defined nothing is replaced without a restart
+    kernel.execute_code('%<< q', lambda msg: None)
+    kernel.execute_code('q;', lambda msg: None, cell_id='g')
+    kernel.execute_code('q + 1;', lambda msg: None, cell_id='g')
+    assert len(started) == 1 and [entry.code for entry in kernel.journal.cells][-1] == 'q + 1;'
+    for a_shell in started:
+        a_shell.kill()
@@ -0,0 +1,105 @@
+import os
+import zipfile
+
+import pytest
+
+from .store import ToolchainStore, sha256_of
+
+
+def make_bundle(path, text='clang-repl'):
+    with zipfile.ZipFile(path, 'w') as zip_ref:
+        zip_ref.writestr('bin/clang-repl', text)
+        zip_ref.writestr('include/a.h', '#pragma once\n')
+    return str(path)
+
+
+def test_bundle_is_extracted_once_and_shared(tmp_path):
+    store = ToolchainStore(str(tmp_path / 'store'))
+    bundle = make_bundle(tmp_path / 'Lin64.zip')
+    digest = store.add(bundle, 'Lin64.zip', sha256_of(bundle))
+    assert store.add(bundle) == digest
+    assert store.lookup('Lin64.zip') == digest
+    assert os.listdir(store.bundles_dir) == [digest]
+
+    first, second = str(tmp_path / 'venv1' / 'Lin64'), str(tmp_path / 'venv2' / 'Lin64')
+    store.link(digest, first)
+    store.link(digest, second)
+    assert os.path.samefile(os.path.join(first, 'bin', 'clang-repl'), os.path.join(second, 'bin', 'clang-repl'))
+    assert os.path.exists(os.path.join(first, 'done'))
+    if os.name != 'nt':
+        assert os.access(os.path.join(first, 'bin', 'clang-repl'), os.X_OK)
+
+
+def test_checksum_mismatch(tmp_path):
+    store = ToolchainStore(str(tmp_path / 'store'))
+    with pytest.raises(Exception, match='Checksum mismatch'):
+        store.add(make_bundle(tmp_path / 'Lin64.zip'), expected_sha256='0' * 64)
+    assert store.lookup('Lin64.zip') is None
+
+
+def test_gc_keeps_linked_bundles(tmp_path):
+    store = ToolchainStore(str(tmp_path / 'store'))
+    old = store.add(make_bundle(tmp_path / 'old.zip', 'old'), 'Lin64.zip')
+    new = store.add(make_bundle(tmp_path / 'new.zip', 'new'), 'Lin64.zip')
+    store.link(old, str(tmp_path / 'venv1' / 'Lin64'))
+    store.link(new, str(tmp_path / 'venv2' / 'Lin64'))
+    assert store.gc() == []
+
+    # venv1 moved to the new bundle, nothing links to the old one anymore
+    store.link(new, str(tmp_path / 'venv1' / 'Lin64'))
+    assert store.gc() == [old]
+    assert store.lookup('Lin64.zip') == new
+    assert os.path.exists(os.path.join(str(tmp_path / 'venv1' / 'Lin64'), 'bin', 'clang-repl'))
+
+
+def test_download_goes_through_the_store(tmp_path, monkeypatch):
+    from . import downloader
+    downloads = []
+
+    def fake_download(extract_dir, file_name, file_url):
+        downloads.append(file_url)
+        return make_bundle(os.path.join(extract_dir, file_name))
+
+    monkeypatch.setattr(downloader, '_download', fake_download)
+    monkeypatch.setattr(downloader, '_expected_sha256', lambda file_url: None)
+    store_dir = str(tmp_path / 'store')
+    for venv in ('venv1', 'venv2'):
+        downloader.download('Lin64.zip', str(tmp_path / venv / 'clang' / 'Lin64'), store_dir)
+        assert downloader.is_done(str(tmp_path / venv / 'clang' / 'Lin64'))
+    assert len(downloads) == 1
+    assert os.listdir(os.path.join(store_dir, 'downloads')) == []
+
+
+def test_private_store_is_not_symlinked(tmp_path, monkeypatch):
+    store = ToolchainStore(str(tmp_path / 'store'))
+    digest = store.add(make_bundle(tmp_path / 'Lin64.zip'), 'Lin64.zip')
+    target = str(tmp_path / 'venv' / 'Lin64')
+    monkeypatch.setattr(ToolchainStore, '_readable_by_others', staticmethod(lambda path: False))
+    assert store.link(digest, target) == 'hardlink'
+    assert not os.path.islink(target)
+    assert os.path.samefile(os.path.join(target, 'bin', 'clang-repl'),
+                            os.path.join(store.bundle_dir(digest), 'bin', 'clang-repl'))
+
+    monkeypatch.setattr(ToolchainStore, '_readable_by_others', staticmethod(lambda path: True))
+    if os.name != 'nt':
+        assert store.link(digest, target) == 'symlink'
+        assert os.path.islink(target)
+
+
+def test_forced_download_skips_the_known_name(tmp_path, monkeypatch):
+    from . import downloader
+    downloads = []
+
+    def fake_download(extract_dir, file_name, file_url):
+        downloads.append(file_url)
+        return make_bundle(os.path.join(extract_dir, file_name), 'build %d' % len(downloads))
+
+    monkeypatch.setattr(downloader, '_download', fake_download)
+    monkeypatch.setattr(downloader, '_expected_sha256', lambda file_url: None)
+    store_dir = str(tmp_path / 'store')
+    target = str(tmp_path / 'venv' / 'clang' / 'Lin64')
+    downloader.download('Lin64.zip', target, store_dir)
+    downloader.download('Lin64.zip', target, store_dir, refresh=True)
+    assert len(downloads) == 2
+    with open(os.path.join(target, 'bin', 'clang-repl')) as f:
+        assert f.read() == 'build 2'
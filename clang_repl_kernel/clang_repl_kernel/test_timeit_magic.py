@@ -0,0 +1,37 @@
+import shutil
+import subprocess
+
+import pytest
+
+from . import ClangReplKernel
+from .timeit_magic import make_timeit_code, parse_timeit_options
+
+
+def test_parse_options():
+    assert parse_timeit_options('') == (0, 7)
+    assert parse_timeit_options(' -n 100 -r 3') == (100, 3)
+    for line in ['-n', '-x 1', '-n many', '-r 0']:
+        with pytest.raises(ValueError):
+            parse_timeit_options(line)
+
+
+def test_each_cell_gets_its_own_functions():
+    first = ClangReplKernel.transform_code('%%timeit -n 10\nint a = 1;')
+    second = ClangReplKernel.transform_code('%%timeit -n 10\nint a = 1;')
+    assert first != second
+    assert first.splitlines()[-1].endswith('();') and first.splitlines()[-1] not in second
+    with pytest.raises(ValueError):
+        ClangReplKernel.transform_code('%%timeit\n\n')
+
+
+@pytest.mark.skipif(shutil.which('c++') is None, reason="needs a C++ compiler")
+def test_generated_code_runs(tmp_path):
+    code = make_timeit_code('%%timeit -r 3\nvolatile int sum = 0;\nfor (int i = 0; i < 100; ++i) sum += i;', 1)
+    lines = code.splitlines()
+    # outside of clang-repl the top level call goes into main
+    source = tmp_path / 'timeit.cpp'
+    source.write_text('\n'.join(lines[:-1]) + '\nint main() { ' + lines[-1] + ' }\n')
+    subprocess.run(['c++', '-std=c++17', '-o', str(tmp_path / 'timeit'), str(source)], check=True)
+    output = subprocess.run([str(tmp_path / 'timeit')], check=True, capture_output=True, text=True).stdout
+    assert ' per loop (mean +- std. dev. of 3 runs, ' in output
+    assert output.rstrip().split()[-2:][1] in ('ns', 'us', 'ms', 's')
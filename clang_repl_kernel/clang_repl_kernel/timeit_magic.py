@@ -0,0 +1,84 @@
+import shlex
+
+# how long one calibration run must take before the loop count is accepted, like IPython's timeit
+CALIBRATION_SECONDS = 0.2
+DEFAULT_REPEAT = 7
+
+# The body is compiled as a function together with the timing code, so all code generation is done before the
+# first measurement. Without -n the loop count grows tenfold until one run takes CALIBRATION_SECONDS.
+TIMEIT_TEMPLATE = """#include <chrono>
+#include <cmath>
+#include <cstdio>
+void clang_repl_timeit_body_{uid}() {{
+{body}
+}}
+void clang_repl_timeit_format_{uid}(double seconds, char *buf) {{
+    const char *unit = "s";
+    if (seconds < 1e-6) {{ seconds *= 1e9; unit = "ns"; }}
+    else if (seconds < 1e-3) {{ seconds *= 1e6; unit = "us"; }}
+    else if (seconds < 1.0) {{ seconds *= 1e3; unit = "ms"; }}
+    std::snprintf(buf, 32, "%.3g %s", seconds, unit);
+}}
+double clang_repl_timeit_run_{uid}(long loops) {{
+    auto start = std::chrono::steady_clock::now();
+    for (long idx = 0; idx < loops; ++idx) clang_repl_timeit_body_{uid}();
+    return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+}}
+void clang_repl_timeit_{uid}() {{
+    long loops = {number};
+    if (loops <= 0) {{
+        loops = 1;
+        while (loops < 1000000000L && clang_repl_timeit_run_{uid}(loops) < {calibration}) loops *= 10;
+    }}
+    const int repeat = {repeat};
+    double per_loop[repeat];
+    double sum = 0, best = 0;
+    for (int run = 0; run < repeat; ++run) {{
+        per_loop[run] = clang_repl_timeit_run_{uid}(loops) / loops;
+        sum += per_loop[run];
+        if (run == 0 || per_loop[run] < best) best = per_loop[run];
+    }}
+    double mean = sum / repeat, variance = 0;
+    for (int run = 0; run < repeat; ++run) variance += (per_loop[run] - mean) * (per_loop[run] - mean);
+    char mean_text[32], stddev_text[32], best_text[32];
+    clang_repl_timeit_format_{uid}(mean, mean_text);
+    clang_repl_timeit_format_{uid}(std::sqrt(variance / repeat), stddev_text);
+    clang_repl_timeit_format_{uid}(best, best_text);
+    std::printf("%s +- %s per loop (mean +- std. dev. of %d run%s, %ld loop%s each), best %s\\n", mean_text,
+                stddev_text, repeat, repeat == 1 ? "" : "s", loops, loops == 1 ? "" : "s", best_text);
+    std::fflush(stdout);
+}}
+clang_repl_timeit_{uid}();"""
+
+
+def parse_timeit_options(line):
+    """Parses the '-n NUMBER -r REPEAT' options of a '%%timeit' line, returns (number, repeat); number 0 means
+    calibrate."""
+    number, repeat = 0, DEFAULT_REPEAT
+    args = shlex.split(line)
+    idx = 0
+    while idx < len(args):
+        option = args[idx]
+        if option not in ('-n', '-r') or idx + 1 == len(args):
+            raise ValueError('%%timeit [-n NUMBER] [-r REPEAT], got: ' + repr(line))
+        try:
+            value = int(args[idx + 1])
+        except ValueError:
+            raise ValueError('%%timeit ' + option + ' expects an integer, got: ' + repr(args[idx + 1]))
+        if value <= 0:
+            raise ValueError('%%timeit ' + option + ' must be positive')
+        if option == '-n':
+            number = value
+        else:
+            repeat = value
+        idx += 2
+    return number, repeat
+
+
+def make_timeit_code(code, uid):
+    """Turns a '%%timeit' cell into C++ that times its body inside the JIT and prints the result."""
+    first_line, _, body = code.lstrip().partition('\n')
+    number, repeat = parse_timeit_options(first_line[len('%%timeit'):])
+    if len(body.strip()) == 0:
+        raise ValueError('%%timeit needs a cell body to time')
+    return TIMEIT_TEMPLATE.format(uid=uid, body=body, number=number, repeat=repeat, calibration=CALIBRATION_SECONDS)
@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class Watchdog:
+    """Calls ``interrupt`` once ``timeout`` seconds have passed and ``kill`` if the run is still going ``grace``
+    seconds after that. ``cancel`` stops it when the run is over and records the elapsed time.
+    """
+
+    def __init__(self, timeout, interrupt, kill, grace=3.0):
+        self.timeout = timeout
+        self.interrupt = interrupt
+        self.kill = kill
+        self.grace = grace
+        self.expired = False
+        self.killed = False
+        self.started = None
+        self.elapsed = None
+        self._cancelled = False
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _start_timer(self, delay, callback):
+        self._timer = threading.Timer(delay, callback)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def start(self):
+        self.started = time.monotonic()
+        with self._lock:
+            self._start_timer(self.timeout, self._expire)
+        return self
+
+    def _expire(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self.expired = True
+            self._start_timer(self.grace, self._kill)
+        self.interrupt()
+
+    def _kill(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self.killed = True
+        self.kill()
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._timer is not None:
+                self._timer.cancel()
+        self.elapsed = time.monotonic() - self.started